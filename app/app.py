@@ -1,12 +1,31 @@
 from flask import Flask, render_template
 
+from assets import assets
+from dashboard import dashboard
+from ingest import ingest
 from login import LoginForm
+from queries import queries
 from register import RegistrationForm
+from serving import configure_production
 
-app = Flask(__name__)
+# templates and static files are in the root of the repository
+app = Flask(__name__, template_folder='../templates', static_folder='../static')
 
 app.config['SECRET_KEY'] = '322aaa35662adf0d1e0ecc141413994e'
 
+# reports sent by the monitoring devices
+app.config['REPORTS_DATABASE'] = 'reports.sqlite3'
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+app.register_blueprint(ingest)
+app.register_blueprint(dashboard)
+app.register_blueprint(queries)
+app.register_blueprint(assets)
+
+# precompiled templates, cached fragments and the precompressed assets of python assets.py build,
+# unless debugging (FLASK_DEBUG=1)
+if not app.debug:
+    configure_production(app)
+
 
 @app.route('/')
 @app.route('/login')
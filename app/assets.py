@@ -0,0 +1,189 @@
+"""
+Static asset pipeline: every file of static/ is copied to static/dist with the hash of its content in the
+name (main.css -> main.3f2a9c1b04de.css), next to its gzip (and brotli, if the brotli module is installed)
+precompressed versions, and listed in static/dist/manifest.json.
+The assets blueprint serves them from memory with far-future cache headers, choosing the encoding from
+Accept-Encoding; templates link them with asset_url(), which falls back to the plain static url (or to the
+CDN, for the vendored libraries) until the assets are built.
+
+    python assets.py fetch    # download the vendored libraries into static/vendor (needs internet, once)
+    python assets.py build    # build static/dist
+"""
+import base64
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import sys
+
+from flask import Blueprint, Response, current_app, request, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+static_folder = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static')
+dist_folder_name = 'dist'
+manifest_name = 'manifest.json'
+
+# libraries served from static/vendor on the site LAN, the CDN copies are used until they are fetched
+vendor_assets = {
+    'vendor/bootstrap.min.css': ('https://stackpath.bootstrapcdn.com/bootstrap/4.1.1/css/bootstrap.min.css',
+                                 'sha384-WskhaSGFgHYWDcbwN70/dfYBj47jz9qbsMId/iRN3ewGhXQFZCSftd1LZCfmhktB'),
+    'vendor/jquery-3.3.1.slim.min.js': ('https://code.jquery.com/jquery-3.3.1.slim.min.js',
+                                        'sha384-q8i/X+965DzO0rT7abK41JStQIAqVgRVzpbzo5smXKp4YfRvH+8abtTE1Pi6jizo'),
+    'vendor/popper.min.js': ('https://cdnjs.cloudflare.com/ajax/libs/popper.js/1.14.3/umd/popper.min.js',
+                             'sha384-ZMP7rVo3mIykV+2+9J3UJ46jBk0WLaUAdn689aCwoqbBJiSnjAK/l8WvCWPIPm49'),
+    'vendor/bootstrap.min.js': ('https://stackpath.bootstrapcdn.com/bootstrap/4.1.1/js/bootstrap.min.js',
+                                'sha384-smHYKdLADwkXOn1EmN1qk/HfnUcbVRZyYmZ4qpPea6sjB/pTJ0euyQp0Mk8ck+5T'),
+}
+
+# the versioned names never change content
+far_future_cache_control = 'public, max-age=31536000, immutable'
+
+# files smaller than this are not worth compressing
+min_compressed_size = 256
+
+# encodings of the precompressed files, in order of preference
+encodings = [('br', '.br'), ('gzip', '.gz')]
+
+assets = Blueprint('assets', __name__)
+
+
+def subresource_integrity(content):
+    return 'sha384-' + base64.b64encode(hashlib.sha384(content).digest()).decode('ascii')
+
+
+def fetch_vendor_assets(static=static_folder):
+    """Downloads the vendored libraries, checking them against their subresource integrity"""
+    import requests
+
+    for name, (url, integrity) in vendor_assets.items():
+        r = requests.get(url, timeout=30)
+        r.raise_for_status()
+        if subresource_integrity(r.content) != integrity:
+            raise ValueError('{} does not match its integrity {}'.format(url, integrity))
+        path = os.path.join(static, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as asset_file:
+            asset_file.write(r.content)
+        print("Fetched {} ({} bytes)".format(name, len(r.content)))
+
+
+def versioned_name(name, content):
+    root, extension = os.path.splitext(name)
+    return '{}.{}{}'.format(root, hashlib.sha256(content).hexdigest()[:12], extension)
+
+
+def build_assets(static=static_folder):
+    """Writes the versioned and precompressed copies of the static files and their manifest,
+    returns the manifest (name -> versioned name)"""
+    dist = os.path.join(static, dist_folder_name)
+    manifest = {}
+    for directory, directories, files in os.walk(static):
+        if os.path.abspath(directory) == os.path.abspath(static) and dist_folder_name in directories:
+            directories.remove(dist_folder_name)
+        for file_name in sorted(files):
+            path = os.path.join(directory, file_name)
+            name = os.path.relpath(path, static).replace(os.sep, '/')
+            with open(path, 'rb') as asset_file:
+                content = asset_file.read()
+            manifest[name] = versioned_name(name, content)
+
+            output_path = os.path.join(dist, manifest[name])
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            variants = [('', content)]
+            if len(content) >= min_compressed_size:
+                # mtime=0 so that the builds are reproducible
+                variants.append(('.gz', gzip.compress(content, compresslevel=9, mtime=0)))
+                if brotli is not None:
+                    variants.append(('.br', brotli.compress(content, quality=11)))
+            for suffix, data in variants:
+                with open(output_path + suffix, 'wb') as output_file:
+                    output_file.write(data)
+
+    with open(os.path.join(dist, manifest_name), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    return manifest
+
+
+class AssetStore(object):
+    """Built assets of static/dist, loaded in memory with their precompressed versions.
+    Without built (development) the static files are linked as they are"""
+
+    def __init__(self, static=static_folder, built=True):
+        self.static = static
+        self.manifest = {}
+        self.files = {}  # versioned name -> {encoding: content}, None for identity
+        self.local_vendor_assets = {name for name in vendor_assets if os.path.exists(os.path.join(static, name))}
+        dist = os.path.join(static, dist_folder_name)
+        manifest_path = os.path.join(dist, manifest_name)
+        if not built or not os.path.exists(manifest_path):
+            return
+        with open(manifest_path) as manifest_file:
+            self.manifest = json.load(manifest_file)
+        for versioned in self.manifest.values():
+            path = os.path.join(dist, versioned)
+            variants = {}
+            for encoding, suffix in [(None, '')] + encodings:
+                if os.path.exists(path + suffix):
+                    with open(path + suffix, 'rb') as asset_file:
+                        variants[encoding] = asset_file.read()
+            self.files[versioned] = variants
+
+    def url(self, name):
+        """Versioned url of a static file, the plain static url (or the CDN) if the assets are not built"""
+        if name in self.manifest:
+            return url_for('assets.asset', filename=self.manifest[name])
+        if name in vendor_assets and name not in self.local_vendor_assets:
+            return vendor_assets[name][0]
+        return url_for('static', filename=name)
+
+
+@assets.record_once
+def install_asset_store(state):
+    state.app.extensions.setdefault('asset_store', AssetStore(state.app.static_folder, built=False))
+    state.app.jinja_env.globals['asset_url'] = asset_url
+    state.app.jinja_env.globals['asset_integrity'] = asset_integrity
+
+
+def asset_url(name):
+    return current_app.extensions['asset_store'].url(name)
+
+
+def asset_integrity(name):
+    """Subresource integrity of a vendored library, served locally or by the CDN"""
+    return vendor_assets[name][1]
+
+
+@assets.route('/assets/<path:filename>')
+def asset(filename):
+    """A built asset, precompressed with the best encoding accepted by the browser"""
+    variants = current_app.extensions['asset_store'].files.get(filename)
+    if variants is None:
+        return Response('Not Found', status=404)
+
+    encoding = next((encoding for encoding, _ in encodings
+                     if encoding in variants and request.accept_encodings[encoding] > 0), None)
+    response = Response(variants[encoding], mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = far_future_cache_control
+    # the name already changes with the content
+    response.set_etag('{}{}'.format(filename, '-' + encoding if encoding else ''))
+    return response.make_conditional(request)
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'build'
+    if command == 'fetch':
+        fetch_vendor_assets()
+    elif command == 'build':
+        built = build_assets()
+        print("Built {} assets in {}{}".format(len(built), os.path.join(static_folder, dist_folder_name),
+                                               '' if brotli is not None else ' (gzip only, brotli not installed)'))
+    else:
+        print(__doc__)
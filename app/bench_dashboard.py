@@ -0,0 +1,142 @@
+"""
+Latency of the live dashboard: hundreds of browsers (threads reading the server-sent events of
+/dashboard/stream) are connected while a Pi posts batches of short reports to a local instance of the
+ingestion and dashboard blueprints. Reports the latency from the report arrival (its publication in the
+cache) and from the report sending to the push received by the browsers.
+
+    python bench_dashboard.py [browsers] [batches per second] [seconds]
+"""
+import datetime
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+from flask import Flask
+from werkzeug.serving import make_server
+
+from bench_ingest import QuietRequestHandler
+from dashboard import dashboard
+from ingest import ingest
+
+default_browsers = 500
+default_rate = 10
+default_duration = 10
+
+plants = 50
+# few browsers per process, so that the latency is not the one of the GIL of the clients
+client_processes = 20
+port = 4997
+
+
+def serve(database_path, ready):
+    app = Flask(__name__)
+    app.config['REPORTS_DATABASE'] = database_path
+    app.register_blueprint(ingest)
+    app.register_blueprint(dashboard)
+    server = make_server('127.0.0.1', port, app, threaded=True, request_handler=QuietRequestHandler)
+    ready.set()
+    server.serve_forever()
+
+
+def browser(connected, latencies):
+    """Reads the stream as an EventSource would, recording the latencies of the status events,
+    until the server is stopped"""
+    connection = socket.create_connection(('127.0.0.1', port))
+    # HTTP/1.0, so that the stream is not chunked
+    connection.sendall(b'GET /dashboard/stream HTTP/1.0\r\nHost: 127.0.0.1\r\nAccept: text/event-stream\r\n\r\n')
+    stream = connection.makefile('rb')
+    event = None
+    while True:
+        line = stream.readline()
+        if not line:
+            break
+        if line.startswith(b'event: '):
+            event = line[7:].strip()
+            if event == b'snapshot':
+                connected.release()
+        elif line.startswith(b'data: ') and event == b'status':
+            received = time.time()
+            data = json.loads(line[6:])
+            sent = datetime.datetime.fromisoformat(data['plants'][0]['timestamp']).timestamp()
+            latencies.append((received - data['published'], received - sent))
+    connection.close()
+
+
+def browsers_process(browsers, ready, results):
+    connected = threading.Semaphore(0)
+    latencies = []
+    threads = [threading.Thread(target=browser, args=(connected, latencies)) for _ in range(browsers)]
+    for thread in threads:
+        thread.start()
+    for _ in threads:
+        connected.acquire()
+    ready.put(browsers)
+    for thread in threads:
+        thread.join()
+    results.put(latencies)
+
+
+def short_batch(timestamp):
+    return [{'BIM_id': 'BIM-{}'.format(i),
+             'phase': 'Maturation',
+             'status': 'Maturation: Good',
+             'record_timestamp': timestamp.isoformat(sep=' '),
+             'temperature': 30.125,
+             'moisture': 25.5,
+             'pressure': 25.5} for i in range(plants)]
+
+
+def percentile(values, q):
+    return sorted(values)[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+if __name__ == '__main__':
+    n_browsers = int(sys.argv[1]) if len(sys.argv) > 1 else default_browsers
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else default_rate
+    duration = float(sys.argv[3]) if len(sys.argv) > 3 else default_duration
+
+    directory = tempfile.mkdtemp()
+    server_ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=serve, args=(os.path.join(directory, 'reports.sqlite3'), server_ready),
+                                     daemon=True)
+    server.start()
+    server_ready.wait()
+
+    ready = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    per_process = max(1, n_browsers // client_processes)
+    clients = [multiprocessing.Process(target=browsers_process, args=(per_process, ready, results))
+               for _ in range(client_processes)]
+    for client in clients:
+        client.start()
+    connected = sum(ready.get() for _ in clients)
+
+    session = requests.Session()
+    batches = int(rate * duration)
+    start = time.perf_counter()
+    for i in range(batches):
+        time.sleep(max(0.0, start + i / rate - time.perf_counter()))
+        session.post('http://127.0.0.1:{}/short_summary'.format(port),
+                     json=short_batch(datetime.datetime.now())).raise_for_status()
+    time.sleep(1)
+    server.terminate()
+    server.join()
+
+    latencies = [latency for _ in clients for latency in results.get()]
+    for client in clients:
+        client.join()
+    shutil.rmtree(directory)
+
+    print("{} browsers connected, {} batches of {} reports posted, {} events pushed ({} expected)".format(
+        connected, batches, plants, len(latencies), connected * batches))
+    for label, index in [('report arrival -> push', 0), ('report sent -> push', 1)]:
+        values = [latency[index] * 1e3 for latency in latencies]
+        print("{:<24} p50 {:.1f} ms, p95 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms".format(
+            label, percentile(values, 50), percentile(values, 95), percentile(values, 99), max(values)))
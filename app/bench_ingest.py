@@ -0,0 +1,127 @@
+"""
+Load test of the ingestion endpoints: hundreds of simulated Pis post batches of short/full reports
+(as ReportUploader does) to a local instance of the blueprint, backed by a temporary SQLite database.
+Reports the sustained records/s, and the same for the legacy one-record GET requests.
+
+    python bench_ingest.py [pis] [seconds] [batch size]
+"""
+import datetime
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+from flask import Flask
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from ingest import ingest
+from report_store import ReportStore
+
+default_pis = 200
+default_duration = 10
+default_batch_size = 500  # max_batch_size of ReportUploader
+
+client_processes = 4
+port = 4998
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """Keep-alive connections, as the pooled session of ReportUploader, and no access log"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def serve(database_path, ready):
+    app = Flask(__name__)
+    app.config['REPORTS_DATABASE'] = database_path
+    app.register_blueprint(ingest)
+    server = make_server('127.0.0.1', port, app, threaded=True, request_handler=QuietRequestHandler)
+    ready.set()
+    server.serve_forever()
+
+
+def full_report(pi, i):
+    timestamp = datetime.datetime(2018, 4, 21) + datetime.timedelta(seconds=30 * i)
+    return {'BIM_id': 'BIM-{}'.format(pi),
+            'phase': 'Maturation',
+            'status': 'Maturation: Bad',
+            'temperature': 30.125,
+            'moisture': 25.5,
+            'pressure': 25.5,
+            'begin_timestamp': str(timestamp),
+            'end_timestamp': str(timestamp + datetime.timedelta(seconds=30))}
+
+
+def simulated_pi(pi, deadline, batch_size, legacy, counts):
+    """Sends reports until the deadline, one batch (or one GET) at a time"""
+    session = requests.Session()
+    root_url = 'http://127.0.0.1:{}/'.format(port)
+    sent = 0
+    while time.monotonic() < deadline:
+        if legacy:
+            r = session.get(root_url + 'full_summary', params=full_report(pi, sent))
+            count = 1
+        else:
+            r = session.post(root_url + 'full_summary', json=[full_report(pi, sent + i) for i in range(batch_size)])
+            count = batch_size
+        r.raise_for_status()
+        sent += count
+    counts.append(sent)
+
+
+def client_process(first_pi, pis, duration, batch_size, legacy, results):
+    deadline = time.monotonic() + duration
+    counts = []
+    threads = [threading.Thread(target=simulated_pi, args=(first_pi + i, deadline, batch_size, legacy, counts))
+               for i in range(pis)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put(sum(counts))
+
+
+def run_load(pis, duration, batch_size, legacy):
+    results = multiprocessing.Queue()
+    per_process = max(1, pis // client_processes)
+    clients = [multiprocessing.Process(target=client_process,
+                                       args=(i * per_process, per_process, duration, batch_size, legacy, results))
+               for i in range(client_processes)]
+    start = time.perf_counter()
+    for client in clients:
+        client.start()
+    sent = sum(results.get() for _ in clients)
+    for client in clients:
+        client.join()
+    return sent, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    pis = int(sys.argv[1]) if len(sys.argv) > 1 else default_pis
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else default_duration
+    batch_size = int(sys.argv[3]) if len(sys.argv) > 3 else default_batch_size
+
+    directory = tempfile.mkdtemp()
+    database_path = os.path.join(directory, 'reports.sqlite3')
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=serve, args=(database_path, ready), daemon=True)
+    server.start()
+    ready.wait()
+
+    for label, legacy in [('bulk POST, {} reports per batch'.format(batch_size), False),
+                          ('legacy GET, 1 report per request', True)]:
+        sent, elapsed = run_load(pis, duration, batch_size, legacy)
+        print("{} Pis, {}: {} reports in {:.1f} s, {:.0f} reports/s".format(pis, label, sent, elapsed,
+                                                                            sent / elapsed))
+
+    server.terminate()
+    server.join()
+    stored = ReportStore(database_path).count('full')
+    print("reports stored: {}".format(stored))
+    shutil.rmtree(directory)
@@ -0,0 +1,156 @@
+"""
+Response times of the history queries of the /reports endpoint over millions of stored full reports: the
+reports are bulk loaded in time order (one report every 10 minutes for each plant), then the indexes are
+built by ReportStore as on the first start over an existing database. Reports the latency of the first and
+of a deep page of a plant in a 28 days window, of a page by location and pillar, the streaming throughput of
+the whole history of a plant, and the same plant query without the indexes.
+
+    python bench_query.py [reports] [plants] [repetitions]
+"""
+import datetime
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from flask import Flask
+
+from ingest import ingest
+from queries import queries
+from report_store import ReportStore, indexes, plant_fields, stored_fields, tables
+
+default_reports = 10 * 1000 * 1000
+default_plants = 2000
+default_repetitions = 200
+
+locations = 20
+casting_windows = 500
+window = datetime.timedelta(minutes=10)
+first_window = datetime.datetime(2018, 4, 1)
+load_batch_size = 100000
+
+
+def bim_id(plant):
+    return 'BIM-{}'.format(plant)
+
+
+def plant(number):
+    fields = {field: None for field in plant_fields}
+    fields.update(loc='Cantiere/Edificio {}'.format(number % locations), pillar_number=str(number // locations))
+    return fields
+
+
+def load(database_path, n_reports, n_plants):
+    """Bulk loads the full reports without the indexes, returns the load and index build times"""
+    store = ReportStore(database_path)
+    store.upsert_plants({bim_id(number): plant(number) for number in range(n_plants)})
+    store.close()
+    connection = sqlite3.connect(database_path, isolation_level=None)
+    for name, _, _ in indexes:
+        connection.execute('DROP INDEX {}'.format(name))
+
+    windows = n_reports // n_plants
+    timestamps = [(first_window + window * i).isoformat(sep=' ', timespec='microseconds') for i in range(windows + 1)]
+    fields = stored_fields('full')
+    insert = 'INSERT INTO {} ({}) VALUES ({})'.format(tables['full'], ', '.join(fields), ', '.join('?' * len(fields)))
+    start = time.perf_counter()
+    rows = []
+    for i in range(windows):
+        phase, status = ('Casting', 'Casting: Good') if i < casting_windows else ('Maturation', 'Maturation: Good')
+        for number in range(n_plants):
+            rows.append(dict(BIM_id=bim_id(number), temperature=20.0 + number % 10, moisture=25.5, pressure=1.5,
+                             phase=phase, status=status, begin_timestamp=timestamps[i],
+                             end_timestamp=timestamps[i + 1]))
+            if len(rows) == load_batch_size:
+                connection.execute('BEGIN')
+                connection.executemany(insert, [tuple(row[field] for field in fields) for row in rows])
+                connection.execute('COMMIT')
+                rows = []
+    if rows:
+        connection.execute('BEGIN')
+        connection.executemany(insert, [tuple(row[field] for field in fields) for row in rows])
+        connection.execute('COMMIT')
+    connection.close()
+    loaded = time.perf_counter() - start
+
+    start = time.perf_counter()
+    ReportStore(database_path).close()
+    return loaded, time.perf_counter() - start
+
+
+def percentile(values, q):
+    return sorted(values)[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+def timed(function, repetitions):
+    latencies = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        function()
+        latencies.append((time.perf_counter() - start) * 1e3)
+    return latencies
+
+
+def report(label, latencies):
+    print("{:<44} p50 {:8.2f} ms, p99 {:8.2f} ms".format(label, percentile(latencies, 50), percentile(latencies, 99)))
+
+
+if __name__ == '__main__':
+    n_reports = int(sys.argv[1]) if len(sys.argv) > 1 else default_reports
+    n_plants = int(sys.argv[2]) if len(sys.argv) > 2 else default_plants
+    repetitions = int(sys.argv[3]) if len(sys.argv) > 3 else default_repetitions
+
+    directory = tempfile.mkdtemp()
+    database_path = os.path.join(directory, 'reports.sqlite3')
+    loaded, indexed = load(database_path, n_reports, n_plants)
+    print("{} full reports of {} plants loaded in {:.1f} s, indexes built in {:.1f} s, {:.0f} MB".format(
+        n_reports, n_plants, loaded, indexed, os.path.getsize(database_path) / 1e6))
+
+    app = Flask(__name__)
+    app.config['REPORTS_DATABASE'] = database_path
+    app.register_blueprint(ingest)
+    app.register_blueprint(queries)
+    client = app.test_client()
+    windows = n_reports // n_plants
+    last_window = first_window + window * windows
+
+    def get(**arguments):
+        response = client.get('/reports/full', query_string=arguments)
+        assert response.status_code == 200, response.data
+        return response
+
+    def plant_window(cursor=None):
+        arguments = dict(bim_id=bim_id(random.randrange(n_plants)), phase='Maturation',
+                         since=str(last_window - datetime.timedelta(days=28)), until=str(last_window))
+        if cursor is not None:
+            arguments['cursor'] = cursor
+        return get(**arguments)
+
+    report('plant, phase, last 28 days: first page', timed(plant_window, repetitions))
+
+    # the cursor of the 20th page of a plant, reused for random plants: the key keeps the timestamp and id
+    cursor = None
+    for _ in range(20):
+        cursor = plant_window(cursor).get_json()['next_cursor']
+    report('plant, phase, last 28 days: 20th page', timed(lambda: plant_window(cursor), repetitions))
+
+    report('location and pillar: first page', timed(
+        lambda: get(loc='Cantiere/Edificio {}'.format(random.randrange(locations)),
+                    pillar_number=str(random.randrange(n_plants // locations))), repetitions))
+
+    streamed = timed(lambda: get(bim_id=bim_id(random.randrange(n_plants)), stream='1').data,
+                     max(1, repetitions // 20))
+    report('whole history of a plant, streamed', streamed)
+    print("{:<44} {:.0f} reports/s".format('', windows / (percentile(streamed, 50) / 1e3)))
+
+    connection = sqlite3.connect(database_path)
+    scan = 'SELECT * FROM {} NOT INDEXED WHERE BIM_id = ? AND phase = ? AND begin_timestamp >= ? ' \
+           'ORDER BY begin_timestamp, id LIMIT 100'.format(tables['full'])
+    since = (last_window - datetime.timedelta(days=28)).isoformat(sep=' ', timespec='microseconds')
+    report('plant, phase, last 28 days: without indexes', timed(
+        lambda: connection.execute(scan, (bim_id(random.randrange(n_plants)), 'Maturation', since)).fetchall(), 3))
+    connection.close()
+    shutil.rmtree(directory)
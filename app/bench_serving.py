@@ -0,0 +1,151 @@
+"""
+wrk-style load test of the web app in development and production serving mode: concurrent connections
+request the dashboard page and the stylesheet as fast as they can, reporting requests/s, latency and the
+bytes of each response. The werkzeug server closes the connection after each response, so the
+connections are opened again as wrk does.
+
+    python bench_serving.py [connections] [seconds]
+"""
+import datetime
+import multiprocessing
+import os
+import re
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+from flask import Flask
+from werkzeug.serving import make_server
+
+from assets import assets, build_assets
+from bench_ingest import QuietRequestHandler
+from dashboard import dashboard
+from ingest import ingest
+from serving import configure_production
+
+default_connections = 32
+default_duration = 5
+
+plants = 200
+client_processes = 4
+port = 4996
+templates_folder = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'templates')
+
+
+def serve(database_path, production, bytecode_cache_path, ready):
+    app = Flask(__name__, template_folder=templates_folder, static_folder='../static')
+    app.config['REPORTS_DATABASE'] = database_path
+    app.register_blueprint(ingest)
+    app.register_blueprint(dashboard)
+    app.register_blueprint(assets)
+    if production:
+        configure_production(app, bytecode_cache_path=bytecode_cache_path)
+    server = make_server('127.0.0.1', port, app, threaded=True, request_handler=QuietRequestHandler)
+    ready.set()
+    server.serve_forever()
+
+
+def connection(path, deadline, latencies, sizes):
+    """Requests path on a keep-alive connection until the deadline, as a wrk connection
+    (reconnecting when the server closes it)"""
+    request = 'GET {} HTTP/1.1\r\nHost: 127.0.0.1\r\nAccept-Encoding: gzip, br\r\n\r\n'.format(path).encode('ascii')
+    sock = None
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        if sock is None:
+            sock = socket.create_connection(('127.0.0.1', port))
+            stream = sock.makefile('rb')
+        sock.sendall(request)
+        stream.readline()
+        length = 0
+        close = False
+        while True:
+            line = stream.readline().lower()
+            if line in (b'\r\n', b''):
+                break
+            if line.startswith(b'content-length:'):
+                length = int(line.split(b':')[1])
+            elif line.startswith(b'connection:') and b'close' in line:
+                close = True
+        stream.read(length)
+        latencies.append(time.perf_counter() - start)
+        sizes.append(length)
+        if close:
+            sock.close()
+            sock = None
+    if sock is not None:
+        sock.close()
+
+
+def client_process(path, connections, duration, results):
+    deadline = time.perf_counter() + duration
+    latencies = []
+    sizes = []
+    threads = [threading.Thread(target=connection, args=(path, deadline, latencies, sizes))
+               for _ in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put((latencies, sizes))
+
+
+def run_load(path, connections, duration):
+    results = multiprocessing.Queue()
+    clients = [multiprocessing.Process(target=client_process,
+                                       args=(path, max(1, connections // client_processes), duration, results))
+               for _ in range(client_processes)]
+    for client in clients:
+        client.start()
+    latencies = []
+    sizes = []
+    for _ in clients:
+        client_latencies, client_sizes = results.get()
+        latencies.extend(client_latencies)
+        sizes.extend(client_sizes)
+    for client in clients:
+        client.join()
+    return sorted(latencies), sizes
+
+
+def short_reports():
+    timestamp = datetime.datetime(2018, 4, 21)
+    return [{'BIM_id': 'BIM-{}'.format(i),
+             'phase': 'Maturation',
+             'status': 'Maturation: Good',
+             'record_timestamp': str(timestamp),
+             'temperature': 30.125,
+             'moisture': 25.5,
+             'pressure': 25.5} for i in range(plants)]
+
+
+if __name__ == '__main__':
+    n_connections = int(sys.argv[1]) if len(sys.argv) > 1 else default_connections
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else default_duration
+
+    directory = tempfile.mkdtemp()
+    build_assets()  # deploy step of the production mode
+    for production in [False, True]:
+        ready = multiprocessing.Event()
+        server = multiprocessing.Process(target=serve, args=(os.path.join(directory, 'reports.sqlite3'), production,
+                                                             os.path.join(directory, 'templates'), ready))
+        server.start()
+        ready.wait()
+        root_url = 'http://127.0.0.1:{}'.format(port)
+        requests.post(root_url + '/short_summary', json=short_reports()).raise_for_status()
+        page = requests.get(root_url + '/dashboard').text
+        stylesheet = re.search(r'href="(/(?:static|assets)/main[^"]*)"', page).group(1)
+
+        for path in ['/dashboard', stylesheet]:
+            latencies, sizes = run_load(path, n_connections, duration)
+            print("{:<11} {:<30} {:>7.0f} requests/s, latency p50 {:.2f} ms, p99 {:.2f} ms, {} bytes".format(
+                'production' if production else 'development', path, len(latencies) / duration,
+                latencies[len(latencies) // 2] * 1e3, latencies[int(len(latencies) * 0.99)] * 1e3,
+                sizes[0] if sizes else 0))
+        server.terminate()
+        server.join()
+    shutil.rmtree(directory)
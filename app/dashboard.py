@@ -0,0 +1,43 @@
+from flask import Blueprint, Response, current_app, render_template, request
+
+from ingest import get_report_store
+from live_status import LiveStatus, report_status
+from serving import FragmentCacheExtension
+
+dashboard = Blueprint('dashboard', __name__)
+
+
+@dashboard.record_once
+def install_live_status(state):
+    state.app.extensions.setdefault('live_status', LiveStatus())
+    # the table of the plants is a cached fragment, see configure_production
+    state.app.jinja_env.add_extension(FragmentCacheExtension)
+
+
+def get_live_status():
+    """LiveStatus of the application, filled with the latest stored reports of every plant on the first use
+    :rtype: LiveStatus
+    """
+    live_status = current_app.extensions['live_status']
+    if not live_status.loaded:
+        live_status.loaded = True
+        store = get_report_store()
+        for file_detail in ['full', 'short']:
+            live_status.update([report_status(report, file_detail) for report in store.latest_reports(file_detail)])
+    return live_status
+
+
+@dashboard.route('/dashboard')
+def home():
+    return render_template('dashboard.html', title='Dashboard', live_status=get_live_status())
+
+
+@dashboard.route('/dashboard/stream')
+def stream():
+    """Server-sent events with the status of the plants, as soon as their reports are received"""
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    response = Response(get_live_status().stream(last_event_id), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # no buffering by the reverse proxies
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
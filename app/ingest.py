@@ -0,0 +1,138 @@
+from flask import Blueprint, current_app, jsonify, request
+
+from live_status import report_status
+from report_store import (ReportStore, default_database_path, plant_of_report, stored_fields, validate_plant,
+                          validate_report)
+import wire_format  # models directory, added to the path by report_store
+
+ingest = Blueprint('ingest', __name__)
+
+
+def get_report_store():
+    """ReportStore of the application, opened on the first request (REPORTS_DATABASE config)
+    :rtype: ReportStore
+    """
+    store = current_app.extensions.get('report_store')
+    if store is None:
+        store = current_app.extensions['report_store'] = ReportStore(
+            current_app.config.get('REPORTS_DATABASE', default_database_path))
+    return store
+
+
+def publish(rows, file_detail):
+    """Updates the live status of the plants, if the dashboard is installed"""
+    live_status = current_app.extensions.get('live_status')
+    if live_status is None or not rows:
+        return
+    fields = stored_fields(file_detail)
+    live_status.update([report_status(dict(zip(fields, row)), file_detail) for row in rows])
+
+
+def ingest_reports(reports, file_detail):
+    """Validates the reports and stores the valid ones with a single bulk insert.
+    Invalid reports are returned with their index, so that a bad record does not make
+    the device send the whole batch again.
+    The short reports are stored without the plant fields: the ones sent by the older devices update the
+    plants table, the plants that are not known are returned so that the device registers them"""
+    store = get_report_store()
+    rows = []
+    rejected = []
+    plants = {}
+    bim_ids = set()
+    for index, report in enumerate(reports):
+        try:
+            row = validate_report(report, file_detail)
+            plant = plant_of_report(report) if file_detail == wire_format.file_suffix[0] else None
+            if plant is not None:
+                bim_id, plants[bim_id] = validate_plant(dict(plant, BIM_id=report['BIM_id']))
+            rows.append(row)
+            bim_ids.add(str(report['BIM_id']))
+        except ValueError as e:
+            rejected.append({'index': index, 'error': str(e)})
+
+    store.upsert_plants(plants)
+    accepted = store.insert_many(file_detail, rows)
+    publish(rows, file_detail)
+    status = 400 if rejected and not accepted else 200
+    if file_detail != wire_format.file_suffix[0]:
+        return jsonify(accepted=accepted, rejected=rejected), status
+    unknown = store.unknown_plants(bim_ids)
+    return jsonify(accepted=accepted, rejected=rejected, unknown_plants=unknown), status
+
+
+def receive_binary(file_detail):
+    """A batch in the binary wire format, the plants sent with it are stored"""
+    try:
+        body_detail, plants, reports = wire_format.decode(request.get_data())
+    except wire_format.UnsupportedVersionError as e:
+        return jsonify(accepted=0, rejected=[{'index': None, 'error': str(e)}]), 415
+    except ValueError as e:
+        return jsonify(accepted=0, rejected=[{'index': None, 'error': str(e)}]), 400
+    if body_detail != file_detail:
+        error = '{} reports sent to the {} endpoint'.format(body_detail, file_detail)
+        return jsonify(accepted=0, rejected=[{'index': None, 'error': error}]), 400
+
+    try:
+        plants = dict(validate_plant(dict(plant, BIM_id=bim_id)) for bim_id, plant in plants.items())
+    except ValueError as e:
+        return jsonify(accepted=0, rejected=[{'index': None, 'error': str(e)}]), 400
+    get_report_store().upsert_plants(plants)
+    return ingest_reports(reports, file_detail)
+
+
+def receive(file_detail):
+    if request.method == 'GET':
+        # one report in the query string, as sent by send_log_to_server
+        return ingest_reports([request.args.to_dict()], file_detail)
+
+    if request.mimetype == wire_format.content_type:
+        return receive_binary(file_detail)
+
+    # a JSON list of reports, as sent by ReportUploader, or a single report
+    reports = request.get_json(silent=True)
+    if reports is None:
+        return jsonify(accepted=0, rejected=[{'index': None, 'error': 'the body is not valid JSON'}]), 400
+    if isinstance(reports, dict):
+        reports = [reports]
+    return ingest_reports(reports, file_detail)
+
+
+@ingest.route('/wire_formats')
+def wire_formats():
+    """Versions of the binary wire format accepted by the endpoints"""
+    return jsonify(versions=wire_format.supported_versions, content_type=wire_format.content_type)
+
+
+@ingest.route('/plants', methods=['GET', 'POST'])
+def plants():
+    """Registry of the plants: the devices register the static fields of a plant (or a list of plants)
+    once, instead of sending them with every short report"""
+    store = get_report_store()
+    if request.method == 'GET':
+        return jsonify([dict(plant, BIM_id=bim_id) for bim_id, plant in store.plants().items()])
+
+    plants = request.get_json(silent=True)
+    if plants is None:
+        return jsonify(accepted=0, rejected=[{'index': None, 'error': 'the body is not valid JSON'}]), 400
+    if isinstance(plants, dict):
+        plants = [plants]
+    valid = {}
+    rejected = []
+    for index, plant in enumerate(plants):
+        try:
+            bim_id, valid[bim_id] = validate_plant(plant)
+        except ValueError as e:
+            rejected.append({'index': index, 'error': str(e)})
+    store.upsert_plants(valid)
+    status = 400 if rejected and not valid else 200
+    return jsonify(accepted=len(valid), rejected=rejected), status
+
+
+@ingest.route('/short_summary', methods=['GET', 'POST'])
+def short_summary():
+    return receive('short')
+
+
+@ingest.route('/full_summary', methods=['GET', 'POST'])
+def full_summary():
+    return receive('full')
@@ -0,0 +1,117 @@
+import collections
+import itertools
+import json
+import threading
+import time
+
+# events kept for the streams that are behind (or reconnect with Last-Event-ID), older ones get a snapshot
+max_buffered_events = 1000
+
+# seconds between two keep-alive comments on an idle stream
+keepalive_interval = 15
+
+# fields of the status of a plant pushed to the dashboards
+status_fields = ['BIM_id', 'phase', 'status', 'temperature', 'moisture', 'pressure', 'timestamp']
+
+keepalive_comment = b': keepalive\n\n'
+
+
+def encode_event(sequence, event, plants):
+    """Server-sent event with the status of some plants, published is the time of the push (in seconds)"""
+    data = json.dumps({'published': time.time(), 'plants': plants}, separators=(',', ':'))
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(sequence, event, data).encode('utf-8')
+
+
+def report_status(report, file_detail):
+    """Status of a plant from a stored report (see stored_fields)"""
+    status = {field: report.get(field) for field in status_fields}
+    status['timestamp'] = report.get('record_timestamp' if file_detail == 'short' else 'end_timestamp')
+    return status
+
+
+class LiveStatus(object):
+    """Latest phase, status and readings of every plant, updated by the ingestion and pushed to the
+    dashboards with server-sent events.
+    Every batch of reports becomes a single event, encoded once and kept in a ring buffer shared by all
+    the streams: a connected browser only waits for the next sequence number, so hundreds of dashboards
+    cost one update of the cache"""
+
+    def __init__(self, max_events=max_buffered_events):
+        self._latest = {}
+        self._events = collections.deque(maxlen=max_events)  # encoded events, sequence numbers are consecutive
+        self._sequence = 0
+        self._condition = threading.Condition()
+        self.subscribers = 0
+        self.loaded = False  # filled with the stored reports
+
+    def __len__(self):
+        return len(self._latest)
+
+    @property
+    def sequence(self):
+        return self._sequence
+
+    def update(self, statuses):
+        """Updates the cache with a list of statuses (see report_status), older than the cached ones are
+        skipped. The changed plants are published as a single event, returns its sequence number
+        (None if nothing changed)"""
+        with self._condition:
+            changed = {}
+            for status in statuses:
+                bim_id = status['BIM_id']
+                current = self._latest.get(bim_id)
+                if current is not None and (current['timestamp'] or '') > (status['timestamp'] or ''):
+                    continue
+                self._latest[bim_id] = changed[bim_id] = status
+            if not changed:
+                return None
+            self._sequence += 1
+            self._events.append(encode_event(self._sequence, 'status', list(changed.values())))
+            self._condition.notify_all()
+            return self._sequence
+
+    def latest(self):
+        """Latest status of every plant, sorted by BIM_id
+        :rtype: list
+        """
+        with self._condition:
+            return [self._latest[bim_id] for bim_id in sorted(self._latest, key=str)]
+
+    def _snapshot_event(self):
+        return encode_event(self._sequence, 'snapshot', [self._latest[bim_id] for bim_id in sorted(self._latest,
+                                                                                                  key=str)])
+
+    def _events_since(self, sequence):
+        """Encoded events after sequence, None if they are no longer in the buffer"""
+        first = self._sequence - len(self._events) + 1
+        if sequence + 1 < first or sequence > self._sequence:
+            return None
+        return list(itertools.islice(self._events, sequence + 1 - first, None))
+
+    def stream(self, last_event_id=None, keepalive=keepalive_interval):
+        """Generator of the server-sent events of a dashboard: a snapshot of all the plants (unless the
+        browser reconnects with a Last-Event-ID still in the buffer), then the events as they are published"""
+        with self._condition:
+            self.subscribers += 1
+            pending = self._events_since(last_event_id) if last_event_id is not None else None
+            if pending is None:
+                pending = [self._snapshot_event()]
+            sequence = self._sequence
+        try:
+            while True:
+                if pending:
+                    yield b''.join(pending)
+                else:
+                    yield keepalive_comment
+                with self._condition:
+                    if self._condition.wait_for(lambda: self._sequence > sequence, keepalive):
+                        pending = self._events_since(sequence)
+                        if pending is None:
+                            # too slow to follow the buffer
+                            pending = [self._snapshot_event()]
+                        sequence = self._sequence
+                    else:
+                        pending = None
+        finally:
+            with self._condition:
+                self.subscribers -= 1
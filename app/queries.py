@@ -0,0 +1,79 @@
+import base64
+import json
+
+from flask import Blueprint, Response, jsonify, request
+
+from ingest import get_report_store
+from report_store import default_page_size, tables
+
+queries = Blueprint('queries', __name__)
+
+# reports of a page, at most
+max_page_size = 10000
+
+# reports read from the database at a time while streaming, the lock of the store is released in between
+stream_page_size = 5000
+
+filters = ['bim_id', 'phase', 'since', 'until', 'loc', 'pillar_number']
+
+
+def encode_cursor(key):
+    """Opaque cursor of the next page from the key returned by ReportStore.query"""
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Raises ValueError if the cursor was not returned by encode_cursor"""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, UnicodeError):
+        raise ValueError('not a valid cursor: {!r}'.format(cursor))
+    if not isinstance(key, list) or len(key) != 4 or not isinstance(key[3], int):
+        raise ValueError('not a valid cursor: {!r}'.format(cursor))
+    return key
+
+
+def ndjson(reports):
+    return ''.join(json.dumps(report, separators=(',', ':')) + '\n' for report in reports).encode('utf-8')
+
+
+def stream_reports(store, file_detail, arguments, after):
+    """Newline-delimited JSON of all the matching reports, read one page at a time"""
+    while True:
+        reports, after = store.query(file_detail, after=after, limit=stream_page_size, **arguments)
+        if reports:
+            yield ndjson(reports)
+        if after is None:
+            return
+
+
+@queries.route('/reports/<file_detail>')
+def reports(file_detail):
+    """Historical reports by plant (bim_id, or loc and pillar_number), phase and time (since, until), in pages of
+    limit reports: the next page is requested with the next_cursor of the previous one.
+    With stream=1 all the reports (from the cursor on) are streamed as newline-delimited JSON"""
+    if file_detail not in tables:
+        return jsonify(error='unknown reports: {}'.format(file_detail)), 404
+    arguments = {name: request.args[name] for name in filters if request.args.get(name)}
+    try:
+        after = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+        limit = int(request.args.get('limit', default_page_size))
+        if not 0 < limit <= max_page_size:
+            raise ValueError('limit must be between 1 and {}'.format(max_page_size))
+        store = get_report_store()
+        if request.args.get('stream') in ('1', 'true'):
+            # the filters are checked by the first page, before the response starts
+            first, next_key = store.query(file_detail, after=after, limit=stream_page_size, **arguments)
+        else:
+            page, next_key = store.query(file_detail, after=after, limit=limit, **arguments)
+            return jsonify(reports=page, next_cursor=encode_cursor(next_key) if next_key is not None else None)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    def stream():
+        if first:
+            yield ndjson(first)
+        if next_key is not None:
+            yield from stream_reports(store, file_detail, arguments, next_key)
+
+    return Response(stream(), mimetype='application/x-ndjson')
@@ -0,0 +1,294 @@
+import datetime
+import os
+import sqlite3
+import sys
+import threading
+
+# the report schemas are shared with the monitoring side
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models'))
+from log_processing import file_suffix, plant_fields, schemas  # noqa: E402
+
+default_database_path = 'reports.sqlite3'
+
+tables = {'short': 'short_reports', 'full': 'full_reports'}
+plants_table = 'plants'
+
+# short reports joined with the fields of their plant
+short_summary_view = 'short_summary'
+
+# fields stored as numbers and as timestamps, the others are text
+numeric_fields = ['temperature', 'moisture', 'pressure']
+timestamp_fields = ['record_timestamp', 'begin_timestamp', 'end_timestamp']
+required_fields = ['BIM_id']
+
+# composite indexes of the history queries: (name, table, columns)
+indexes = [('full_reports_plant_phase_time', tables['full'], ['BIM_id', 'phase', 'begin_timestamp']),
+           ('short_reports_plant_phase_time', tables['short'], ['BIM_id', 'phase', 'record_timestamp']),
+           ('plants_location', plants_table, ['loc', 'pillar_number'])]
+
+# reports returned by a query when no limit is given
+default_page_size = 100
+
+
+def schema_fields(file_detail):
+    return list(schemas[file_suffix.index(file_detail)])
+
+
+def stored_fields(file_detail):
+    """Columns of the reports table: the plant fields of the short reports are stored once in the plants table"""
+    return [field for field in schema_fields(file_detail)
+            if file_detail != file_suffix[0] or field not in plant_fields]
+
+
+def validate_report(report, file_detail):
+    """Checks a report against the schema and returns the row to insert (values in the order of
+    stored_fields, the plant fields sent by the older devices are not part of it).
+    Timestamps are normalized to 'YYYY-MM-DD HH:MM:SS.ffffff', so that they sort as text.
+    Raises ValueError if the report is not valid"""
+    if not isinstance(report, dict):
+        raise ValueError('a report must be an object')
+    fields = schemas[file_suffix.index(file_detail)]
+    unknown = [key for key in report if key not in fields]
+    if unknown:
+        raise ValueError('unknown fields: {}'.format(', '.join(sorted(unknown))))
+    for field in required_fields:
+        if report.get(field) in (None, ''):
+            raise ValueError('missing field: {}'.format(field))
+
+    row = []
+    for field in stored_fields(file_detail):
+        value = report.get(field)
+        if value is None or value == '':
+            row.append(None)
+        elif field in numeric_fields:
+            try:
+                row.append(float(value))
+            except (TypeError, ValueError):
+                raise ValueError('{} is not a number: {!r}'.format(field, value))
+        elif field in timestamp_fields:
+            row.append(timestamp_text(value, field))
+        else:
+            row.append(str(value))
+    return tuple(row)
+
+
+def timestamp_text(value, field='timestamp'):
+    """Timestamp normalized to 'YYYY-MM-DD HH:MM:SS.ffffff' as stored, raises ValueError if it is not one"""
+    try:
+        timestamp = datetime.datetime.fromisoformat(str(value))
+    except ValueError:
+        raise ValueError('{} is not a timestamp: {!r}'.format(field, value))
+    return timestamp.isoformat(sep=' ', timespec='microseconds')
+
+
+def timestamp_field(file_detail):
+    """Column the reports are ordered by in time"""
+    return 'record_timestamp' if file_detail == file_suffix[0] else 'begin_timestamp'
+
+
+def keyset_condition(columns, key):
+    """WHERE condition of the rows after key (the values of columns of the last row of the previous page) in the
+    order of columns, with SQLite's NULLs first. The lower bound on the first column lets the index seek to the
+    page instead of scanning the previous ones"""
+    terms = []
+    parameters = []
+    for i, (column, value) in enumerate(zip(columns, key)):
+        term = ['{} IS ?'.format(previous) for previous in columns[:i]]
+        parameters.extend(key[:i])
+        if value is None:
+            term.append('{} IS NOT NULL'.format(column))
+        else:
+            term.append('{} > ?'.format(column))
+            parameters.append(value)
+        terms.append('(' + ' AND '.join(term) + ')')
+    condition = '(' + ' OR '.join(terms) + ')'
+    if key[0] is not None:
+        condition = '{} >= ? AND {}'.format(columns[0], condition)
+        parameters.insert(0, key[0])
+    return condition, parameters
+
+
+def validate_plant(plant):
+    """Checks the fields of a plant, returns its BIM_id and the fields to store.
+    Raises ValueError if the plant is not valid"""
+    if not isinstance(plant, dict):
+        raise ValueError('a plant must be an object')
+    unknown = [key for key in plant if key != 'BIM_id' and key not in plant_fields]
+    if unknown:
+        raise ValueError('unknown fields: {}'.format(', '.join(sorted(unknown))))
+    if plant.get('BIM_id') in (None, ''):
+        raise ValueError('missing field: BIM_id')
+    return str(plant['BIM_id']), {field: None if plant.get(field) in (None, '') else str(plant[field])
+                                  for field in plant_fields}
+
+
+def plant_of_report(report):
+    """Plant fields of a short report sent by the older devices, None if it carries none"""
+    if not any(field in report for field in plant_fields):
+        return None
+    return {field: report.get(field) for field in plant_fields}
+
+
+class ReportStore(object):
+    """Reports received from the monitoring devices, stored in SQLite (WAL mode) with one table per schema.
+    Every batch is written with a single executemany in a single transaction.
+    The short reports are stored without the static fields of their plant, which are kept once in the
+    plants table (and in memory) and joined again at query time by the short_summary view"""
+
+    def __init__(self, path=default_database_path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+
+        self._inserts = {}
+        for file_detail, table in tables.items():
+            fields = stored_fields(file_detail)
+            columns = ', '.join('{} {}'.format(field, 'REAL' if field in numeric_fields else 'TEXT')
+                                for field in fields)
+            self._connection.execute('CREATE TABLE IF NOT EXISTS {} (id INTEGER PRIMARY KEY, {})'.format(table,
+                                                                                                     columns))
+            self._inserts[file_detail] = 'INSERT INTO {} ({}) VALUES ({})'.format(table, ', '.join(fields),
+                                                                                ', '.join('?' * len(fields)))
+
+        columns = ', '.join('{} TEXT'.format(field) for field in plant_fields)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS {} (BIM_id TEXT PRIMARY KEY, {})'.format(plants_table,
+                                                                                                     columns))
+        self._upsert_plant = 'INSERT OR REPLACE INTO {} (BIM_id, {}) VALUES ({})'.format(
+            plants_table, ', '.join(plant_fields), ', '.join('?' * (len(plant_fields) + 1)))
+        self._plants = {row[0]: dict(zip(plant_fields, row[1:])) for row in self._connection.execute(
+            'SELECT BIM_id, {} FROM {}'.format(', '.join(plant_fields), plants_table))}
+
+        columns = ', '.join('{}.{}'.format('p' if field in plant_fields else 's', field)
+                            for field in schema_fields(file_suffix[0]))
+        self._connection.execute('CREATE VIEW IF NOT EXISTS {} AS SELECT s.id, {} FROM {} s LEFT JOIN {} p '
+                                 'ON p.BIM_id = s.BIM_id'.format(short_summary_view, columns, tables['short'],
+                                                                 plants_table))
+        for name, table, columns in indexes:
+            self._connection.execute('CREATE INDEX IF NOT EXISTS {} ON {} ({})'.format(name, table,
+                                                                                        ', '.join(columns)))
+
+    def insert_many(self, file_detail, rows):
+        """Inserts rows returned by validate_report, returns how many were inserted"""
+        if not rows:
+            return 0
+        with self._lock:
+            with self._connection:
+                self._connection.execute('BEGIN')
+                self._connection.executemany(self._inserts[file_detail], rows)
+        return len(rows)
+
+    def upsert_plants(self, plants):
+        """Stores the static fields of the plants, a dict BIM_id -> dict of plant_fields (see validate_plant).
+        The plants already stored with the same fields are skipped"""
+        plants = {bim_id: plant for bim_id, plant in plants.items() if self._plants.get(bim_id) != plant}
+        if not plants:
+            return
+        rows = [tuple([bim_id] + [plant.get(field) for field in plant_fields]) for bim_id, plant in plants.items()]
+        with self._lock:
+            with self._connection:
+                self._connection.execute('BEGIN')
+                self._connection.executemany(self._upsert_plant, rows)
+            self._plants.update((bim_id, dict(plant)) for bim_id, plant in plants.items())
+
+    def plant(self, bim_id):
+        """Static fields of a plant, None if the plant is not known"""
+        return self._plants.get(bim_id)
+
+    def plants(self):
+        """All the plants, a dict BIM_id -> dict of plant_fields"""
+        with self._lock:
+            return {bim_id: dict(plant) for bim_id, plant in self._plants.items()}
+
+    def unknown_plants(self, bim_ids):
+        """BIM_id of the plants not in the plants table, sorted"""
+        return sorted({bim_id for bim_id in bim_ids if bim_id not in self._plants}, key=str)
+
+    def latest_reports(self, file_detail):
+        """Latest stored report of every plant, as dicts of the stored_fields"""
+        fields = stored_fields(file_detail)
+        timestamp = 'record_timestamp' if file_detail == file_suffix[0] else 'end_timestamp'
+        # with MAX the other columns come from the row of the latest timestamp
+        query = 'SELECT {}, MAX({}) FROM {} GROUP BY BIM_id'.format(', '.join(fields), timestamp, tables[file_detail])
+        with self._lock:
+            rows = self._connection.execute(query).fetchall()
+        return [dict(zip(fields, row)) for row in rows]
+
+    def reports(self, file_detail, bim_id=None):
+        """Stored reports as dicts of the schema fields, the short ones joined with their plant"""
+        source = short_summary_view if file_detail == file_suffix[0] else tables[file_detail]
+        fields = schema_fields(file_detail)
+        query = 'SELECT {} FROM {}'.format(', '.join(fields), source)
+        parameters = ()
+        if bim_id is not None:
+            query += ' WHERE BIM_id = ?'
+            parameters = (bim_id,)
+        with self._lock:
+            rows = self._connection.execute(query + ' ORDER BY id', parameters).fetchall()
+        return [dict(zip(fields, row)) for row in rows]
+
+    def query(self, file_detail, bim_id=None, phase=None, since=None, until=None, loc=None, pillar_number=None,
+              after=None, limit=default_page_size):
+        """A page of the stored reports matching the filters, as dicts of the schema fields (the short ones
+        joined with their plant), in the order of the (BIM_id, phase, timestamp) index.
+        since and until bound the timestamp (the begin_timestamp of the full reports), loc and pillar_number
+        select the plants through the plants index; after is the key returned with the previous page.
+        Returns the reports and the key of the next page, None after the last one.
+        Raises ValueError if since or until are not timestamps"""
+        source = short_summary_view if file_detail == file_suffix[0] else tables[file_detail]
+        fields = schema_fields(file_detail)
+        timestamp = timestamp_field(file_detail)
+        order = ['BIM_id', 'phase', timestamp, 'id']
+
+        conditions = []
+        parameters = []
+        for column, value in [('BIM_id', bim_id), ('phase', phase)]:
+            if value is not None:
+                conditions.append('{} = ?'.format(column))
+                parameters.append(value)
+        if since is not None:
+            conditions.append('{} >= ?'.format(timestamp))
+            parameters.append(timestamp_text(since, 'since'))
+        if until is not None:
+            conditions.append('{} < ?'.format(timestamp))
+            parameters.append(timestamp_text(until, 'until'))
+        plant_conditions = ['{} = ?'.format(column) for column, value in [('loc', loc),
+                                                                           ('pillar_number', pillar_number)]
+                            if value is not None]
+        if plant_conditions:
+            conditions.append('BIM_id IN (SELECT BIM_id FROM {} WHERE {})'.format(plants_table,
+                                                                                 ' AND '.join(plant_conditions)))
+            parameters.extend(str(value) for value in [loc, pillar_number] if value is not None)
+        if after is not None:
+            # the columns fixed by the filters are left out of the key, so that the index seeks on the next one
+            fixed = {'BIM_id': bim_id is not None, 'phase': phase is not None}
+            key_columns = [column for column in order if not fixed.get(column)]
+            key = [value for column, value in zip(order, after) if not fixed.get(column)]
+            condition, key_parameters = keyset_condition(key_columns, key)
+            conditions.append(condition)
+            parameters.extend(key_parameters)
+
+        query = 'SELECT {}, id FROM {}'.format(', '.join(fields), source)
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        # one more row tells whether there is a next page
+        query += ' ORDER BY {} LIMIT ?'.format(', '.join(order))
+        parameters.append(limit + 1)
+        with self._lock:
+            rows = self._connection.execute(query, parameters).fetchall()
+
+        reports = [dict(zip(fields, row)) for row in rows[:limit]]
+        next_key = None
+        if len(rows) > limit:
+            last = reports[-1]
+            next_key = [last['BIM_id'], last['phase'], last[timestamp], rows[limit - 1][-1]]
+        return reports, next_key
+
+    def count(self, file_detail):
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM {}'.format(tables[file_detail])).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
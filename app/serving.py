@@ -0,0 +1,96 @@
+import collections
+import os
+import threading
+
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+
+from assets import AssetStore
+
+# rendered fragments kept in memory, the least recently used are dropped first
+max_cached_fragments = 1000
+
+
+class FragmentCache(object):
+    """Rendered template fragments by key, bounded LRU"""
+
+    def __init__(self, max_entries=max_cached_fragments):
+        self.max_entries = max_entries
+        self._fragments = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            fragment = self._fragments.get(key)
+            if fragment is None:
+                self.misses += 1
+                return None
+            self._fragments.move_to_end(key)
+            self.hits += 1
+            return fragment
+
+    def set(self, key, fragment):
+        with self._lock:
+            self._fragments[key] = fragment
+            self._fragments.move_to_end(key)
+            if len(self._fragments) > self.max_entries:
+                self._fragments.popitem(last=False)
+
+
+class FragmentCacheExtension(Extension):
+    """{% cache key, ... %}...{% endcache %} renders the block once for each key: the key has to change
+    with the data shown by the block (e.g. the sequence number of the live status).
+    Without a fragment cache in the environment (development) the block is always rendered"""
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super(FragmentCacheExtension, self).__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        keys = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            keys.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render_cached', [nodes.List(keys)]), [], [], body).set_lineno(lineno)
+
+    def _render_cached(self, keys, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+        key = tuple(keys)
+        fragment = cache.get(key)
+        if fragment is None:
+            fragment = caller()
+            cache.set(key, fragment)
+        return fragment
+
+
+def configure_production(app, bytecode_cache_path=None):
+    """Production serving: the templates are compiled once (and their bytecode kept across restarts),
+    never reloaded, and the fragments are cached; the static assets built at deploy time
+    (python assets.py build) are served versioned and precompressed by the assets blueprint.
+    The bytecode is kept in bytecode_cache_path, a directory owned by the app (e.g. in its instance folder),
+    by default in the private directory of the user that Jinja creates in the temp folder"""
+    app.config['TEMPLATES_AUTO_RELOAD'] = False
+    if bytecode_cache_path is None:
+        bytecode_cache = FileSystemBytecodeCache()
+    else:
+        os.makedirs(bytecode_cache_path, mode=0o700, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(bytecode_cache_path)
+    app.jinja_env.auto_reload = False
+    app.jinja_env.bytecode_cache = bytecode_cache
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.fragment_cache = FragmentCache()
+
+    asset_store = AssetStore(app.static_folder)
+    if not asset_store.manifest:
+        print("The static assets are not built (python assets.py build), serving the plain static files")
+    app.extensions['asset_store'] = asset_store
+
+    # compile all the templates now, not on their first request
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
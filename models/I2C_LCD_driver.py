@@ -21,15 +21,23 @@ I2CBUS = 0
 # LCD Address
 ADDRESS = 0x27
 
+# data bytes of a write_i2c_block_data transaction (SMBus limit)
+I2C_BLOCK_MAX = 32
+
+import threading
 from time import sleep
 
-import smbus
+try:
+    import smbus
+except ImportError:
+    # off the Pi, the lcd runs on a mock_smbus
+    smbus = None
 
 
 class i2c_device:
-    def __init__(self, addr, port=I2CBUS):
+    def __init__(self, addr, port=I2CBUS, bus=None):
         self.addr = addr
-        self.bus = smbus.SMBus(port)
+        self.bus = bus if bus is not None else smbus.SMBus(port)
 
     # Write a single command
     def write_cmd(self, cmd):
@@ -46,6 +54,10 @@ class i2c_device:
         self.bus.write_block_data(self.addr, cmd, data)
         sleep(0.0001)
 
+    # Write a block of raw bytes in a single transaction (no byte count, unlike write_block_data)
+    def write_i2c_block(self, cmd, data):
+        self.bus.write_i2c_block_data(self.addr, cmd, data)
+
     # Read a single byte
     def read(self):
         return self.bus.read_byte(self.addr)
@@ -105,11 +117,14 @@ En = 0b00000100  # Enable bit
 Rw = 0b00000010  # Read/Write bit
 Rs = 0b00000001  # Register select bit
 
+# DDRAM address of the first character of each line
+LCD_LINE_OFFSETS = [0x00, 0x40, 0x14, 0x54]
+
 
 class lcd:
-    # initializes objects and lcd
-    def __init__(self):
-        self.lcd_device = i2c_device(ADDRESS)
+    # initializes objects and lcd, on the given bus (e.g. a mock_smbus) instead of the I2CBUS one
+    def __init__(self, bus=None):
+        self.lcd_device = i2c_device(ADDRESS, bus=bus)
 
         self.lcd_write(0x03)
         self.lcd_write(0x03)
@@ -144,6 +159,25 @@ class lcd:
         self.lcd_write_four_bits(mode | (charvalue & 0xF0))
         self.lcd_write_four_bits(mode | ((charvalue << 4) & 0xF0))
 
+    # bytes that set up and clock with EN the two nibbles of each (value, mode), as lcd_write does
+    def lcd_nibble_bytes(self, writes):
+        data = []
+        for value, mode in writes:
+            for nibble in (mode | (value & 0xF0), mode | ((value << 4) & 0xF0)):
+                data.extend((nibble | LCD_BACKLIGHT, nibble | En | LCD_BACKLIGHT, nibble | LCD_BACKLIGHT))
+        return data
+
+    # write a list of (value, mode) in write_i2c_block_data bursts: the expander latches the bytes one by one
+    # at the bus speed (~90us each at 100kHz), longer than the EN pulse and the execution of a character
+    def lcd_write_burst(self, writes):
+        data = self.lcd_nibble_bytes(writes)
+        for start in range(0, len(data), I2C_BLOCK_MAX + 1):
+            block = data[start:start + I2C_BLOCK_MAX + 1]
+            if len(block) == 1:
+                self.lcd_device.write_cmd(block[0])
+            else:
+                self.lcd_device.write_i2c_block(block[0], block[1:])
+
     # put string function with optional char positioning
     def lcd_display_string(self, string, line=1, pos=0):
         if line == 1:
@@ -178,3 +212,168 @@ class lcd:
         for char in fontdata:
             for line in char:
                 self.lcd_write_char(line)
+
+
+class framebuffer_lcd:
+    """Non-blocking lcd: the strings are written to a framebuffer and a refresh thread sends to the display
+    only the cells that differ from what is on screen, in write_i2c_block_data bursts.
+    Updates made while a refresh is in progress are coalesced into the next one"""
+
+    def __init__(self, bus=None, rows=2, columns=16):
+        self.rows = rows
+        self.columns = columns
+        self.lcd = lcd(bus)
+        self.refreshes = 0
+
+        self._shown = [[' '] * columns for _ in range(rows)]  # what is on screen, lcd() clears it
+        self._frame = [[' '] * columns for _ in range(rows)]
+        self._version = 0
+        self._shown_version = 0
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._worker = threading.Thread(target=self._run, name='lcd-refresh', daemon=True)
+        self._worker.start()
+
+    # put string function with optional char positioning, returns immediately
+    def lcd_display_string(self, string, line=1, pos=0):
+        with self._condition:
+            row = self._frame[line - 1]
+            for i, char in enumerate(string[:max(0, self.columns - pos)]):
+                row[pos + i] = char
+            self._version += 1
+            self._condition.notify_all()
+
+    # shows the given lines, padded with spaces
+    def lcd_display_lines(self, *lines):
+        with self._condition:
+            for line in range(self.rows):
+                text = lines[line] if line < len(lines) else ''
+                self._frame[line] = list(text[:self.columns].ljust(self.columns))
+            self._version += 1
+            self._condition.notify_all()
+
+    def lcd_clear(self):
+        self.lcd_display_lines()
+
+    # waits until the framebuffer is on screen, returns False on timeout
+    def flush(self, timeout=None):
+        with self._condition:
+            version = self._version
+            return self._condition.wait_for(lambda: self._shown_version >= version, timeout)
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._worker.join()
+
+    def changed_writes(self, frame):
+        """(value, mode) writes that turn the screen into frame: the changed cells of each line, moving the
+        address only across unchanged runs longer than the set address command (one write)"""
+        writes = []
+        for line, (shown, wanted) in enumerate(zip(self._shown, frame)):
+            address = None
+            for column, (old, new) in enumerate(zip(shown, wanted)):
+                if old == new:
+                    continue
+                if address is None or column - address > 1:
+                    writes.append((LCD_SETDDRAMADDR | (LCD_LINE_OFFSETS[line] + column), 0))
+                elif column - address == 1:
+                    # rewriting the unchanged cell in between costs the same as moving the address
+                    writes.append((self.char_code(wanted[address]), Rs))
+                writes.append((self.char_code(new), Rs))
+                address = column + 1
+        return writes
+
+    @staticmethod
+    def char_code(char):
+        code = ord(char)
+        return code if code < 256 else ord('?')
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._stopped or self._version > self._shown_version)
+                if self._stopped:
+                    return
+                version = self._version
+                frame = [list(row) for row in self._frame]
+            writes = self.changed_writes(frame)
+            if writes:
+                self.lcd.lcd_write_burst(writes)
+                self.refreshes += 1
+            with self._condition:
+                self._shown = frame
+                self._shown_version = version
+                self._condition.notify_all()
+
+
+class mock_smbus:
+    """Stands in for smbus.SMBus off the Pi: counts the bus transactions and the bytes written, and decodes
+    the 4-bit writes to the HD44780 behind the PCF8574 expander, so that the screen can be checked"""
+
+    def __init__(self, port=I2CBUS):
+        self.transactions = 0
+        self.bytes_written = 0
+        self.ddram = [0x20] * 0x80
+        self.address = 0
+        self._enable = False
+        self._high_nibble = None
+
+    def write_byte(self, addr, value):
+        self._write([value])
+
+    def write_byte_data(self, addr, cmd, value):
+        self._write([cmd, value])
+
+    def write_block_data(self, addr, cmd, data):
+        self.transactions += 1
+        self.bytes_written += len(data) + 2
+
+    def write_i2c_block_data(self, addr, cmd, data):
+        self._write([cmd] + list(data))
+
+    def read_byte(self, addr):
+        self.transactions += 1
+        return 0
+
+    def read_byte_data(self, addr, cmd):
+        self.transactions += 1
+        return 0
+
+    def read_block_data(self, addr, cmd):
+        self.transactions += 1
+        return []
+
+    def line(self, line, columns=16):
+        """Characters on screen of a line (1-4)"""
+        start = LCD_LINE_OFFSETS[line - 1]
+        return ''.join(chr(code) for code in self.ddram[start:start + columns])
+
+    def _write(self, values):
+        self.transactions += 1
+        self.bytes_written += len(values)
+        for value in values:
+            enable = bool(value & En)
+            # the display reads the nibble on the falling edge of EN
+            if self._enable and not enable:
+                self._latch(value)
+            self._enable = enable
+
+    def _latch(self, value):
+        if self._high_nibble is None:
+            self._high_nibble = value
+            return
+        byte = (self._high_nibble & 0xF0) | ((value & 0xF0) >> 4)
+        data = self._high_nibble & Rs
+        self._high_nibble = None
+        if data:
+            self.ddram[self.address] = byte
+            self.address = (self.address + 1) % len(self.ddram)
+        elif byte & LCD_SETDDRAMADDR:
+            self.address = byte & 0x7F
+        elif byte == LCD_CLEARDISPLAY:
+            self.ddram = [0x20] * len(self.ddram)
+            self.address = 0
+        elif byte & 0xFE == LCD_RETURNHOME:
+            self.address = 0
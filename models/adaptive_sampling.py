@@ -0,0 +1,97 @@
+import collections
+import time
+
+from timer_wheel import Timer
+
+# longest delay (in seconds) between two samples of a plant
+default_max_read_delay = 5 * 60
+
+# the next sample is taken after this fraction of the time the readings need to reach the edge of a band
+horizon_fraction = 0.25
+
+# readings closer than this fraction of the width of the warning band to its outer edges (out of which the
+# phase fails) are sampled at the read delay of the phase
+near_edge_fraction = 0.2
+
+# the delay grows at most by this factor from one sample to the next
+backoff_factor = 1.5
+
+# samples used to estimate the rate of change of the readings
+rate_window = 5
+
+
+class AdaptiveSampler(object):
+    """Delay before the next sample of a plant, from its last readings: the samples are taken at the read
+    delay of the phase when a reading is close to the edge of the warning band (out of which the phase
+    fails), otherwise after a fraction of the time the readings need to reach the edge of a band (the
+    warning one or the safe one, which completes the phase) at their current rate of change.
+    Stable readings back off gradually up to max_delay, readings that move fast or approach the warning
+    edges are sampled again at once.
+    The rate of change is the least squares slope of the last rate_window samples, so the noise of a
+    single reading does not make the sampler speed up"""
+
+    def __init__(self, threshold_table, min_delays, max_delay=default_max_read_delay):
+        self.threshold_table = threshold_table
+        self.min_delays = min_delays  # phase -> read delay of the phase
+        self.max_delay = max_delay
+        self.params = threshold_table.params
+        # edges of the bands of every param, in the order of params
+        self._edges = {phase: [threshold_table.edges(phase)[param] for param in self.params]
+                       for phase in threshold_table.phases}
+        self._samples = collections.deque(maxlen=rate_window)  # (time, values in the order of params)
+        self.phase = None
+        self.delay = None  # last delay returned
+
+    def reset(self):
+        """Forgets the readings, at the beginning of a phase"""
+        self._samples.clear()
+        self.phase = None
+        self.delay = None
+
+    def rates(self):
+        """Least squares slope of every parameter over the last samples (units per second, in the order of
+        params), 0 with less than two"""
+        mean_time = sum(t for t, _ in self._samples) / len(self._samples)
+        deviations = [t - mean_time for t, _ in self._samples]
+        variance = sum(deviation * deviation for deviation in deviations)
+        if variance == 0:
+            return [0.0] * len(self.params)
+        return [sum(deviation * values[i] for deviation, (_, values) in zip(deviations, self._samples)) / variance
+                for i in range(len(self.params))]
+
+    def next_delay(self, params, phase, now):
+        """Delay (in seconds) before the sample that follows params (a dict), read at now (in seconds)"""
+        if phase != self.phase:
+            self.reset()
+            self.phase = phase
+        values = tuple(params[param] for param in self.params)
+        self._samples.append((now, values))
+        min_delay = self.min_delays[phase]
+        edges = self._edges[phase]
+
+        if any(min(value - lower, upper - value) < near_edge_fraction * (safe_lower - lower)
+               for value, (lower, safe_lower, _, upper) in zip(values, edges)):
+            delay = min_delay
+        else:
+            delay = self.max_delay
+            for value, rate, param_edges in zip(values, self.rates(), edges):
+                if rate > 0:
+                    ahead = [edge - value for edge in param_edges if edge > value]
+                elif rate < 0:
+                    ahead = [value - edge for edge in param_edges if edge < value]
+                else:
+                    ahead = None
+                if ahead:
+                    delay = min(delay, horizon_fraction * min(ahead) / abs(rate))
+
+        # from the read delay of the phase, or from one second when it is 0
+        delay = min(delay, max(self.delay if self.delay is not None else min_delay, 1.0) * backoff_factor)
+        self.delay = max(min_delay, min(self.max_delay, delay))
+        return self.delay
+
+    def timer(self, params, phase):
+        """One-shot Timer of the next sample, for the loops that wait on their timers
+        :rtype: Timer
+        """
+        now = time.monotonic()
+        return Timer(now + self.next_delay(params, phase, now), callback=None)
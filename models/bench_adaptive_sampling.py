@@ -0,0 +1,147 @@
+"""
+Replay harness of the adaptive sampling: plants of SimulatedSensorBackend are monitored by PlantMonitor on a
+simulated clock (casting, then a maturation of many hours) with the fixed read delays and with the
+AdaptiveSampler, reporting for each policy the sensor reads (duty cycle), the CPU time of the simulated reads
+and of the monitoring (on the Pi a DHT11 read alone polls the GPIO for milliseconds), the reports queued for
+upload and how late the breaches and the completions of the phases are detected.
+Half of the plants settle as expected, the other half drift out of the warning band during maturation: the
+breaches are timed from the crossing of the noiseless curve, which the noise of the readings anticipates.
+The noise of a reading depends only on the plant and on the time, so both policies read the same values.
+Runs on any machine, no hardware needed:
+
+    python bench_adaptive_sampling.py [plants] [maturation hours]
+"""
+import datetime
+import math
+import random
+import sys
+import time
+
+import flowchart_no_sensors
+from monitoring_core import MonitoringCore
+from monitoring_scheduler import PlantMonitor
+from plant_registry import PlantRegistry
+from sensor_backends import SimulatedSensorBackend
+
+default_plants = 20
+default_maturation_hours = 24
+
+read_delay = 5
+full_report_sampling_rate = 30
+short_report_sampling_rate = 120
+casting_duration = 30 * 60
+
+
+class MaturationDriftBackend(SimulatedSensorBackend):
+    """Settles during casting and drifts away from the expected values during maturation"""
+
+    def _start_phase(self, start_values):
+        super(MaturationDriftBackend, self)._start_phase(start_values)
+        self.failing = self.phase == 'maturation'
+
+
+def breach_time(backend, phase_start):
+    """Time the noiseless curve of a drifting phase leaves the warning band: the offsets grow as exp(t / tau)"""
+    tau = backend.durations[backend.phase] / 3.0
+    warning = flowchart_no_sensors.params_tolerances
+    return phase_start + min(tau * math.log(warning[param]['warning'] / abs(offset))
+                             for param, offset in backend.offsets.items() if offset)
+
+
+def replay(backend, core, adaptive, seed):
+    """Monitors a plant on a simulated clock, returns its statistics"""
+    start = datetime.datetime(2018, 4, 21)
+    monitor = PlantMonitor({'BIM_id': 'BIM-replay'}, core, read_params=backend.read_params,
+                           light_output=lambda color: None, sampler=core.make_sampler() if adaptive else None)
+    stats = {'reads': 0, 'reports': 0, 'cpu': 0.0, 'breach': None, 'detected': None, 'completed': {}}
+    t = 0.0
+    next_full = full_report_sampling_rate
+    next_short = short_report_sampling_rate
+    phase_start = 0.0
+    delay = 0.0
+    while not monitor.done:
+        backend.sample_period = delay
+        backend.random = random.Random('{}:{}'.format(seed, t))
+        phase = monitor.current_phase
+        now = start + datetime.timedelta(seconds=t)
+
+        cpu = time.process_time()
+        moisture, temperature, pressure = backend.read_params()
+        monitor.process_sample(moisture, temperature, pressure, now=now)
+        stats['cpu'] += time.process_time() - cpu
+        stats['reads'] += 1
+
+        if monitor.current_phase != phase or monitor.done:
+            stats['completed'][phase] = t
+            phase_start = t
+            if backend.failing and stats['breach'] is None:
+                stats['breach'] = breach_time(backend, phase_start)
+        while next_full <= t:
+            monitor.full_report(now=now)
+            next_full += full_report_sampling_rate
+        while next_short <= t:
+            monitor.short_report(now=now)
+            next_short += short_report_sampling_rate
+        stats['reports'] += len(monitor.pop_reports())
+
+        delay = monitor.read_delay
+        t += delay
+    if monitor.result is False:
+        stats['detected'] = t - delay
+    stats['duration'] = t - delay
+    return stats
+
+
+def make_core(adaptive):
+    return MonitoringCore(expected_values=flowchart_no_sensors.params_expected_values,
+                          tolerances=flowchart_no_sensors.params_tolerances,
+                          casting_read_delay=read_delay, maturation_read_delay=read_delay,
+                          full_report_sampling_rate=full_report_sampling_rate,
+                          short_report_sampling_rate=short_report_sampling_rate,
+                          registry=PlantRegistry(), adaptive_sampling=adaptive)
+
+
+def percentile(values, q):
+    return sorted(values)[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+if __name__ == '__main__':
+    n_plants = int(sys.argv[1]) if len(sys.argv) > 1 else default_plants
+    maturation_duration = float(sys.argv[2]) * 3600 if len(sys.argv) > 2 else default_maturation_hours * 3600
+
+    results = {}
+    for adaptive in [False, True]:
+        core = make_core(adaptive)
+        runs = []
+        for seed in range(n_plants):
+            backend_class = MaturationDriftBackend if seed % 2 else SimulatedSensorBackend
+            backend = backend_class(flowchart_no_sensors.params_expected_values, core.check_params, seed=seed,
+                                    casting_duration=casting_duration, maturation_duration=maturation_duration)
+            runs.append(replay(backend, core, adaptive, seed))
+        results[adaptive] = runs
+
+        label = 'adaptive' if adaptive else 'fixed {} s'.format(read_delay)
+        hours = sum(run['duration'] for run in runs) / 3600
+        reads = sum(run['reads'] for run in runs)
+        print("{:<10} {:7d} reads ({:6.1f} per hour), {:6d} reports queued, CPU {:7.1f} ms".format(
+            label, reads, reads / hours, sum(run['reports'] for run in runs),
+            sum(run['cpu'] for run in runs) * 1e3))
+
+        latencies = [run['detected'] - run['breach'] for run in runs if run['breach'] is not None]
+        if latencies:
+            print("{:<10} breach detected {:+.0f} s from the noiseless crossing (p50), {:+.0f} s (latest), "
+                  "{} of {} breaches".format('', percentile(latencies, 50), max(latencies), len(latencies),
+                                             sum(1 for run in runs if run['breach'] is not None)))
+
+    fixed, adaptive = results[False], results[True]
+    delays = [run['detected'] - reference['detected'] for run, reference in zip(adaptive, fixed)
+              if run['detected'] is not None and reference['detected'] is not None]
+    if delays:
+        print("breaches detected {:.0f} s later with adaptive sampling (p50), {:.0f} s (max)".format(
+            percentile(delays, 50), max(delays)))
+    for phase in ['casting', 'maturation']:
+        delays = [run['completed'][phase] - reference['completed'][phase] for run, reference in zip(adaptive, fixed)
+                  if phase in run['completed'] and phase in reference['completed'] and run['detected'] is None]
+        if delays:
+            print("{} completed {:.0f} s later with adaptive sampling (p50), {:.0f} s (max)".format(
+                phase, percentile(delays, 50), max(delays)))
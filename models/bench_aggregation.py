@@ -0,0 +1,70 @@
+"""
+Benchmark of the aggregation of the full reports: dict-of-lists path of extract_average_from_batch
+against the columnar NumPy path, on a single batch and on many windows summarized in bulk.
+
+    python bench_aggregation.py [max samples]
+
+The dict path reuses the same log_full dict for every sample, so that 10M samples fit in memory:
+the time spent walking the list is the same as with distinct dicts.
+"""
+import datetime
+import sys
+import time
+
+import numpy as np
+
+from log_processing import ColumnarBatch, extract_average_from_batch, summarize_batches
+
+sample_counts = [10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7]
+
+# samples per window in the bulk benchmark
+window_size = 100
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def run_benchmark(n_samples):
+    now = datetime.datetime.now()
+    sample = {'BIM_id': 'BIM-0', 'phase': 'Maturation', 'status': 'Maturation: Bad',
+              'begin_timestamp': now, 'end_timestamp': now,
+              'temperature': 30.5, 'moisture': 25.25, 'pressure': 25.25}
+    log = [sample] * n_samples
+
+    random = np.random.default_rng(0)
+    batch = ColumnarBatch(bim_id='BIM-0', phase='Maturation', status='Maturation: Bad',
+                          temperature=random.normal(30, 2, n_samples),
+                          moisture=random.normal(25, 2, n_samples),
+                          pressure=random.normal(25, 2, n_samples),
+                          begin_timestamp=np.full(n_samples, np.datetime64(now, 'us')),
+                          end_timestamp=np.full(n_samples, np.datetime64(now, 'us')))
+
+    # single batch
+    dict_single = timed(extract_average_from_batch, log, 'full')
+    columnar_means = timed(extract_average_from_batch, batch, 'full')
+    columnar_single = timed(batch.summarize)
+
+    # many windows (plants x windows) summarized with one call
+    windows = [log[i:i + window_size] for i in range(0, n_samples, window_size)]
+    dict_bulk = timed(lambda: [extract_average_from_batch(window, 'full') for window in windows])
+    offsets = np.arange(0, n_samples, window_size)
+    columnar_bulk = timed(summarize_batches, batch.values, offsets)
+
+    return dict_single, columnar_means, columnar_single, dict_bulk, columnar_bulk
+
+
+if __name__ == '__main__':
+    max_samples = int(sys.argv[1]) if len(sys.argv) > 1 else sample_counts[-1]
+    print("means: extract_average_from_batch on a list of dicts and on a ColumnarBatch")
+    print("all stats: mean/min/max/std/percentiles of a ColumnarBatch")
+    print("bulk: windows of {} samples, means only (dict) vs all stats (columnar)\n".format(window_size))
+    print("{:>10} {:>12} {:>14} {:>14} {:>14} {:>18}".format('samples', 'dict [s]', 'columnar [s]',
+                                                             'all stats [s]', 'dict bulk [s]',
+                                                             'columnar bulk [s]'))
+    for n in sample_counts:
+        if n > max_samples:
+            break
+        print("{:>10} {:>12.4f} {:>14.4f} {:>14.4f} {:>14.4f} {:>18.4f}".format(n, *run_benchmark(n)))
@@ -0,0 +1,142 @@
+"""
+Replay benchmark of the DHT11 decoder: GPIO traces are decoded with the previous per-sample
+state machine and with the run-length decoder of dht11_decoder, reporting decode time and success rate.
+Runs on any Linux machine, no hardware needed:
+
+    python bench_dht11.py                       # synthetic traces
+    python bench_dht11.py traces.txt            # traces recorded on the Pi
+    python bench_dht11.py record traces.txt 50  # record 50 traces (on the Pi, sensor on pin 22)
+
+Trace files have one capture per line, as a string of 0/1 GPIO samples.
+"""
+import random
+import sys
+import time
+
+from dht11_decoder import DHT11Result, decode
+
+# GPIO polls per microsecond of the synthetic traces (Python polling on a Pi)
+polls_per_us = 0.4
+
+synthetic_traces = 2000
+
+
+def synthetic_trace(humidity, temperature, rng, jitter=0.15, missed_poll_rate=0.0):
+    """GPIO samples of a DHT11 answer: 80us low + 80us high, then for each bit 50us low
+    followed by 26us (0) or 70us (1) high, then the line goes back high"""
+    the_bytes = [humidity, 0, temperature, 0, (humidity + temperature) & 255]
+    bits = [(byte >> (7 - i)) & 1 for byte in the_bytes for i in range(8)]
+
+    periods = [(1, 5), (0, 80), (1, 80)]
+    for bit in bits:
+        periods.append((0, 50))
+        periods.append((1, 70 if bit else 26))
+    periods.append((0, 50))
+
+    samples = []
+    for level, duration in periods:
+        polls = max(1, int(round(duration * polls_per_us * rng.uniform(1 - jitter, 1 + jitter))))
+        samples.extend([level] * polls)
+    samples.extend([1] * 120)
+
+    # polls lost while the process was not scheduled
+    if missed_poll_rate:
+        samples = [s for s in samples if rng.random() >= missed_poll_rate]
+    return bytearray(samples)
+
+
+def legacy_decode(data):
+    """Per-sample state machine of the previous DHT11 reader, kept as a reference"""
+    state = 1
+    lengths = []
+    current_length = 0
+    for current in data:
+        current_length += 1
+        if state == 1:
+            if current == 0:
+                state = 2
+        elif state == 2:
+            if current == 1:
+                state = 3
+        elif state == 3:
+            if current == 0:
+                state = 4
+        elif state == 4:
+            if current == 1:
+                current_length = 0
+                state = 5
+        elif state == 5:
+            if current == 0:
+                lengths.append(current_length)
+                state = 4
+    if len(lengths) != 40:
+        return DHT11Result(DHT11Result.ERR_MISSING_DATA, 0, 0)
+
+    shortest_pull_up = min(lengths)
+    longest_pull_up = max(lengths)
+    halfway = shortest_pull_up + (longest_pull_up - shortest_pull_up) / 2
+    the_bytes = []
+    byte = 0
+    for i, length in enumerate(lengths):
+        byte = byte << 1
+        if length > halfway:
+            byte = byte | 1
+        if (i + 1) % 8 == 0:
+            the_bytes.append(byte)
+            byte = 0
+    if the_bytes[4] != the_bytes[0] + the_bytes[1] + the_bytes[2] + the_bytes[3] & 255:
+        return DHT11Result(DHT11Result.ERR_CRC, 0, 0)
+    return DHT11Result(DHT11Result.ERR_NO_ERROR, the_bytes[2], the_bytes[0])
+
+
+def load_traces(path):
+    with open(path) as f:
+        return [bytearray(int(c) for c in line.strip()) for line in f if line.strip()]
+
+
+def record_traces(path, count, pin=22):
+    import RPi.GPIO  # noqa: F401, imported for dht11
+    import dht11
+
+    sensor = dht11.DHT11(pin=pin)
+    with open(path, 'w') as f:
+        for _ in range(count):
+            length = sensor.capture()
+            f.write(''.join(str(s) for s in sensor.capture_buffer[:length]) + '\n')
+            time.sleep(2)
+
+
+def replay(traces, decoder):
+    errors = {DHT11Result.ERR_NO_ERROR: 0, DHT11Result.ERR_MISSING_DATA: 0, DHT11Result.ERR_CRC: 0}
+    start = time.perf_counter()
+    for trace in traces:
+        errors[decoder(trace).error_code] += 1
+    elapsed = time.perf_counter() - start
+    return elapsed / len(traces), errors
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'record':
+        record_traces(sys.argv[2], int(sys.argv[3]))
+        sys.exit()
+
+    if len(sys.argv) > 1:
+        trace_sets = {sys.argv[1]: load_traces(sys.argv[1])}
+    else:
+        rng = random.Random(0)
+        trace_sets = {}
+        for missed_poll_rate in [0.0, 0.01, 0.03]:
+            trace_sets['synthetic, {:.0%} polls missed'.format(missed_poll_rate)] = [
+                synthetic_trace(rng.randint(20, 90), rng.randint(0, 50), rng, missed_poll_rate=missed_poll_rate)
+                for _ in range(synthetic_traces)]
+
+    for name, traces in trace_sets.items():
+        print("{} ({} traces, {:.0f} samples on average)".format(name, len(traces),
+                                                                  sum(map(len, traces)) / len(traces)))
+        for decoder_name, decoder in [('state machine', legacy_decode), ('run-length', decode)]:
+            elapsed, errors = replay(traces, decoder)
+            print("  {:<14} {:>8.1f} us/trace  valid {:>6.1%}  missing data {:>6.1%}  crc {:>6.1%}".format(
+                decoder_name, elapsed * 1e6,
+                errors[DHT11Result.ERR_NO_ERROR] / len(traces),
+                errors[DHT11Result.ERR_MISSING_DATA] / len(traces),
+                errors[DHT11Result.ERR_CRC] / len(traces)))
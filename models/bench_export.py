@@ -0,0 +1,74 @@
+"""
+Benchmark of the columnar export: a history of full reports is exported in chunks, then opened
+with pandas from the memory-mapped columns and, for comparison, from a CSV file of the same rows.
+
+    python bench_export.py [reports]
+"""
+import datetime
+import mmap
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from log_export import export_reports, load_export
+
+default_reports = 2000000
+
+
+def full_reports(n):
+    start = datetime.datetime(2018, 4, 21)
+    for i in range(n):
+        timestamp = start + datetime.timedelta(seconds=30 * i)
+        yield {'BIM_id': 'BIM-{}'.format(i % 200),
+               'phase': 'Maturation',
+               'status': 'Maturation: Bad',
+               'temperature': 30 + (i % 97) / 10,
+               'moisture': 20 + (i % 89) / 10,
+               'pressure': 20 + (i % 83) / 10,
+               'begin_timestamp': timestamp,
+               'end_timestamp': timestamp + datetime.timedelta(seconds=30)}
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else default_reports
+    directory = tempfile.mkdtemp()
+    export_path = os.path.join(directory, 'full')
+
+    start = time.perf_counter()
+    export_reports(full_reports(n), export_path)
+    elapsed = time.perf_counter() - start
+    print("exported {} reports in {:.1f} s ({:.0f} reports/s), {:.1f} MB".format(
+        n, elapsed, n / elapsed, directory_size(export_path) / 1e6))
+
+    start = time.perf_counter()
+    frame = load_export(export_path)
+    open_elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    means = frame.groupby('BIM_id', observed=True)['temperature'].mean()
+    query_elapsed = time.perf_counter() - start
+    base = frame['temperature'].to_numpy()
+    while isinstance(base, np.ndarray):
+        base = base.base
+    zero_copy = isinstance(base, mmap.mmap)
+    print("columnar: opened in {:.1f} ms (memory-mapped: {}), mean temperature per plant in {:.1f} ms".format(
+        open_elapsed * 1e3, zero_copy, query_elapsed * 1e3))
+
+    csv_path = os.path.join(directory, 'full.csv')
+    frame.to_csv(csv_path, index=False)
+    start = time.perf_counter()
+    csv_frame = pd.read_csv(csv_path, parse_dates=['begin_timestamp', 'end_timestamp'])
+    csv_elapsed = time.perf_counter() - start
+    print("csv:      {:.1f} MB, parsed in {:.1f} ms".format(os.path.getsize(csv_path) / 1e6, csv_elapsed * 1e3))
+
+    assert np.allclose(csv_frame['temperature'].to_numpy(), frame['temperature'].to_numpy())
+    del frame
+    shutil.rmtree(directory)
@@ -0,0 +1,145 @@
+"""
+Throughput benchmark of the gateway: simulated nodes (child processes, each with its plants of
+SimulatedSensorBackend) send their readings to a Gateway on localhost, over TCP in batches as fast as they can
+and over UDP, one datagram per batch, paced at a total rate (unpaced, the nodes of the same machine outrun any
+receiver). The gateway runs the state machines of all the plants and saves their reports with an upload that
+only counts them (no server is needed).
+Reports for every transport and batch size the readings per second handled by the gateway, over the wall time
+and over the CPU time of its thread, and the readings lost (UDP drops the datagrams the gateway cannot keep up
+with). Runs on any machine:
+
+    python bench_gateway.py [nodes] [plants per node] [readings per plant]
+"""
+import contextlib
+import io
+import multiprocessing
+import sys
+import threading
+import time
+
+import flowchart_no_sensors
+from gateway import Gateway, GatewayClient
+from monitoring_core import MonitoringCore
+from plant_registry import PlantRegistry
+from sensor_backends import SimulatedSensorBackend
+
+default_nodes = 4
+default_plants = 50
+default_readings = 500
+
+# (transport, readings per message, readings per second of all the nodes, None -> as fast as possible)
+runs = [('tcp', 100, None), ('tcp', 10, None), ('tcp', 1, None), ('udp', 40, 40000), ('udp', 40, 20000),
+        ('udp', 1, 10000)]
+
+read_delay = 5
+maturation_duration = 24 * 60 * 60
+
+# the gateway is done when no reading arrived for this long (in seconds)
+idle_timeout = 2
+
+
+def node(address, transport, batch_size, rate, node_index, n_plants, n_readings, ready, start):
+    """Simulated node: readings are generated before the start, then sent at rate readings per second"""
+    start_time = time.time() - n_readings * read_delay
+    plants = {}
+    for i in range(n_plants):
+        seed = node_index * n_plants + i
+        backend = SimulatedSensorBackend(flowchart_no_sensors.params_expected_values,
+                                         flowchart_no_sensors.check_params, seed=seed, sample_period=read_delay,
+                                         maturation_duration=maturation_duration)
+        plants['BIM-{}'.format(seed)] = [backend.read_params() for _ in range(n_readings)]
+
+    client = GatewayClient(address, transport=transport, batch_size=batch_size)
+    for bim_id in plants:
+        client.register({'BIM_id': bim_id, 'loc': 'node {}'.format(node_index), 'pillar_number': bim_id})
+    ready.release()
+    start.wait()
+    sent = 0
+    begin = time.perf_counter()
+    for i in range(n_readings):
+        timestamp = start_time + i * read_delay
+        for bim_id, readings in plants.items():
+            client.send(bim_id, *readings[i], timestamp=timestamp)
+            sent += 1
+            if rate and not sent % batch_size:
+                ahead = begin + sent / rate - time.perf_counter()
+                if ahead > 0:
+                    time.sleep(ahead)
+    client.close()
+
+
+class CountingUpload(object):
+    def __init__(self):
+        self.reports = 0
+
+    def __call__(self, payload, file_detail):
+        self.reports += 1
+
+
+def run(transport, batch_size, rate, n_nodes, n_plants, n_readings):
+    upload = CountingUpload()
+    core = MonitoringCore(expected_values=flowchart_no_sensors.params_expected_values,
+                          tolerances=flowchart_no_sensors.params_tolerances,
+                          casting_read_delay=read_delay, maturation_read_delay=read_delay,
+                          full_report_sampling_rate=1, short_report_sampling_rate=5,
+                          upload=upload, registry=PlantRegistry())
+    gateway = Gateway(core, host='127.0.0.1', port=0, tick=0.01)
+    cpu = {}
+
+    def serve():
+        start = time.thread_time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            gateway.run()
+        cpu['gateway'] = time.thread_time() - start
+
+    server = threading.Thread(target=serve)
+    server.start()
+
+    ready = multiprocessing.Semaphore(0)
+    start = multiprocessing.Event()
+    nodes = [multiprocessing.Process(target=node, args=(gateway.address, transport, batch_size,
+                                                        rate and rate / n_nodes, i, n_plants, n_readings, ready,
+                                                        start))
+             for i in range(n_nodes)]
+    for process in nodes:
+        process.start()
+    for _ in nodes:
+        ready.acquire()
+
+    start_time = time.perf_counter()
+    start.set()
+    expected = n_nodes * n_plants * n_readings
+    handled = last_handled = 0
+    last_progress = time.perf_counter()
+    end_time = start_time
+    while handled < expected and time.perf_counter() - last_progress < idle_timeout:
+        time.sleep(0.01)
+        handled = gateway.readings + gateway.ignored
+        if handled != last_handled:
+            last_handled = handled
+            last_progress = end_time = time.perf_counter()
+    gateway.stop()
+    server.join()
+    for process in nodes:
+        process.join()
+    statistics = gateway.statistics()
+    gateway.close()
+
+    elapsed = end_time - start_time
+    print("{} x{:<4} {:>11} {:8d} readings in {:5.2f} s: {:7.0f} readings/s, {:7.0f} readings per CPU second of the "
+          "gateway, {:5.1f}% lost, {} plants ({} completed), {} reports".format(
+              transport, batch_size, 'at {}/s'.format(rate) if rate else 'unpaced', handled, elapsed,
+              handled / elapsed, handled / cpu['gateway'],
+              (expected - handled) / expected * 100, statistics['running'] + statistics['sessions'],
+              statistics['sessions'], upload.reports))
+
+
+if __name__ == '__main__':
+    n_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else default_nodes
+    n_plants = int(sys.argv[2]) if len(sys.argv) > 2 else default_plants
+    n_readings = int(sys.argv[3]) if len(sys.argv) > 3 else default_readings
+
+    print("{} nodes, {} plants per node, {} readings per plant, {} CPU".format(
+        n_nodes, n_plants, n_readings, multiprocessing.cpu_count()))
+    for transport, batch_size, rate in runs:
+        run(transport, batch_size, rate, n_nodes, n_plants, n_readings)
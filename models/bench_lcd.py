@@ -0,0 +1,100 @@
+"""
+Benchmark of the 2x16 status display on a mock SMBus: a sequence of status screens of a plant (phase, status
+and readings) is shown with the original lcd_display_string of each line and with framebuffer_lcd, reporting
+the bus transactions and bytes of each refresh, the estimated bus time at 100 kHz and the time the monitoring
+loop is blocked by an update. Runs on any machine, no hardware needed:
+
+    python bench_lcd.py [updates]
+"""
+import random
+import sys
+import time
+
+import I2C_LCD_driver
+from I2C_LCD_driver import framebuffer_lcd, lcd, mock_smbus
+
+default_updates = 200
+
+# I2C clock of the Pi, every byte takes 9 clocks (8 bits and the ack), plus start, stop and the address
+bus_clock = 100000
+
+
+def bus_time(transactions, bytes_written):
+    return (bytes_written + transactions) * 9 / bus_clock + transactions * 2 / bus_clock
+
+
+def status_screens(updates, seed=0):
+    """Lines of the status of a plant, the readings drift by little between two updates"""
+    rng = random.Random(seed)
+    temperature, moisture, pressure = 21.0, 45.0, 25.0
+    screens = []
+    for i in range(updates):
+        temperature += rng.gauss(0, 0.05)
+        moisture += rng.gauss(0, 0.2)
+        pressure += rng.gauss(0, 0.2)
+        status = 'Maturation: Good' if i % 50 < 45 else 'Maturation: Bad'
+        screens.append((status, 'T{:4.1f} M{:3.0f} P{:3.0f}'.format(temperature, moisture, pressure)))
+    return screens
+
+
+def run(screens, buffered):
+    bus = mock_smbus()
+    if buffered:
+        display = framebuffer_lcd(bus)
+        display.flush()
+    else:
+        display = lcd(bus)
+    first_transactions, first_bytes = bus.transactions, bus.bytes_written
+
+    blocked = []
+    for line1, line2 in screens:
+        start = time.perf_counter()
+        if buffered:
+            display.lcd_display_lines(line1, line2)
+        else:
+            display.lcd_display_string(line1.ljust(16), 1)
+            display.lcd_display_string(line2.ljust(16), 2)
+        blocked.append(time.perf_counter() - start)
+        if buffered:
+            # one refresh per update, as the monitoring loop shows a status every few seconds
+            display.flush()
+    if buffered:
+        display.stop()
+
+    assert [bus.line(1), bus.line(2)] == [line.ljust(16) for line in screens[-1]]
+    transactions = (bus.transactions - first_transactions) / len(screens)
+    bytes_written = (bus.bytes_written - first_bytes) / len(screens)
+    return transactions, bytes_written, sorted(blocked)
+
+
+if __name__ == '__main__':
+    n_updates = int(sys.argv[1]) if len(sys.argv) > 1 else default_updates
+    screens = status_screens(n_updates)
+
+    for label, buffered in [('lcd_display_string', False), ('framebuffer_lcd', True)]:
+        transactions, bytes_written, blocked = run(screens, buffered)
+        print("{:<19} {:6.1f} transactions, {:6.1f} bytes per update, bus {:5.1f} ms, "
+              "caller blocked p50 {:.3f} ms, max {:.3f} ms".format(
+                  label, transactions, bytes_written, bus_time(transactions, bytes_written) * 1e3,
+                  blocked[len(blocked) // 2] * 1e3, blocked[-1] * 1e3))
+
+    # a full refresh of every cell, e.g. the first screen after a clear
+    for label, buffered in [('full refresh, lcd', False), ('full refresh, burst', True)]:
+        bus = mock_smbus()
+        if buffered:
+            display = framebuffer_lcd(bus)
+            display.flush()
+            before = bus.transactions, bus.bytes_written
+            display.lcd_display_lines('A' * 16, 'B' * 16)
+            display.flush()
+            display.stop()
+        else:
+            display = lcd(bus)
+            before = bus.transactions, bus.bytes_written
+            display.lcd_display_string('A' * 16, 1)
+            display.lcd_display_string('B' * 16, 2)
+        transactions = bus.transactions - before[0]
+        bytes_written = bus.bytes_written - before[1]
+        print("{:<19} {:6d} transactions, {:6d} bytes, bus {:5.1f} ms".format(
+            label, transactions, bytes_written, bus_time(transactions, bytes_written) * 1e3))
+    print("(the sleeps of the driver are real, {} block bytes per transaction)".format(I2C_LCD_driver.I2C_BLOCK_MAX))
@@ -0,0 +1,168 @@
+"""
+Benchmark of the status LEDs of many plants driven by one board, on a mock GPIO:
+- status updates: every sample of every plant outputs its color (as the monitoring loop does), with the
+  previous switch off all + turn on (4 GPIO writes per sample) and with StatusLights, which writes only
+  the transitions;
+- blinking: the red LED of every plant blinks, with a sleeping thread per LED and with the single timer
+  thread of LEDController, reporting the error of the edges from their ideal time (the threads drift by
+  their sleep overshoots, the timers stay within the tick of the wheel) and the CPU time.
+Runs on any machine, no hardware needed:
+
+    python bench_leds.py [plants] [samples per plant] [blink seconds]
+"""
+import random
+import sys
+import threading
+import time
+
+from status_leds import LEDController, StatusLights, status_colors
+
+default_plants = 200
+default_samples = 500
+default_blink_duration = 30
+
+# probability that the status of a plant changes between two samples
+status_change_rate = 0.05
+
+blink_time = 0.25
+
+
+class MockGPIO(object):
+    """Counts the writes of GPIO.output, optionally recording their time"""
+
+    def __init__(self, record=False):
+        self.writes = 0
+        self.edges = [] if record else None
+        self._lock = threading.Lock()
+
+    def output(self, pin, level):
+        with self._lock:
+            self.writes += 1
+            if self.edges is not None:
+                self.edges.append((time.monotonic(), pin, level))
+
+
+def status_sequences(plants, samples, seed=0):
+    rng = random.Random(seed)
+    sequences = []
+    for _ in range(plants):
+        color = 'G'
+        sequence = []
+        for _ in range(samples):
+            if rng.random() < status_change_rate:
+                color = rng.choice(status_colors)
+            sequence.append(color)
+        sequences.append(sequence)
+    return sequences
+
+
+def legacy_status_output(output, pins):
+    """Light output with the previous RPiConfigs calls: switch_off_all and change_LED_status"""
+    def light_output(color):
+        for pin in pins.values():
+            output(pin, False)
+        output(pins[color], True)
+    return light_output
+
+
+def percentile(values, q):
+    return sorted(values)[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+def edge_errors(edges, starts):
+    """Distance of every edge from its ideal time, start of the pattern + k * blink_time"""
+    errors = []
+    for edge_time, pin, level in edges:
+        start = starts.get(pin)
+        if start is None or edge_time < start:
+            continue
+        k = round((edge_time - start) / blink_time)
+        errors.append(abs(edge_time - (start + k * blink_time)))
+    return errors
+
+
+def legacy_blink(output, pin, stop):
+    while not stop.is_set():
+        output(pin, True)
+        time.sleep(blink_time)
+        output(pin, False)
+        time.sleep(blink_time)
+
+
+if __name__ == '__main__':
+    n_plants = int(sys.argv[1]) if len(sys.argv) > 1 else default_plants
+    n_samples = int(sys.argv[2]) if len(sys.argv) > 2 else default_samples
+    blink_duration = float(sys.argv[3]) if len(sys.argv) > 3 else default_blink_duration
+
+    sequences = status_sequences(n_plants, n_samples)
+    pins = [{color: 3 * plant + i for i, color in enumerate(status_colors)} for plant in range(n_plants)]
+    updates = n_plants * n_samples
+
+    gpio = MockGPIO()
+    outputs = [legacy_status_output(gpio.output, plant_pins) for plant_pins in pins]
+    start = time.perf_counter()
+    for i in range(n_samples):
+        for plant in range(n_plants):
+            outputs[plant](sequences[plant][i])
+    elapsed = time.perf_counter() - start
+    print("{} plants, {} status updates, switch off all + on: {} GPIO writes ({:.2f} per update), "
+          "{:.2f} us per update".format(n_plants, updates, gpio.writes, gpio.writes / updates, elapsed / updates * 1e6))
+
+    gpio = MockGPIO()
+    controller = LEDController(gpio.output)
+    outputs = []
+    for plant, plant_pins in enumerate(pins):
+        for color, pin in plant_pins.items():
+            controller.add((plant, color), pin)
+        outputs.append(StatusLights(controller, {color: (plant, color) for color in status_colors}))
+    setup_writes = gpio.writes
+    start = time.perf_counter()
+    for i in range(n_samples):
+        for plant in range(n_plants):
+            outputs[plant](sequences[plant][i])
+    elapsed = time.perf_counter() - start
+    writes = gpio.writes - setup_writes
+    print("{} plants, {} status updates, StatusLights:          {} GPIO writes ({:.2f} per update), "
+          "{:.2f} us per update".format(n_plants, updates, writes, writes / updates, elapsed / updates * 1e6))
+    controller.close()
+
+    # blinking red LEDs
+    gpio = MockGPIO(record=True)
+    stop = threading.Event()
+    starts = {}
+    threads = []
+    cpu = time.process_time()
+    for plant_pins in pins:
+        starts[plant_pins['R']] = time.monotonic()
+        thread = threading.Thread(target=legacy_blink, args=(gpio.output, plant_pins['R'], stop))
+        thread.start()
+        threads.append(thread)
+    time.sleep(blink_duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    cpu = time.process_time() - cpu
+    errors = [error * 1e3 for error in edge_errors(gpio.edges, starts)]
+    print("{} LEDs blinking, a thread per LED:       edge error p50 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms, "
+          "CPU {:.0f}%, {} threads".format(n_plants, percentile(errors, 50), percentile(errors, 99), max(errors),
+                                           cpu / blink_duration * 100, len(threads)))
+
+    gpio = MockGPIO(record=True)
+    controller = LEDController(gpio.output)
+    for plant, plant_pins in enumerate(pins):
+        controller.add(plant, plant_pins['R'])
+    gpio.edges = []
+    starts = {}
+    cpu = time.process_time()
+    for plant, plant_pins in enumerate(pins):
+        starts[plant_pins['R']] = time.monotonic()
+        controller.blink(plant, blink_time)
+    time.sleep(blink_duration)
+    cpu = time.process_time() - cpu
+    # the LEDs switched off by close are not edges of the pattern
+    edges, gpio.edges = gpio.edges, None
+    controller.close()
+    errors = [error * 1e3 for error in edge_errors(edges, starts)]
+    print("{} LEDs blinking, LEDController:         edge error p50 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms, "
+          "CPU {:.0f}%, 1 thread".format(n_plants, percentile(errors, 50), percentile(errors, 99), max(errors),
+                                         cpu / blink_duration * 100))
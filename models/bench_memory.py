@@ -0,0 +1,60 @@
+"""
+Memory benchmark of log_full: bytes per sample of the list of dicts
+against the ReportAccumulator, whose size does not grow with the samples.
+
+    python bench_memory.py [samples]
+"""
+import datetime
+import sys
+import tracemalloc
+
+from log_processing import ReportAccumulator
+
+default_samples = 100000
+
+
+def measure(build, n_samples):
+    tracemalloc.start()
+    log = build(n_samples)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(log) == n_samples
+    return size
+
+
+def build_dict_log(n_samples):
+    start = datetime.datetime.now()
+    log = []
+    for i in range(n_samples):
+        log.append({'BIM_id': 'BIM-0',
+                    'phase': 'Maturation',
+                    'status': 'Maturation' + ': Bad',
+                    'begin_timestamp': start,
+                    'end_timestamp': datetime.datetime.now(),
+                    'moisture': 25.0 + i % 10,
+                    'temperature': 30.0 + i % 10,
+                    'pressure': 25.0 + i % 10})
+    return log
+
+
+def build_accumulator(n_samples):
+    start = datetime.datetime.now()
+    log = ReportAccumulator('BIM-0')
+    for i in range(n_samples):
+        log.append(phase='Maturation',
+                   status='Maturation' + ': Bad',
+                   begin_timestamp=start,
+                   end_timestamp=datetime.datetime.now(),
+                   moisture=25.0 + i % 10,
+                   temperature=30.0 + i % 10,
+                   pressure=25.0 + i % 10)
+    return log
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else default_samples
+    dict_size = measure(build_dict_log, n)
+    accumulator_size = measure(build_accumulator, n)
+    print("{} samples".format(n))
+    print("list of dicts:     {:.1f} bytes/sample".format(dict_size / n))
+    print("ReportAccumulator: {:.3f} bytes/sample ({} bytes)".format(accumulator_size / n, accumulator_size))
@@ -0,0 +1,86 @@
+"""
+Benchmark of the report outbox: the reports accumulated during a network outage
+are stored on disk and then replayed to a local stub server when the link returns.
+
+    python bench_outbox.py [reports]
+"""
+import http.server
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from outbox import ReportOutbox
+from server_connection import ReportUploader
+
+default_reports = 100000
+
+
+class StubServerHandler(http.server.BaseHTTPRequestHandler):
+    """Accepts the bulk reports (and the plants) and counts the reports"""
+    protocol_version = 'HTTP/1.1'
+    received = 0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.path.endswith('_summary'):
+            StubServerHandler.received += len(json.loads(body))
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server():
+    """Starts the stub server on a free local port, returns its root url"""
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StubServerHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{}/'.format(server.server_address[1])
+
+
+def sample_report(i):
+    return {'BIM_id': 'BIM-{}'.format(i % 200),
+            'phase': 'Maturation',
+            'status': 'Maturation: Bad',
+            'temperature': 30.125,
+            'moisture': 25.5,
+            'pressure': 25.5,
+            'begin_timestamp': '2018-04-21 05:24:39.000000',
+            'end_timestamp': '2018-04-21 05:25:09.000000'}
+
+
+def run_benchmark(n_reports):
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'outbox.sqlite3')
+
+    # network outage: the reports are only stored in the outbox
+    outbox = ReportOutbox(path=path)
+    start = time.perf_counter()
+    for i in range(n_reports):
+        outbox.append(sample_report(i), 'full' if i % 10 else 'short')
+    append_elapsed = time.perf_counter() - start
+    size_before = os.path.getsize(path)
+    outbox.close()
+
+    # restart with the link back: the outbox is replayed to the server
+    server, root_url = start_stub_server()
+    start = time.perf_counter()
+    uploader = ReportUploader(root_url=root_url, outbox=ReportOutbox(path=path))
+    uploader.flush()
+    replay_elapsed = time.perf_counter() - start
+    uploader.close()
+    server.shutdown()
+
+    assert StubServerHandler.received == n_reports
+    print("Appended {} reports in {:.2f} s ({:.0f} reports/s), outbox size {:.1f} MB".format(
+        n_reports, append_elapsed, n_reports / append_elapsed, size_before / 1e6))
+    print("Replayed {} reports in {:.2f} s ({:.0f} reports/s), outbox size after compaction {:.1f} MB".format(
+        n_reports, replay_elapsed, n_reports / replay_elapsed, os.path.getsize(path) / 1e6))
+
+
+if __name__ == '__main__':
+    run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else default_reports)
@@ -0,0 +1,111 @@
+"""
+Load generator of the whole monitoring pipeline without hardware: every plant reads a
+SimulatedSensorBackend, the samples go through the checks of flowchart_no_sensors, the
+aggregation of the reports and the background uploader, which posts to a local stub server.
+
+    python bench_pipeline.py [plants] [dropout rate] [crc error rate] [failure rate]
+"""
+import contextlib
+import io
+import sys
+import time
+import types
+
+import flowchart_no_sensors
+import plant_registry
+import server_connection
+from bench_outbox import StubServerHandler, start_stub_server
+from monitoring_scheduler import MonitoringScheduler
+from sensor_backends import SimulatedSensorBackend
+
+default_plants = 100
+
+# resolution of the timer wheel (in seconds)
+tick = 0.001
+
+# simulated duration of the phases (in seconds, at one sample every 5 seconds)
+casting_duration = 30 * 60
+maturation_duration = 2 * 60 * 60
+
+
+def make_core():
+    """Core with the flowchart checks and report savers, without delays between the samples"""
+    return types.SimpleNamespace(
+        classify_params=flowchart_no_sensors.classify_params,
+        update_params=None,
+        status_light_output=lambda color: None,
+        save_full_report=flowchart_no_sensors.save_full_report,
+        save_short_report=flowchart_no_sensors.save_short_report,
+        casting_read_delay=0,
+        maturation_read_delay=0,
+        full_report_sampling_rate=0.05,
+        short_report_rate=lambda phase: 0.2)
+
+
+def make_plant(i):
+    return flowchart_no_sensors.init_plant(b3f_id='b3f-{}'.format(i), name='Pilastro {}'.format(i),
+                                           type='Pilastro', desc='n\\a', loc='Milano>E10>P1', cls='C25/30',
+                                           status='Ordered', n_issues='0', n_open_issues='0', n_checklists='1',
+                                           n_open_checklists='1', date_created='2018-04-21 05:24:39',
+                                           contractor='Appaltatore 1', completion_percentage='50',
+                                           pillar_number=str(i), superficial_quality='Bassa',
+                                           bim_id='BIM-{}'.format(i))
+
+
+def run_benchmark(n_plants, dropout_rate=0.01, crc_error_rate=0.05, failure_rate=0.0):
+    server, root_url = start_stub_server()
+    previous_registry = plant_registry.set_registry(plant_registry.PlantRegistry())
+    uploader = server_connection.ReportUploader(root_url=root_url, delay=0.1)
+    previous = server_connection.set_uploader(uploader)
+
+    scheduler = MonitoringScheduler(core=make_core(), tick=tick)
+    sensors = []
+    for i in range(n_plants):
+        sensor = SimulatedSensorBackend(expected_values=flowchart_no_sensors.params_expected_values,
+                                        check_params=flowchart_no_sensors.check_params, seed=i,
+                                        casting_duration=casting_duration, maturation_duration=maturation_duration,
+                                        dropout_rate=dropout_rate, crc_error_rate=crc_error_rate,
+                                        failure_rate=failure_rate)
+        sensors.append(sensor)
+        scheduler.add_plant(make_plant(i), read_params=sensor.read_params)
+
+    # the report savers print every report
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        results = scheduler.run()
+        elapsed = time.perf_counter() - start
+        scheduler.close()
+        uploader.flush()
+        total = time.perf_counter() - start
+        uploader.close()
+
+    server_connection.set_uploader(previous)
+    plant_registry.set_registry(previous_registry)
+    server.shutdown()
+
+    samples = sum(monitor.samples for monitor in scheduler.monitors)
+    return {'elapsed': elapsed,
+            'total': total,
+            'samples': samples,
+            'completed': sum(1 for result in results if result),
+            'reports': uploader.sent,
+            'received': StubServerHandler.received,
+            'failed': uploader.failed,
+            'crc_errors': sum(sensor.crc_errors for sensor in sensors),
+            'dropouts': sum(sensor.dropouts for sensor in sensors)}
+
+
+if __name__ == '__main__':
+    n_plants = int(sys.argv[1]) if len(sys.argv) > 1 else default_plants
+    rates = [float(arg) for arg in sys.argv[2:5]]
+    stats = run_benchmark(n_plants, *rates)
+
+    print("plants:            {}".format(n_plants))
+    print("completed casts:   {}".format(stats['completed']))
+    print("samples:           {} ({:.0f} samples/s)".format(stats['samples'], stats['samples'] / stats['elapsed']))
+    print("crc errors:        {}".format(stats['crc_errors']))
+    print("dropouts:          {}".format(stats['dropouts']))
+    print("reports uploaded:  {} (received {}, failed {})".format(stats['reports'], stats['received'],
+                                                                 stats['failed']))
+    print("monitoring time:   {:.2f} s, with the upload of the last reports {:.2f} s".format(stats['elapsed'],
+                                                                                         stats['total']))
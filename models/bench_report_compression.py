@@ -0,0 +1,140 @@
+"""
+Replay harness of the report compression: plants of SimulatedSensorBackend are monitored by PlantMonitor on a
+simulated clock, with the reports uploaded through a ReportCompressor for several scales of the default
+deadbands (0 only drops the duplicated reports), reporting for each kind of report the reports and the bytes
+(as JSON) uploaded, the reduction ratio, the largest error of the readings seen by the server (the last report
+uploaded of the plant) from the readings of the reports suppressed, the longest silence of a plant (the
+heartbeat is checked when a report arrives, so up to a report period longer than the heartbeat) and the largest
+gap between the full reports uploaded of a plant (the suppressed windows are folded into the reports uploaded).
+Runs on any machine, no hardware needed:
+
+    python bench_report_compression.py [plants] [maturation hours]
+"""
+import contextlib
+import datetime
+import io
+import json
+import sys
+
+import flowchart_no_sensors
+from log_processing import file_suffix, process_params
+from monitoring_core import MonitoringCore
+from monitoring_scheduler import PlantMonitor
+from plant_registry import PlantRegistry
+from report_compression import ReportCompressor, default_deadbands, default_heartbeat
+from sensor_backends import SimulatedSensorBackend
+
+default_plants = 10
+default_maturation_hours = 12
+
+deadband_scales = [0, 0.5, 1, 2]
+
+read_delay = 5
+full_report_sampling_rate = 30
+short_report_sampling_rate = 120
+casting_duration = 30 * 60
+
+
+class ReportRecorder(object):
+    """Upload of the reports received by the compressor (received) or uploaded by it (sent), with the error
+    of the readings seen by the server when a report is suppressed"""
+
+    def __init__(self):
+        self.clock = 0.0
+        self.reports = {detail: 0 for detail in file_suffix}
+        self.bytes = {detail: 0 for detail in file_suffix}
+        self.last = {}  # (file_detail, BIM_id) -> (time, report) of the last report
+        self.errors = {param: 0.0 for param in process_params}
+        self.silence = 0.0
+        self.gap = datetime.timedelta(0)
+        self.ends = {}  # BIM_id -> latest end_timestamp of the full reports
+
+    def __call__(self, payload, file_detail):
+        self.reports[file_detail] += 1
+        self.bytes[file_detail] += len(json.dumps(payload, default=str))
+        key = (file_detail, payload['BIM_id'])
+        if key in self.last:
+            self.silence = max(self.silence, self.clock - self.last[key][0])
+        if file_detail == file_suffix[1] and payload['begin_timestamp'] <= payload['end_timestamp']:
+            # the first window of a PlantMonitor created without a time begins at the wall clock time
+            if payload['BIM_id'] in self.ends:
+                self.gap = max(self.gap, payload['begin_timestamp'] - self.ends[payload['BIM_id']])
+            self.ends[payload['BIM_id']] = max(self.ends.get(payload['BIM_id'], payload['end_timestamp']),
+                                               payload['end_timestamp'])
+        self.last[key] = (self.clock, payload)
+
+    def observe(self, payload, file_detail):
+        """Error of the server from a report received by the compressor, after the compressor handled it"""
+        _, server = self.last[(file_detail, payload['BIM_id'])]
+        for param in process_params:
+            self.errors[param] = max(self.errors[param], abs(payload[param] - server[param]))
+
+
+def replay(backend, core, recorder, compressor, bim_id):
+    """Monitors a plant on a simulated clock, uploading its reports"""
+    start = datetime.datetime(2018, 4, 21)
+    monitor = PlantMonitor({'BIM_id': bim_id}, core, read_params=backend.read_params,
+                           light_output=lambda color: None)
+    t = 0.0
+    next_full = full_report_sampling_rate
+    next_short = short_report_sampling_rate
+    while not monitor.done:
+        now = start + datetime.timedelta(seconds=t)
+        monitor.process_sample(*backend.read_params(), now=now)
+        while next_full <= t:
+            monitor.full_report(now=now)
+            next_full += full_report_sampling_rate
+        while next_short <= t:
+            monitor.short_report(now=now)
+            next_short += short_report_sampling_rate
+        recorder.clock = t
+        for report in monitor.pop_reports():
+            report()
+        t += read_delay
+    compressor.forget(bim_id)
+
+
+def observing(compressor, recorder):
+    """Upload of MonitoringCore: the compressor, then the error of the server"""
+    def upload(payload, file_detail):
+        compressor(payload=payload, file_detail=file_detail)
+        recorder.observe(payload, file_detail)
+    return upload
+
+
+def run(n_plants, maturation_duration, scale):
+    recorder = ReportRecorder()
+    compressor = ReportCompressor(recorder, deadbands={param: band * scale for param, band in
+                                                       default_deadbands.items()},
+                                  clock=lambda: recorder.clock)
+    core = MonitoringCore(expected_values=flowchart_no_sensors.params_expected_values,
+                          tolerances=flowchart_no_sensors.params_tolerances,
+                          casting_read_delay=read_delay, maturation_read_delay=read_delay,
+                          full_report_sampling_rate=full_report_sampling_rate,
+                          short_report_sampling_rate=short_report_sampling_rate,
+                          upload=observing(compressor, recorder), registry=PlantRegistry())
+    for seed in range(n_plants):
+        backend = SimulatedSensorBackend(flowchart_no_sensors.params_expected_values, core.check_params, seed=seed,
+                                         sample_period=read_delay, casting_duration=casting_duration,
+                                         maturation_duration=maturation_duration)
+        replay(backend, core, recorder, compressor, 'BIM-{}'.format(seed))
+    return compressor.statistics(), recorder
+
+
+if __name__ == '__main__':
+    n_plants = int(sys.argv[1]) if len(sys.argv) > 1 else default_plants
+    maturation_duration = float(sys.argv[2]) * 3600 if len(sys.argv) > 2 else default_maturation_hours * 3600
+
+    print("{} plants, heartbeat {} s, deadbands {}".format(n_plants, default_heartbeat, default_deadbands))
+    for scale in deadband_scales:
+        with contextlib.redirect_stdout(io.StringIO()):
+            statistics, recorder = run(n_plants, maturation_duration, scale)
+        for detail in file_suffix:
+            counts = statistics[detail]
+            print("deadbands x{:<4} {:<5} {:6d} received, {:6d} sent ({:4d} heartbeats), reduction {:5.1f}x, "
+                  "{:8.1f} kB uploaded".format(scale, detail, counts['received'], counts['sent'], counts['heartbeats'],
+                                               counts['reduction_ratio'], recorder.bytes[detail] / 1e3))
+        print("{:<16} max error seen by the server {}, longest silence of a plant {:.0f} s, largest gap between "
+              "full reports {:.0f} s".format('', ', '.join('{} {:.2f}'.format(param, error)
+                                                          for param, error in recorder.errors.items()),
+                                             recorder.silence, recorder.gap.total_seconds()))
@@ -0,0 +1,123 @@
+"""
+Benchmark of the monitoring scheduler: the CPU overhead per sample should stay flat while the number of
+plants monitored in the same process grows, and so should the cost of a tick of the timer wheel while the
+number of timers grows. Sensors, server and clock are simulated (the scheduler waits by advancing the clock),
+so every plant takes the same samples and reports whatever the number of plants, and it can be run on any
+machine:
+
+    python bench_scheduler.py
+"""
+import time
+import types
+
+import flowchart_no_sensors
+from monitoring_scheduler import MonitoringScheduler
+from timer_wheel import TimerWheel
+
+plants_counts = [1, 10, 100, 1000]
+timers_counts = [1000, 10000, 100000]
+
+# resolution of the timer wheel of the scheduler (in simulated seconds)
+tick = 0.5
+
+# resolution of the timer wheel of the tick benchmark (in seconds)
+wheel_tick = 0.001
+
+# sampling and report periods of the simulated plants (in simulated seconds)
+read_delay = 5
+full_report_sampling_rate = 30
+short_report_sampling_rate = 120
+
+# samples in the warning band before the parameters are as expected, for each phase
+warning_samples = 50
+
+
+class SimulatedClock(object):
+    """Monotonic clock of the scheduler, advanced by its waits"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def make_core(reports):
+    """Core with the flowchart checks and report savers that only count the reports"""
+    return types.SimpleNamespace(
+        classify_params=flowchart_no_sensors.classify_params,
+        update_params=None,
+        status_light_output=lambda color: None,
+        save_full_report=lambda log: reports.append('full'),
+        save_short_report=lambda plant, **kwargs: reports.append('short'),
+        casting_read_delay=read_delay,
+        maturation_read_delay=read_delay,
+        full_report_sampling_rate=full_report_sampling_rate,
+        short_report_rate=lambda phase: short_report_sampling_rate)
+
+
+def simulated_sensor(samples_per_phase):
+    """Reads values in the warning band and then the expected ones, phase after phase"""
+    expected = flowchart_no_sensors.params_expected_values
+    readings = []
+    for phase in ['casting', 'maturation']:
+        warning = (expected['moisture'][phase] + 5,
+                   expected['temperature'][phase] + 5,
+                   expected['pressure'][phase] + 5)
+        safe = (expected['moisture'][phase],
+                expected['temperature'][phase],
+                expected['pressure'][phase])
+        readings.extend([warning] * samples_per_phase + [safe])
+    readings = iter(readings)
+    return lambda: next(readings)
+
+
+def run_benchmark(n_plants):
+    reports = []
+    clock = SimulatedClock()
+    scheduler = MonitoringScheduler(core=make_core(reports), tick=tick, clock=clock, sleep=clock.sleep)
+    for i in range(n_plants):
+        plant = {'BIM_id': 'BIM-{}'.format(i)}
+        scheduler.add_plant(plant, read_params=simulated_sensor(warning_samples))
+
+    start = time.process_time()
+    results = scheduler.run()
+    elapsed = time.process_time() - start
+    scheduler.close()
+
+    assert all(results)
+    samples = sum(monitor.samples for monitor in scheduler.monitors)
+    return elapsed, samples, len(reports)
+
+
+def run_wheel_benchmark(n_timers, n_ticks=1000):
+    """Timers spread over 100 s, the wheel is advanced tick by tick on a simulated clock"""
+    clock = [0.0]
+    wheel = TimerWheel(tick=wheel_tick, clock=lambda: clock[0])
+    fired = []
+    for i in range(n_timers):
+        wheel.schedule(delay=(i * 100.0 / n_timers), callback=lambda: fired.append(None),
+                       period=100.0)
+
+    start = time.process_time()
+    for i in range(1, n_ticks + 1):
+        wheel.advance(i * wheel_tick)
+    elapsed = time.process_time() - start
+    return elapsed, len(fired)
+
+
+if __name__ == '__main__':
+    print("{:>8} {:>10} {:>10} {:>14} {:>12} {:>10}".format('plants', 'samples', 'reports', 'reports/plant',
+                                                            'CPU [s]', 'us/sample'))
+    for n in plants_counts:
+        elapsed, samples, reports = run_benchmark(n)
+        print("{:>8} {:>10} {:>10} {:>14.1f} {:>12.3f} {:>10.2f}".format(n, samples, reports, reports / n, elapsed,
+                                                                        elapsed / samples * 1e6))
+
+    print("\n{:>8} {:>10} {:>10}".format('timers', 'fired', 'us/tick'))
+    for n in timers_counts:
+        elapsed, fired = run_wheel_benchmark(n)
+        print("{:>8} {:>10} {:>10.2f}".format(n, fired, elapsed / 1000 * 1e6))
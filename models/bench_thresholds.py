@@ -0,0 +1,84 @@
+"""
+Benchmark of the range checks: the previous per-key check with nested dict lookups, the
+precompiled ThresholdTable on single samples and its vectorized classification of whole batches.
+
+    python bench_thresholds.py
+"""
+import time
+
+import numpy as np
+
+import flowchart_no_sensors
+from thresholds import FAIL, SAFE, WARNING, ThresholdTable
+
+batch_sizes = [1000, 100000, 1000000]
+
+
+def legacy_check_param_in_range(param_key, param_value, phase, urgency_label):
+    expected = flowchart_no_sensors.params_expected_values
+    tolerances = flowchart_no_sensors.params_tolerances
+    return True if ((float(param_value) < expected[param_key][phase] + tolerances[param_key][urgency_label])
+                    and (float(param_value) > expected[param_key][phase] - tolerances[param_key][urgency_label])) \
+        else False
+
+
+def legacy_check_params(current_params, phase, urgency_label):
+    """Check of the flowcharts before the threshold table, kept as a reference"""
+    for key, value in current_params.items():
+        if not legacy_check_param_in_range(key, value, phase, urgency_label):
+            return False
+    return True
+
+
+def legacy_classify(current_params, phase):
+    if legacy_check_params(current_params, phase, 'safe'):
+        return SAFE
+    if legacy_check_params(current_params, phase, 'warning'):
+        return WARNING
+    return FAIL
+
+
+def random_samples(n, table, phase, rng):
+    """Samples around the expected values of the phase, spread over the three classes"""
+    center = table.lower[table.phase_indexes[phase], 0] + (table.upper[table.phase_indexes[phase], 0] -
+                                                             table.lower[table.phase_indexes[phase], 0]) / 2
+    return center + rng.normal(0, 4, size=(n, len(table.params)))
+
+
+if __name__ == '__main__':
+    table = ThresholdTable(flowchart_no_sensors.params_expected_values, flowchart_no_sensors.params_tolerances,
+                           params=flowchart_no_sensors.process_params)
+    rng = np.random.default_rng(0)
+
+    print("{:>9} {:>14} {:>14} {:>14}".format('samples', 'legacy us/smp', 'table us/smp', 'batch ns/smp'))
+    for n in batch_sizes:
+        values = random_samples(n, table, 'maturation', rng)
+        dicts = [dict(zip(table.params, row)) for row in values.tolist()]
+
+        # the per-sample paths are timed on a subset of the large batches
+        subset = dicts[:100000]
+        start = time.perf_counter()
+        legacy = [legacy_classify(sample, 'maturation') for sample in subset]
+        legacy_elapsed = (time.perf_counter() - start) / len(subset)
+
+        start = time.perf_counter()
+        single = [table.classify(sample, 'maturation') for sample in subset]
+        single_elapsed = (time.perf_counter() - start) / len(subset)
+
+        start = time.perf_counter()
+        codes = table.classify_batch(values, 'maturation')
+        batch_elapsed = (time.perf_counter() - start) / n
+
+        assert legacy == single == codes[:len(subset)].tolist()
+        print("{:>9} {:>14.3f} {:>14.3f} {:>14.1f}".format(n, legacy_elapsed * 1e6, single_elapsed * 1e6,
+                                                            batch_elapsed * 1e9))
+
+    # last sample of many plants, each in its own phase
+    n_plants = 100000
+    phases = rng.integers(0, len(table.phases), size=n_plants)
+    values = np.stack([random_samples(1, table, table.phases[p], rng)[0] for p in phases])
+    start = time.perf_counter()
+    codes = table.classify_batch(values, phases)
+    elapsed = time.perf_counter() - start
+    print("\n{} plants classified in {:.2f} ms (safe {}, warning {}, fail {})".format(
+        n_plants, elapsed * 1e3, *np.bincount(codes, minlength=3)))
@@ -0,0 +1,77 @@
+"""
+Benchmark of the time series store: months of readings of a plant (one every 5 seconds)
+are appended, then ranges of growing length are queried at every resolution.
+Reports the append rate, the query latencies and the space used with the default retention.
+
+    python bench_timeseries.py [days]
+"""
+import datetime
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from timeseries_store import TimeSeriesStore, resolutions
+
+default_days = 180
+
+# delay between two readings (in seconds)
+sample_period = 5
+
+query_ranges = [('1 hour', datetime.timedelta(hours=1)),
+                ('1 day', datetime.timedelta(days=1)),
+                ('1 week', datetime.timedelta(days=7)),
+                ('1 month', datetime.timedelta(days=30)),
+                ('6 months', datetime.timedelta(days=180))]
+
+query_repetitions = 20
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def fill(store, bim_id, start, days):
+    """Appends the readings of a maturation with a daily temperature cycle"""
+    samples = days * 24 * 60 * 60 // sample_period
+    step = datetime.timedelta(seconds=sample_period)
+    timestamp = start
+    for i in range(samples):
+        daily = math.sin(2 * math.pi * i * sample_period / 86400)
+        store.append(bim_id, timestamp, moisture=20 + daily, temperature=40 + 3 * daily, pressure=20 - daily)
+        timestamp += step
+    store.flush()
+    return samples, timestamp
+
+
+if __name__ == '__main__':
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else default_days
+    directory = tempfile.mkdtemp()
+    store = TimeSeriesStore(path=directory)
+    start = datetime.datetime(2018, 4, 21)
+
+    begin = time.perf_counter()
+    samples, end = fill(store, 'BIM-0', start, days)
+    elapsed = time.perf_counter() - begin
+    print("{} days, {} readings appended in {:.1f} s ({:.0f} readings/s)".format(days, samples, elapsed,
+                                                                                samples / elapsed))
+    print("space used with the default retention: {:.1f} MB (raw readings without retention: {:.1f} MB)\n".format(
+        directory_size(directory) / 1e6, samples * 20 / 1e6))
+
+    # reopened store: the chunks are memory-mapped on the first query
+    store.close()
+    store = TimeSeriesStore(path=directory)
+
+    print("{:>10} {:>8} {:>10} {:>10}".format('range', 'level', 'points', 'ms/query'))
+    for label, length in query_ranges:
+        for resolution in list(resolutions) + ['auto']:
+            begin = time.perf_counter()
+            for _ in range(query_repetitions):
+                records = store.query('BIM-0', end - length, end, resolution=resolution)
+            elapsed = (time.perf_counter() - begin) / query_repetitions
+            print("{:>10} {:>8} {:>10} {:>10.3f}".format(label, resolution, len(records), elapsed * 1e3))
+
+    store.close()
+    shutil.rmtree(directory)
@@ -0,0 +1,90 @@
+"""
+Size and speed of the encodings of the short reports: one GET query string per report with the plant fields
+(send_log_to_server), the JSON batches of ReportUploader with and without the plant fields and the binary
+wire format, for the first batch of a session (with the plants) and for the following ones.
+Also the time to build a short report, merged with the plant fields or with the readings only.
+
+    python bench_wire_format.py [plants] [batch size]
+"""
+import datetime
+import json
+import sys
+import time
+from urllib.parse import urlencode
+
+import wire_format
+from log_processing import extract_average_from_batch
+from monitoring_core import init_plant, merge_two_dicts
+from plant_registry import PlantRegistry
+
+default_plants = 200
+default_batch_size = 500  # max_batch_size of ReportUploader
+repeats = 20
+
+
+def make_plants(n_plants):
+    return [init_plant('B3F-{}'.format(i), 'Pilastro {}'.format(i), 'Pilastro', 'Pilastro in c.a. gettato in opera',
+                       'Edificio A/Piano 1/Campata {}'.format(i % 12), 'C30/37', 'Casting: Good', 0, 0, 2, 1,
+                       '2018-04-20', 'Impresa Edile Rossi', 40, i, 'Buona', 'BIM-{}'.format(i))
+            for i in range(n_plants)]
+
+
+def short_report(plant, i):
+    return {'BIM_id': plant['BIM_id'],
+            'phase': 'Maturation',
+            'status': 'Maturation: Good',
+            'record_timestamp': datetime.datetime(2018, 4, 21) + datetime.timedelta(seconds=120 * i),
+            'temperature': round(30 + (i % 97) / 10, 3),
+            'moisture': round(20 + (i % 89) / 10, 3),
+            'pressure': round(20 + (i % 83) / 10, 3)}
+
+
+def merged_short_report(plant, i):
+    """Short report as built before the plant registry"""
+    return extract_average_from_batch([merge_two_dicts(plant, short_report(plant, i))], file_detail='short')
+
+
+def timed(function):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = function()
+    return result, (time.perf_counter() - start) / repeats
+
+
+if __name__ == '__main__':
+    n_plants = int(sys.argv[1]) if len(sys.argv) > 1 else default_plants
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else default_batch_size
+    plants = make_plants(n_plants)
+    registry = PlantRegistry()
+    for plant in plants:
+        registry.register(plant)
+    merged_reports, merge_elapsed = timed(lambda: [merged_short_report(plants[i % n_plants], i)
+                                                   for i in range(batch_size)])
+    reports, build_elapsed = timed(lambda: [short_report(plants[i % n_plants], i) for i in range(batch_size)])
+
+    query_bytes = sum(len(urlencode({key: str(value) for key, value in report.items()}))
+                      for report in merged_reports)
+    merged_body, merged_elapsed = timed(lambda: json.dumps(merged_reports, default=str).encode('utf-8'))
+    json_body, json_elapsed = timed(lambda: json.dumps(reports, default=str).encode('utf-8'))
+
+    encoder = wire_format.SessionEncoder(plants=registry)
+    (first_body, sent_plants), first_elapsed = timed(lambda: encoder.encode(reports, 'short'))
+    encoder.confirm(sent_plants)
+    (next_body, _), next_elapsed = timed(lambda: encoder.encode(reports, 'short'))
+    _, decode_elapsed = timed(lambda: wire_format.decode(next_body))
+
+    print("{} short reports of {} plants".format(batch_size, n_plants))
+    print("built in {:.2f} ms merged with the plant fields, {:.2f} ms with the readings only".format(
+        merge_elapsed * 1e3, build_elapsed * 1e3))
+    for label, size, elapsed in [('GET query strings', query_bytes, None),
+                                 ('JSON, merged', len(merged_body), merged_elapsed),
+                                 ('JSON, readings only', len(json_body), json_elapsed),
+                                 ('binary, first batch', len(first_body), first_elapsed),
+                                 ('binary, next batches', len(next_body), next_elapsed)]:
+        print("{:<22} {:>8} bytes, {:>6.1f} bytes/report{}".format(
+            label, size, size / batch_size, '' if elapsed is None else ', encoded in {:.2f} ms'.format(elapsed * 1e3)))
+    print("binary decoded in {:.2f} ms".format(decode_elapsed * 1e3))
+
+    _, _, decoded = wire_format.decode(next_body)
+    assert [report['temperature'] for report in decoded] == [report['temperature'] for report in reports]
+    assert [report['record_timestamp'] for report in decoded] == [report['record_timestamp'] for report in reports]
@@ -0,0 +1,71 @@
+import re
+
+# GPIO levels of the samples
+LOW = 0
+HIGH = 1
+
+# runs of consecutive HIGH samples
+_pull_up_runs = re.compile(b'\x01+')
+
+
+class DHT11Result:
+    'DHT11 sensor result returned by DHT11.read() method'
+
+    ERR_NO_ERROR = 0
+    ERR_MISSING_DATA = 1
+    ERR_CRC = 2
+
+    error_code = ERR_NO_ERROR
+    temperature = -1
+    humidity = -1
+
+    def __init__(self, error_code, temperature, humidity):
+        self.error_code = error_code
+        self.temperature = temperature
+        self.humidity = humidity
+
+    def is_valid(self):
+        return self.error_code == DHT11Result.ERR_NO_ERROR
+
+
+def pull_up_lengths(data, length=None):
+    """Lengths (in samples) of the data pull up periods of a capture.
+    The capture starts with the initial pull down and pull up of the sensor, then every bit is
+    a pull down followed by a pull up whose length tells if the bit is 0 or 1.
+    The runs are found with a single regex scan of the buffer instead of a per-sample state machine"""
+    if length is None:
+        length = len(data)
+
+    start = data.find(LOW, 0, length)
+    if start < 0:
+        return []
+
+    # a run that reaches the end of the capture is not followed by a pull down, so it is not a bit
+    lengths = [match.end() - match.start() for match in _pull_up_runs.finditer(data, start, length)
+               if match.end() < length]
+
+    # the first pull up is the initial one of the sensor
+    return lengths[1:]
+
+
+def decode(data, length=None):
+    """Decodes the 40 bits (4 data bytes + 1 checksum byte) of a capture of GPIO samples
+    :rtype: DHT11Result
+    """
+    lengths = pull_up_lengths(data, length)
+
+    # if bit count mismatch, return error (4 byte data + 1 byte checksum)
+    if len(lengths) != 40:
+        return DHT11Result(DHT11Result.ERR_MISSING_DATA, 0, 0)
+
+    # use the halfway to determine whether the period it is long or short
+    halfway = (min(lengths) + max(lengths)) / 2
+    bits = ''.join(['1' if l > halfway else '0' for l in lengths])
+    the_bytes = int(bits, 2).to_bytes(5, 'big')
+
+    # calculate checksum and check
+    if the_bytes[4] != sum(the_bytes[:4]) & 255:
+        return DHT11Result(DHT11Result.ERR_CRC, 0, 0)
+
+    # ok, we have valid data, return it
+    return DHT11Result(DHT11Result.ERR_NO_ERROR, the_bytes[2], the_bytes[0])
@@ -0,0 +1,673 @@
+"""
+Gateway of the nodes of a site: the nodes (the Pis with the sensors) send their readings over the local network
+and the gateway runs the casting -> maturation state machines of all their plants, uploading the reports
+with the uploader of its MonitoringCore, which sends them upstream in consolidated batches.
+
+Messages (version 1, little endian), one per UDP datagram or prefixed by I length over TCP:
+
+    header    3s magic, B version, B type
+    readings  blocks of: B length + UTF-8 BIM_id, H readings, readings of d timestamp, f moisture,
+              f temperature, f pressure
+    plant     UTF-8 JSON of the plant (see init_plant)
+    session   as plant, starting a new session of the plant
+    status    B length + UTF-8 BIM_id, 1s color ('-' before the first sample), B result (0 running,
+              1 completed, 2 failed)
+
+Readings, plants and sessions go from the nodes to the gateway, which answers with the status of a plant when
+it changes and to every session message. When the session of a plant ends its monitor is dropped: only a
+session message starts a new one, its plant messages and readings are answered with the final status.
+Timestamps are seconds from the epoch (the time of the gateway for 0), readings are float32 rounded
+back to float_precision decimals.
+Run the gateway with the configuration of flowchart.py:
+
+    python gateway.py [port]
+"""
+import collections
+import datetime
+import json
+import selectors
+import socket
+import struct
+import sys
+import time
+
+from log_processing import float_precision
+from monitoring_scheduler import PlantMonitor
+from timer_wheel import Timer, TimerWheel, default_tick
+
+default_port = 4998
+version = 1
+magic = b'CFG'
+
+# types of the messages
+READINGS = 0
+PLANT = 1
+STATUS = 2
+SESSION = 3
+
+header_struct = struct.Struct('<3sBB')
+id_length_struct = struct.Struct('<B')
+count_struct = struct.Struct('<H')
+reading_struct = struct.Struct('<dfff')
+result_struct = struct.Struct('<cB')
+frame_struct = struct.Struct('<I')
+
+# color of the status of a plant without samples
+no_color = '-'
+
+# results of the plants in the status messages, as PlantMonitor.result
+results = {None: 0, True: 1, False: 2}
+result_values = {code: result for result, code in results.items()}
+
+# UDP datagrams are kept within the MTU of the local network, longer batches are split
+max_datagram_size = 1400
+
+# longest message accepted over TCP
+max_message_size = 1 << 20
+
+# datagrams read in a row before the report timers are checked
+receive_batch = 256
+
+# receive buffer (in bytes) asked for the UDP socket, to absorb the bursts of the nodes (capped by the kernel)
+receive_buffer_size = 1 << 22
+
+# bytes read at once from a TCP connection
+receive_size = 1 << 18
+
+# longest wait (in seconds) for the gateway to handle the readings of a TCP node that is closing
+close_timeout = 10
+
+# the plant is sent again with the readings after this many seconds, in case its datagram was lost
+plant_resend_interval = 60
+
+# plants whose session ended kept by the gateway, to ignore their late readings (the oldest are forgotten)
+max_ended_plants = 10000
+
+
+class ProtocolError(ValueError):
+    """Malformed or unsupported message"""
+
+
+def encode_header(message_type):
+    return header_struct.pack(magic, version, message_type)
+
+
+def encode_id(bim_id):
+    encoded = bim_id.encode('utf-8')
+    return id_length_struct.pack(len(encoded)) + encoded
+
+
+def encode_readings(blocks):
+    """Readings message of blocks, (BIM_id, list of (timestamp, moisture, temperature, pressure)) pairs"""
+    parts = [encode_header(READINGS)]
+    for bim_id, readings in blocks:
+        parts.append(encode_id(bim_id))
+        parts.append(count_struct.pack(len(readings)))
+        parts.extend(reading_struct.pack(*reading) for reading in readings)
+    return b''.join(parts)
+
+
+def encode_plant(plant, new_session=False):
+    return encode_header(SESSION if new_session else PLANT) + json.dumps(plant, default=str).encode('utf-8')
+
+
+def encode_status(bim_id, color, result):
+    color = no_color if color is None else color
+    return encode_header(STATUS) + encode_id(bim_id) + result_struct.pack(color.encode('ascii'), results[result])
+
+
+def decode_header(message):
+    """Type and body of a message
+    :rtype: tuple
+    """
+    if len(message) < header_struct.size:
+        raise ProtocolError('Truncated message of {} bytes'.format(len(message)))
+    tag, message_version, message_type = header_struct.unpack_from(message)
+    if tag != magic:
+        raise ProtocolError('Not a gateway message')
+    if message_version != version:
+        raise ProtocolError('Unsupported version {}'.format(message_version))
+    return message_type, memoryview(message)[header_struct.size:]
+
+
+def decode_id(body, offset):
+    if offset >= len(body):
+        raise ProtocolError('Missing BIM_id')
+    length = body[offset]
+    end = offset + 1 + length
+    if end > len(body):
+        raise ProtocolError('Truncated BIM_id')
+    return str(body[offset + 1:end], 'utf-8'), end
+
+
+def decode_readings(body):
+    """Blocks of a readings message, the whole message is checked before it is processed
+    :rtype: list
+    """
+    blocks = []
+    offset = 0
+    while offset < len(body):
+        bim_id, offset = decode_id(body, offset)
+        if offset + count_struct.size > len(body):
+            raise ProtocolError('Truncated block of {}'.format(bim_id))
+        count, = count_struct.unpack_from(body, offset)
+        offset += count_struct.size
+        end = offset + count * reading_struct.size
+        if end > len(body):
+            raise ProtocolError('Truncated block of {}'.format(bim_id))
+        blocks.append((bim_id, [(timestamp, round(moisture, float_precision), round(temperature, float_precision),
+                                 round(pressure, float_precision))
+                                for timestamp, moisture, temperature, pressure
+                                in reading_struct.iter_unpack(body[offset:end])]))
+        offset = end
+    return blocks
+
+
+def decode_plant(body):
+    plant = json.loads(str(body, 'utf-8'))
+    if not isinstance(plant, dict) or not isinstance(plant.get('BIM_id'), str):
+        raise ProtocolError('Plant without BIM_id')
+    return plant
+
+
+def decode_status(body):
+    """BIM_id, color and result of a status message
+    :rtype: tuple
+    """
+    bim_id, offset = decode_id(body, 0)
+    if offset + result_struct.size != len(body):
+        raise ProtocolError('Truncated status of {}'.format(bim_id))
+    color, result = result_struct.unpack_from(body, offset)
+    if result not in result_values:
+        raise ProtocolError('Unknown result {}'.format(result))
+    color = color.decode('ascii')
+    return bim_id, None if color == no_color else color, result_values[result]
+
+
+def frame(message):
+    """Message prefixed by its length, for TCP"""
+    return frame_struct.pack(len(message)) + message
+
+
+def split_frames(buffer):
+    """Complete messages at the beginning of a TCP buffer, which are removed from it
+    :rtype: list
+    """
+    messages = []
+    offset = 0
+    while len(buffer) - offset >= frame_struct.size:
+        length, = frame_struct.unpack_from(buffer, offset)
+        if length > max_message_size:
+            raise ProtocolError('Message of {} bytes'.format(length))
+        end = offset + frame_struct.size + length
+        if end > len(buffer):
+            break
+        messages.append(bytes(buffer[offset + frame_struct.size:end]))
+        offset = end
+    del buffer[:offset]
+    return messages
+
+
+def no_light(color):
+    """Light output of the plants of the gateway, the status is sent to their nodes instead"""
+
+
+class Gateway(object):
+    """Receives the readings of the plants of many nodes over UDP and TCP on the same port and runs their
+    state machines (PlantMonitor, by BIM_id) in a single thread: a selector waits for the sockets and for the
+    next tick of the timer wheel of the full and short reports of all the plants.
+    A plant is monitored from its first readings, its fields are those of the last plant message of its node.
+    The status of a plant is sent back to the node of its last readings when its color or result changes.
+    When the session of a plant ends (completed or failed) its monitor is dropped: its later readings are ignored
+    (answered with the final status over UDP, which may have been lost) and its plant messages are answered with
+    the final status, until a session message of the same BIM_id starts a new session.
+    Readings of malformed messages are rejected as a whole"""
+
+    def __init__(self, core, host='', port=default_port, tick=default_tick, store=None):
+        self.core = core
+        self.store = store
+        self.monitors = {}  # BIM_id -> PlantMonitor
+        self._plants = {}  # BIM_id -> plant received before its readings
+        self._timers = {}  # BIM_id -> (full report, short report) timers
+        self._statuses = {}  # BIM_id -> (color, result) last sent to the node
+        self._ended = collections.OrderedDict()  # BIM_id -> final (color, result) of the sessions ended
+        self._wheel = TimerWheel(tick=tick)
+        self._running = False
+
+        # statistics
+        self.messages = 0
+        self.readings = 0
+        self.rejected = 0
+        self.ignored = 0
+        self.reports = 0
+        self.sessions = 0
+
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind((host, port))
+        self._listener.listen()
+        self.address = self._listener.getsockname()
+        self._datagrams = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._datagrams.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer_size)
+        self._datagrams.bind(self.address)
+        self._buffer = bytearray(1 << 16)
+        self._connections = {}  # TCP connection -> bytes received and not yet handled
+
+        self._selector = selectors.DefaultSelector()
+        for sock, callback in [(self._listener, self._accept), (self._datagrams, self._receive_datagrams)]:
+            sock.setblocking(False)
+            self._selector.register(sock, selectors.EVENT_READ, callback)
+
+    def run(self):
+        """Handles the messages of the nodes and the reports of the plants until stopped"""
+        self._running = True
+        while self._running:
+            self._wheel.advance()
+            timeout = max(0.0, self._wheel.next_tick_time() - time.monotonic())
+            for key, _ in self._selector.select(timeout):
+                key.data(key.fileobj)
+
+    def stop(self):
+        """Stops the gateway within a tick, from any thread"""
+        self._running = False
+
+    def close(self):
+        """Closes the sockets, the reports of the plants still running are not saved"""
+        for connection in list(self._connections):
+            self._disconnect(connection)
+        self._selector.close()
+        self._listener.close()
+        self._datagrams.close()
+        for timers in self._timers.values():
+            for timer in timers:
+                timer.cancel()
+        if self.store is not None:
+            self.store.flush()
+
+    def statistics(self):
+        """Messages and readings handled, rejected messages, ignored readings, reports, plants running
+        and sessions ended
+        :rtype: dict
+        """
+        return {'messages': self.messages, 'readings': self.readings, 'rejected': self.rejected,
+                'ignored': self.ignored, 'reports': self.reports, 'running': len(self.monitors),
+                'sessions': self.sessions, 'connections': len(self._connections)}
+
+    def _accept(self, listener):
+        try:
+            connection, _ = listener.accept()
+        except BlockingIOError:
+            return
+        connection.setblocking(False)
+        self._connections[connection] = bytearray()
+        self._selector.register(connection, selectors.EVENT_READ, self._receive_stream)
+
+    def _disconnect(self, connection):
+        self._selector.unregister(connection)
+        connection.close()
+        del self._connections[connection]
+
+    def _receive_stream(self, connection):
+        try:
+            data = connection.recv(receive_size)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._disconnect(connection)
+            return
+
+        buffer = self._connections[connection]
+        buffer += data
+        try:
+            for message in split_frames(buffer):
+                self._handle(message, connection)
+                if connection not in self._connections:  # disconnected while sending a status
+                    return
+        except ProtocolError as e:
+            # the stream cannot be resynchronized
+            self.rejected += 1
+            print("Closing the connection of {}: {}".format(connection.getpeername(), e))
+            self._disconnect(connection)
+
+    def _receive_datagrams(self, datagrams):
+        view = memoryview(self._buffer)
+        for _ in range(receive_batch):
+            try:
+                size, address = datagrams.recvfrom_into(self._buffer)
+            except BlockingIOError:
+                return
+            try:
+                self._handle(view[:size], address)
+            except ProtocolError as e:
+                self.rejected += 1
+                print("Rejected datagram from {}: {}".format(address, e))
+
+    def _handle(self, message, node):
+        """Handles a message of the node (a TCP connection or a UDP address)"""
+        try:
+            message_type, body = decode_header(message)
+            if message_type == READINGS:
+                blocks = decode_readings(body)
+            elif message_type in (PLANT, SESSION):
+                plant = decode_plant(body)
+            else:
+                raise ProtocolError('Unexpected message type {}'.format(message_type))
+        except ValueError as e:
+            raise ProtocolError(e)
+
+        self.messages += 1
+        if message_type == PLANT:
+            self._register(plant, node)
+        elif message_type == SESSION:
+            self._start_session(plant, node)
+        else:
+            for bim_id, readings in blocks:
+                self._process(bim_id, readings, node)
+
+    def _register(self, plant, node):
+        bim_id = plant['BIM_id']
+        monitor = self.monitors.get(bim_id)
+        if bim_id in self._ended:
+            # resent by a node that did not receive the final status
+            self._send_status(bim_id, node, encode_status(bim_id, *self._ended[bim_id]))
+        elif monitor is None:
+            self._plants[bim_id] = plant
+        else:
+            monitor.plant = plant
+
+    def _start_session(self, plant, node):
+        """A new session of the plant, unless it is running (e.g. its node restarted): answered with its status"""
+        bim_id = plant['BIM_id']
+        self._ended.pop(bim_id, None)
+        self._register(plant, node)
+        monitor = self.monitors.get(bim_id)
+        status = (None, None) if monitor is None else (monitor.status, monitor.result)
+        self._send_status(bim_id, node, encode_status(bim_id, *status))
+
+    def _monitor(self, bim_id):
+        monitor = self.monitors.get(bim_id)
+        if monitor is None:
+            plant = self._plants.pop(bim_id, None) or {'BIM_id': bim_id}
+            monitor = self.monitors[bim_id] = PlantMonitor(plant, self.core, light_output=no_light)
+            self._start_timers(monitor)
+        return monitor
+
+    def _start_timers(self, monitor):
+        """(Re)starts the report timers of the plant, at the beginning of each phase"""
+        bim_id = monitor.plant['BIM_id']
+        for timer in self._timers.get(bim_id, ()):
+            timer.cancel()
+        full_rate = self.core.full_report_sampling_rate
+        short_rate = self.core.short_report_rate(monitor.current_phase)
+        self._timers[bim_id] = (self._wheel.schedule(full_rate, lambda: self._report(monitor, monitor.full_report),
+                                                     period=full_rate),
+                                self._wheel.schedule(short_rate, lambda: self._report(monitor, monitor.short_report),
+                                                     period=short_rate))
+
+    def _process(self, bim_id, readings, node):
+        """Feeds the readings of a block to the state machine of the plant"""
+        final_status = self._ended.get(bim_id)
+        if final_status is not None:
+            self.ignored += len(readings)
+            if not isinstance(node, socket.socket):
+                self._send_status(bim_id, node, encode_status(bim_id, *final_status))
+            return
+        monitor = self._monitor(bim_id)
+        phase_index = monitor.phase_index
+        for timestamp, moisture, temperature, pressure in readings:
+            if monitor.done:
+                self.ignored += 1
+                continue
+            now = datetime.datetime.fromtimestamp(timestamp) if timestamp else datetime.datetime.now()
+            if self.store is not None:
+                self.store.append(bim_id, now, moisture=moisture, temperature=temperature, pressure=pressure)
+            monitor.process_sample(moisture, temperature, pressure, now=now)
+            self.readings += 1
+        self._dispatch(monitor)
+
+        if monitor.done:
+            for timer in self._timers.pop(bim_id, ()):
+                timer.cancel()
+        elif monitor.phase_index != phase_index:
+            self._start_timers(monitor)
+
+        status = (monitor.status, monitor.result)
+        if status != self._statuses.get(bim_id) and monitor.status is not None:
+            self._statuses[bim_id] = status
+            self._send_status(bim_id, node, encode_status(bim_id, *status))
+        if monitor.done:
+            self._end_session(bim_id, status)
+
+    def _end_session(self, bim_id, status):
+        """Drops the monitor of a plant whose session ended"""
+        del self.monitors[bim_id]
+        self._statuses.pop(bim_id, None)
+        self._ended[bim_id] = status
+        while len(self._ended) > max_ended_plants:
+            self._ended.popitem(last=False)
+        self.sessions += 1
+        forget = getattr(self.core.upload, 'forget', None)  # e.g. a ReportCompressor
+        if forget is not None:
+            try:
+                forget(bim_id)
+            except Exception as e:
+                print("Unable to save report: {}".format(e))
+
+    def _report(self, monitor, report):
+        report()
+        self._dispatch(monitor)
+
+    def _dispatch(self, monitor):
+        for report in monitor.pop_reports():
+            self.reports += 1
+            try:
+                report()
+            except Exception as e:
+                print("Unable to save report: {}".format(e))
+
+    def _send_status(self, bim_id, node, message):
+        """Best effort over UDP: a node that does not receive a status gets it with the next change.
+        A TCP node that does not read its statuses is disconnected"""
+        if isinstance(node, socket.socket) and node not in self._connections:
+            return
+        try:
+            if isinstance(node, socket.socket):
+                message = frame(message)
+                if node.send(message) != len(message):
+                    raise OSError('status truncated, the node does not read')
+            else:
+                self._datagrams.sendto(message, node)
+        except OSError as e:
+            print("Unable to send the status of {}: {}".format(bim_id, e))
+            if isinstance(node, socket.socket) and node in self._connections:
+                self._disconnect(node)
+
+
+class GatewayClient(object):
+    """Node side of the gateway: the readings of the plants of the node are buffered and sent in batches
+    of batch_size readings (split in datagrams within max_datagram_size over UDP).
+    The statuses of the plants sent back by the gateway are collected by poll"""
+
+    def __init__(self, address, transport='udp', batch_size=1):
+        if transport not in ['udp', 'tcp']:
+            raise ValueError('Unknown transport: {}'.format(transport))
+        self.transport = transport
+        self.batch_size = batch_size
+        if transport == 'tcp':
+            self.sock = socket.create_connection(address)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.connect(address)
+        self.sock.setblocking(False)
+
+        self.statuses = {}  # BIM_id -> (color, result) received last
+        self._plants = {}  # BIM_id -> (plant, monotonic time it was sent)
+        self._sessions = set()  # BIM_id of the sessions started and not yet answered by the gateway
+        self._pending = {}  # BIM_id -> readings not yet sent
+        self._count = 0
+        self._received = bytearray()
+
+    def register(self, plant, new_session=False):
+        """Sends the fields of a plant, before its readings. With new_session a new session of the plant is
+        started if the previous one ended, and the statuses of the previous one are ignored from now on"""
+        bim_id = plant['BIM_id']
+        self._plants[bim_id] = (plant, time.monotonic())
+        if new_session:
+            self._sessions.add(bim_id)
+            self.statuses.pop(bim_id, None)
+        self._send([encode_plant(plant, new_session=new_session)])
+
+    def send(self, bim_id, moisture, temperature, pressure, timestamp=None):
+        """Queues a reading of a plant (taken now if timestamp is None), the batch is sent when full"""
+        if timestamp is None:
+            timestamp = time.time()
+        self._pending.setdefault(bim_id, []).append((timestamp, moisture, temperature, pressure))
+        self._count += 1
+        if self._count >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Sends the readings queued"""
+        if not self._count:
+            return
+        messages = []
+        if self.transport == 'udp':
+            now = time.monotonic()
+            for bim_id in self._pending:
+                if bim_id in self._plants and now - self._plants[bim_id][1] >= plant_resend_interval:
+                    plant = self._plants[bim_id][0]
+                    self._plants[bim_id] = (plant, now)
+                    messages.append(encode_plant(plant, new_session=bim_id in self._sessions))
+            messages.extend(self._datagrams())
+        else:
+            messages.append(encode_readings(list(self._pending.items())))
+        self._pending = {}
+        self._count = 0
+        self._send(messages)
+
+    def _datagrams(self):
+        """Readings messages within max_datagram_size"""
+        blocks = []
+        size = header_struct.size
+        for bim_id, readings in self._pending.items():
+            block_size = len(encode_id(bim_id)) + count_struct.size
+            while readings:
+                fit = (max_datagram_size - size - block_size) // reading_struct.size
+                if fit <= 0:
+                    yield encode_readings(blocks)
+                    blocks = []
+                    size = header_struct.size
+                    continue
+                blocks.append((bim_id, readings[:fit]))
+                size += block_size + len(readings[:fit]) * reading_struct.size
+                readings = readings[fit:]
+        if blocks:
+            yield encode_readings(blocks)
+
+    def _send(self, messages):
+        if self.transport == 'tcp':
+            self.sock.setblocking(True)
+            try:
+                self.sock.sendall(b''.join(frame(message) for message in messages))
+            finally:
+                self.sock.setblocking(False)
+        else:
+            for message in messages:
+                self.sock.send(message)
+
+    def poll(self):
+        """Collects the statuses received from the gateway, without waiting
+        :rtype: dict
+        """
+        while True:
+            try:
+                data = self.sock.recv(receive_size)
+            except (BlockingIOError, ConnectionRefusedError):
+                break
+            if self.transport == 'tcp' and not data:
+                break
+            self._receive(data)
+        return self.statuses
+
+    def _receive(self, data):
+        if self.transport == 'udp':
+            messages = [data]
+        else:
+            self._received += data
+            messages = split_frames(self._received)
+        for message in messages:
+            try:
+                message_type, body = decode_header(message)
+                if message_type != STATUS:
+                    raise ProtocolError('Unexpected message type {}'.format(message_type))
+                bim_id, color, result = decode_status(body)
+            except ValueError as e:
+                print("Rejected message from the gateway: {}".format(e))
+                continue
+            if bim_id in self._sessions:
+                if result is not None:
+                    # final status of the previous session, sent before the gateway handled the session message
+                    continue
+                self._sessions.discard(bim_id)
+            self.statuses[bim_id] = (color, result)
+            if result is not None:
+                # the session ended, register(new_session=True) starts a new one
+                self._plants.pop(bim_id, None)
+
+    def close(self):
+        """Sends the readings queued and closes the socket. Over TCP, waits for the gateway to close its side,
+        i.e. to handle all the readings: closing with statuses not read would reset the connection and
+        drop the readings the gateway did not receive yet"""
+        self.flush()
+        if self.transport == 'tcp':
+            self.sock.settimeout(close_timeout)
+            try:
+                self.sock.shutdown(socket.SHUT_WR)
+                while True:
+                    data = self.sock.recv(receive_size)
+                    if not data:
+                        break
+                    self._receive(data)
+            except OSError as e:
+                print("The gateway did not close the connection: {}".format(e))
+        self.sock.close()
+
+
+def run_node(client, plant, read_params, read_delay, light_output=no_light):
+    """Monitors a plant through the gateway: reads the sensors every read_delay seconds and forwards the
+    readings, showing the status of the plant sent back by the gateway.
+    Returns the result of the session (True if all phases were completed)"""
+    bim_id = plant['BIM_id']
+    client.register(plant, new_session=True)
+    sampling_timer = Timer.periodic(read_delay)
+    color = None
+    while True:
+        moisture, temperature, pressure = read_params()
+        client.send(bim_id, moisture, temperature, pressure)
+        client.flush()
+        status = client.poll().get(bim_id)
+        if status is not None:
+            if status[0] is not None and status[0] != color:
+                color = status[0]
+                light_output(color)
+            if status[1] is not None:
+                return status[1]
+        sampling_timer.wait()
+
+
+if __name__ == '__main__':
+    import flowchart
+
+    gateway = Gateway(flowchart.core, port=int(sys.argv[1]) if len(sys.argv) > 1 else default_port,
+                      store=flowchart.store)
+    print("Gateway listening on port {}".format(gateway.address[1]))
+    try:
+        gateway.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        gateway.close()
+        print(gateway.statistics())
@@ -0,0 +1,181 @@
+"""
+Columnar export of the short/full reports for offline analysis.
+An export is a directory with one append-only binary file per column and a schema.json with
+their dtypes and the number of rows, so that a history of any size is opened with np.memmap
+without parsing it, and handed to pandas without copies:
+
+    python log_export.py reports.jsonl exports/full full   # JSON lines -> columnar export
+"""
+import json
+import os
+import sys
+
+import numpy as np
+
+from log_processing import file_suffix, schemas
+
+# reports buffered in memory before being appended to the column files
+export_chunk_size = 100000
+
+schema_file = 'schema.json'
+
+# dtypes of the columns, the other fields are strings stored as int32 codes of a list of categories
+column_dtypes = {'temperature': '<f8',
+                 'moisture': '<f8',
+                 'pressure': '<f8',
+                 'record_timestamp': '<M8[us]',
+                 'begin_timestamp': '<M8[us]',
+                 'end_timestamp': '<M8[us]'}
+category_dtype = '<i4'
+
+
+class ColumnarExporter(object):
+    """Appends reports of the short or full schema to a columnar export, in chunks of chunk_size.
+    Rows are committed when a chunk is written: schema.json is replaced atomically with the new
+    row count, so an interrupted export is still readable up to its last complete chunk.
+    An existing export of the same schema is extended"""
+
+    def __init__(self, path, schema=file_suffix[1], chunk_size=export_chunk_size):
+        self.path = path
+        self.chunk_size = chunk_size
+        os.makedirs(path, exist_ok=True)
+
+        if os.path.exists(os.path.join(path, schema_file)):
+            info = read_schema(path)
+            if info['schema'] != schema:
+                raise ValueError('{} is an export of the {} schema'.format(path, info['schema']))
+            self.rows = info['rows']
+            self.categories = info['categories']
+        else:
+            self.rows = 0
+            self.categories = {field: [] for field in schemas[file_suffix.index(schema)]
+                               if field not in column_dtypes}
+        self.schema = schema
+        self.fields = list(schemas[file_suffix.index(schema)])
+        self._category_codes = {field: {label: code for code, label in enumerate(labels)}
+                                for field, labels in self.categories.items()}
+        self._pending = {field: [] for field in self.fields}
+        self._buffered = 0
+
+        # drops the bytes of a chunk that was not committed
+        for field in self.fields:
+            column_path = os.path.join(path, field + '.bin')
+            size = self.rows * np.dtype(self._dtype(field)).itemsize
+            if os.path.exists(column_path) and os.path.getsize(column_path) > size:
+                os.truncate(column_path, size)
+
+    def _dtype(self, field):
+        return column_dtypes.get(field, category_dtype)
+
+    def _code(self, field, value):
+        if value is None:
+            return -1
+        codes = self._category_codes[field]
+        value = str(value)
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(self.categories[field])
+            self.categories[field].append(value)
+        return code
+
+    def write(self, report):
+        """Adds a report (a dict with the keys of the schema, missing ones are exported as null)"""
+        for field in self.fields:
+            value = report.get(field)
+            if field not in column_dtypes:
+                value = self._code(field, value)
+            self._pending[field].append(value)
+        self._buffered += 1
+        if self._buffered >= self.chunk_size:
+            self.flush()
+
+    def write_many(self, reports):
+        for report in reports:
+            self.write(report)
+
+    def flush(self):
+        """Appends the buffered reports to the column files and commits them"""
+        if not self._buffered:
+            return
+        for field in self.fields:
+            # None -> NaN/NaT, timestamps can be datetimes or ISO strings
+            column = np.array(self._pending[field], dtype=self._dtype(field))
+            with open(os.path.join(self.path, field + '.bin'), 'ab') as f:
+                f.write(column.tobytes())
+            self._pending[field] = []
+        self.rows += self._buffered
+        self._buffered = 0
+
+        info = {'schema': self.schema,
+                'rows': self.rows,
+                'columns': [{'field': field, 'name': schemas[file_suffix.index(self.schema)][field],
+                             'dtype': self._dtype(field)} for field in self.fields],
+                'categories': self.categories}
+        temporary_path = os.path.join(self.path, schema_file + '.tmp')
+        with open(temporary_path, 'w') as f:
+            json.dump(info, f)
+        os.replace(temporary_path, os.path.join(self.path, schema_file))
+
+    def close(self):
+        self.flush()
+
+
+def read_schema(path):
+    with open(os.path.join(path, schema_file)) as f:
+        return json.load(f)
+
+
+def open_columns(path):
+    """Memory-maps the columns of an export, read-only
+    :rtype: dict
+    """
+    info = read_schema(path)
+    columns = {}
+    for column in info['columns']:
+        if info['rows']:
+            columns[column['field']] = np.memmap(os.path.join(path, column['field'] + '.bin'),
+                                                 dtype=column['dtype'], mode='r', shape=(info['rows'],))
+        else:
+            columns[column['field']] = np.empty(0, dtype=column['dtype'])
+    return columns
+
+
+def load_export(path, excel_names=False):
+    """Opens an export as a pandas DataFrame backed by the memory-mapped columns: the numeric and
+    timestamp columns are not copied, the string ones become categoricals (pandas copies their codes).
+    With excel_names the columns are named as in the spreadsheets (see convert_dict_keys)
+    :rtype: pandas.DataFrame
+    """
+    import pandas as pd
+
+    info = read_schema(path)
+    data = {}
+    for field, values in open_columns(path).items():
+        if field in info['categories']:
+            values = pd.Categorical.from_codes(values, categories=info['categories'][field], validate=False)
+        data[field] = values
+    frame = pd.DataFrame(data, copy=False)
+    if excel_names:
+        frame.columns = [column['name'] for column in info['columns']]
+    return frame
+
+
+def export_reports(reports, path, schema=file_suffix[1], chunk_size=export_chunk_size):
+    """Streams an iterable of reports to a columnar export, returns the number of rows of the export"""
+    exporter = ColumnarExporter(path, schema=schema, chunk_size=chunk_size)
+    exporter.write_many(reports)
+    exporter.close()
+    return exporter.rows
+
+
+def read_json_lines(path):
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+if __name__ == '__main__':
+    rows = export_reports(read_json_lines(sys.argv[1]), sys.argv[2],
+                          schema=sys.argv[3] if len(sys.argv) > 3 else file_suffix[1])
+    print("{} rows in {}".format(rows, sys.argv[2]))
@@ -1,8 +1,13 @@
+import datetime
 from collections import OrderedDict
 
 # Utility constants
 file_suffix = ['short', 'full']
 float_precision = 3
+process_params = ['temperature', 'moisture', 'pressure']
+
+# percentiles evaluated by the columnar summaries
+summary_percentiles = (5, 50, 95)
 
 # dictionaries to convert dict names to Excel naming conventions
 schemas = [
@@ -40,6 +45,11 @@ schemas = [
         'end_timestamp': 'End Timestamp'
     }]
 
+# fields of a short report, the static fields of the plant are kept by the plant registry
+# and joined again by the server
+short_report_fields = ['BIM_id', 'phase', 'status', 'record_timestamp', 'temperature', 'moisture', 'pressure']
+plant_fields = [field for field in schemas[0] if field not in short_report_fields]
+
 
 def list_avg(data):
     """Evaluates the average of the list
@@ -48,10 +58,199 @@ def list_avg(data):
     return float(sum(data)) / len(data)
 
 
+# timestamps are stored as microseconds from this naive epoch, as datetime64[us] does
+timestamp_epoch = datetime.datetime(1970, 1, 1)
+
+
+def to_microseconds(timestamp):
+    return (timestamp - timestamp_epoch) // datetime.timedelta(microseconds=1)
+
+
+def from_microseconds(microseconds):
+    return timestamp_epoch + datetime.timedelta(microseconds=microseconds)
+
+
+class RunningStats(object):
+    """Running mean and variance (Welford's algorithm), min and max of a parameter, updated in O(1)"""
+
+    __slots__ = ('count', 'mean', 'm2', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def std(self):
+        """Population standard deviation, as ColumnarBatch.summarize"""
+        return (self.m2 / self.count) ** 0.5 if self.count else 0.0
+
+
+class ReportAccumulator(object):
+    """Incremental replacement of the log_full batch of a full report: every sample updates the
+    running statistics and is then discarded, so memory does not grow with the report window
+    (the raw readings, e.g. of the 'Bad' windows, are kept by the TimeSeriesStore, see report_readings)"""
+
+    def __init__(self, bim_id):
+        self.BIM_id = bim_id
+        self.stats = {param: RunningStats() for param in process_params}
+        self.phase = None
+        self.status = None
+        self.begin_timestamp = None
+        self.end_timestamp = None
+
+    def append(self, phase, status, begin_timestamp, end_timestamp, moisture, temperature, pressure):
+        """Adds a sample, same keys of a log_full dict (without BIM_id)"""
+        if self.begin_timestamp is None:
+            self.begin_timestamp = begin_timestamp
+        self.end_timestamp = end_timestamp
+        self.phase = phase
+        self.status = status
+        self.stats['temperature'].add(temperature)
+        self.stats['moisture'].add(moisture)
+        self.stats['pressure'].add(pressure)
+
+    def __len__(self):
+        return self.stats['temperature'].count
+
+    def summarize(self):
+        """Mean, min, max and standard deviation of every parameter, as ColumnarBatch.summarize
+        (percentiles need the raw samples, see TimeSeriesStore)
+        :rtype: dict
+        """
+        return {param: {'mean': stats.mean, 'min': stats.min, 'max': stats.max, 'std': stats.std}
+                for param, stats in self.stats.items()}
+
+
+class ColumnarBatch(object):
+    """Batch of samples of a plant stored as one NumPy array per parameter,
+    with the begin/end timestamps as datetime64 arrays.
+    NumPy is imported by the batches only, so the monitoring of single samples does not load it"""
+
+    def __init__(self, bim_id, phase, status, temperature, moisture, pressure,
+                 begin_timestamp, end_timestamp):
+        import numpy as np
+
+        self.BIM_id = bim_id
+        self.phase = phase
+        self.status = status
+        self.values = np.vstack([np.asarray(temperature, dtype=np.float64),
+                                 np.asarray(moisture, dtype=np.float64),
+                                 np.asarray(pressure, dtype=np.float64)])
+        self.begin_timestamp = np.asarray(begin_timestamp, dtype='datetime64[us]')
+        self.end_timestamp = np.asarray(end_timestamp, dtype='datetime64[us]')
+
+    @classmethod
+    def from_log(cls, log):
+        """Builds the batch from a list of log_full dicts
+        :rtype: ColumnarBatch
+        """
+        return cls(bim_id=log[-1]['BIM_id'],
+                   phase=log[-1]['phase'],
+                   status=log[-1]['status'],
+                   temperature=[l['temperature'] for l in log],
+                   moisture=[l['moisture'] for l in log],
+                   pressure=[l['pressure'] for l in log],
+                   begin_timestamp=[l['begin_timestamp'] for l in log],
+                   end_timestamp=[l['end_timestamp'] for l in log])
+
+    def __len__(self):
+        return self.values.shape[1]
+
+    def column(self, param):
+        return self.values[process_params.index(param)]
+
+    def summarize(self, percentiles=summary_percentiles):
+        """Evaluates mean, min, max, standard deviation and percentiles of every parameter,
+        each statistic is computed for all the parameters with a single NumPy call
+        :rtype: dict
+        """
+        import numpy as np
+
+        stats = {'mean': self.values.mean(axis=1),
+                 'min': self.values.min(axis=1),
+                 'max': self.values.max(axis=1),
+                 'std': self.values.std(axis=1)}
+        if percentiles:
+            for q, values in zip(percentiles, np.percentile(self.values, percentiles, axis=1)):
+                stats['p{}'.format(q)] = values
+
+        return {param: {name: float(values[i]) for name, values in stats.items()}
+                for i, param in enumerate(process_params)}
+
+
+def summarize_batches(values, offsets, percentiles=summary_percentiles):
+    """Summarizes many batches (e.g. many plants x many windows) with a single call.
+    values is a (3, n_samples) array with the samples of all the batches one after the other
+    (rows ordered as process_params), offsets the index of the first sample of each batch.
+    Batches must not be empty. Returns the statistics of each parameter as arrays with one item per batch
+    :rtype: dict
+    """
+    import numpy as np
+
+    values = np.asarray(values, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.intp)
+    counts = np.diff(np.append(offsets, values.shape[1]))
+
+    means = np.add.reduceat(values, offsets, axis=1) / counts
+    squares = np.add.reduceat(values * values, offsets, axis=1) / counts
+    stats = {'mean': means,
+             'min': np.minimum.reduceat(values, offsets, axis=1),
+             'max': np.maximum.reduceat(values, offsets, axis=1),
+             'std': np.sqrt(np.maximum(squares - means * means, 0))}
+
+    if percentiles:
+        for q in percentiles:
+            stats['p{}'.format(q)] = np.empty_like(means)
+
+        # batches with the same number of samples are sorted together as a (params, batches, samples) block
+        for count in np.unique(counts):
+            selected = np.flatnonzero(counts == count)
+            block = np.sort(values[:, offsets[selected, None] + np.arange(count)], axis=2)
+            for q, block_values in zip(percentiles, np.percentile(block, percentiles, axis=2)):
+                stats['p{}'.format(q)][:, selected] = block_values
+
+    return {param: {name: stat[i] for name, stat in stats.items()}
+            for i, param in enumerate(process_params)}
+
+
 def extract_average_from_batch(log, file_detail):
-    """Extracts summarized info from a batch of data
+    """Extracts summarized info from a batch of data,
+    log is a list of dicts, or a ColumnarBatch or ReportAccumulator (full reports only)
     :rtype: dict
     """
+    if isinstance(log, ReportAccumulator):
+        return {'BIM_id': log.BIM_id,
+                'phase': log.phase,
+                'status': log.status,
+                'temperature': round(log.stats['temperature'].mean, float_precision),
+                'moisture': round(log.stats['moisture'].mean, float_precision),
+                'pressure': round(log.stats['pressure'].mean, float_precision),
+                'begin_timestamp': log.begin_timestamp,
+                'end_timestamp': log.end_timestamp}
+    if isinstance(log, ColumnarBatch):
+        summary = log.summarize(percentiles=None)
+        return {'BIM_id': log.BIM_id,
+                'phase': log.phase,
+                'status': log.status,
+                'temperature': round(summary['temperature']['mean'], float_precision),
+                'moisture': round(summary['moisture']['mean'], float_precision),
+                'pressure': round(summary['pressure']['mean'], float_precision),
+                'begin_timestamp': log.begin_timestamp[0].astype(object),
+                'end_timestamp': log.end_timestamp[-1].astype(object)}
+
     summarized_log = {
         'BIM_id': log[-1]['BIM_id'],
         'phase': log[-1]['phase'],
@@ -59,26 +258,15 @@ def extract_average_from_batch(log, file_detail):
     }
 
     if file_detail == file_suffix[0]:  # shorts
-        summarized_log['B3F_id'] = log[-1]['B3F_id'],
-        summarized_log['name'] = log[-1]['name'],
-        summarized_log['type'] = log[-1]['type'],
-        summarized_log['desc'] = log[-1]['desc'],
-        summarized_log['loc'] = log[-1]['loc'],
-        summarized_log['cls'] = log[-1]['cls'],
-        summarized_log['status'] = log[-1]['status'],
-        summarized_log['n_issues'] = log[-1]['n_issues'],
-        summarized_log['n_open_issues'] = log[-1]['n_open_issues'],
-        summarized_log['n_checklists'] = log[-1]['n_checklists'],
-        summarized_log['n_open_checklists'] = log[-1]['n_open_checklists'],
-        summarized_log['date_created'] = log[-1]['date_created'],
-        summarized_log['contractor'] = log[-1]['contractor'],
-        summarized_log['completion_percentage'] = log[-1]['completion_percentage'],
-        summarized_log['pillar_number'] = log[-1]['pillar_number'],
-        summarized_log['superficial_quality'] = log[-1]['superficial_quality'],
-        summarized_log['record_timestamp'] = log[-1]['record_timestamp']
-        summarized_log['temperature'] = log[-1]['temperature']
-        summarized_log['moisture'] = log[-1]['moisture']
-        summarized_log['pressure'] = log[-1]['pressure']
+        last = log[-1]
+        # the plant fields are copied only from the reports that still carry them
+        for field in plant_fields:
+            if field in last:
+                summarized_log[field] = last[field]
+        summarized_log['record_timestamp'] = last['record_timestamp']
+        summarized_log['temperature'] = last['temperature']
+        summarized_log['moisture'] = last['moisture']
+        summarized_log['pressure'] = last['pressure']
 
     elif file_detail == file_suffix[1]:  # full
         # eval averages
@@ -0,0 +1,358 @@
+import datetime
+
+from adaptive_sampling import AdaptiveSampler, default_max_read_delay
+from log_processing import ReportAccumulator, extract_average_from_batch
+from plant_registry import get_registry
+from sensor_backends import UserInputBackend
+from thresholds import SAFE, WARNING, ThresholdTable
+from timer_wheel import Timer
+
+file_suffix = ['short', 'full', 'test']
+urgency_labels = ['safe', 'warning']
+process_params = ['moisture', 'temperature', 'pressure']
+phases = ['casting', 'maturation']
+
+
+def merge_two_dicts(x, y):
+    z = x.copy()  # start with x's keys and values
+    z.update(y)  # modifies z with y's keys and values & returns None
+    return z
+
+
+def init_plant(b3f_id, name, type, desc, loc, cls, status, n_issues, n_open_issues, n_checklists,
+               n_open_checklists, date_created, contractor, completion_percentage, pillar_number,
+               superficial_quality, bim_id):
+    """Initializes the plant filling fields that will not be changed during the monitoring session"""
+    plant = {'B3F_id': b3f_id,
+             'name': name,
+             'type': type,
+             'desc': desc,
+             'loc': loc,
+             'cls': cls,
+             'status': status,
+             'n_issues': n_issues,
+             'n_open_issues': n_open_issues,
+             'n_checklists': n_checklists,
+             'n_open_checklists': n_open_checklists,
+             'date_created': date_created,
+             'contractor': contractor,
+             'completion_percentage': completion_percentage,
+             'pillar_number': pillar_number,
+             'superficial_quality': superficial_quality,
+             'BIM_id': bim_id}
+    return plant
+
+
+def upload_log_to_server(payload, file_detail):
+    """Uploads a report with server_connection, which is imported (with requests) on the first report"""
+    import server_connection
+    server_connection.upload_log_to_server(payload=payload, file_detail=file_detail)
+
+
+class LazyRPiConfigs(object):
+    """Stands in for RPiConfigs until it is used: RPi.GPIO is imported, the GPIO pins are set up
+    and the sensor thread is started only on the first access to the board"""
+
+    def __init__(self, **pins):
+        self._pins = pins
+        self._rpi = None
+
+    def __getattr__(self, name):
+        if self._rpi is None:
+            from rpi_conf import RPiConfigs
+            self._rpi = RPiConfigs(**self._pins)
+        return getattr(self._rpi, name)
+
+
+class LazyTimeSeriesStore(object):
+    """Stands in for a TimeSeriesStore until it is used: timeseries_store (with numpy) is imported
+    and the store is opened on the first reading, not when the flowchart is imported"""
+
+    def __init__(self, **options):
+        self._options = options
+        self._store = None
+
+    def __getattr__(self, name):
+        if self._store is None:
+            from timeseries_store import TimeSeriesStore
+            self._store = TimeSeriesStore(**self._options)
+        return getattr(self._store, name)
+
+    def close(self):
+        if self._store is not None:
+            self._store.close()
+
+
+class ConsoleLightOutput(object):
+    """Prints the color of the status light on the console"""
+
+    def __call__(self, color):
+        print("Turning ON LED: " + color)
+
+
+class LEDLightOutput(object):
+    """Turns on the LED of the color on the RPi (see RPiConfigs.status_lights), the pins are
+    written only when the color changes"""
+
+    def __init__(self, rpi):
+        self.rpi = rpi
+
+    def __call__(self, color):
+        self.rpi.status_lights(color)
+
+
+class MonitoringCore(object):
+    """Monitoring of the casting and maturation of a plant, shared by all the flowcharts:
+    they only differ in their constants, in the source of the parameters (a SensorBackend)
+    and in the output of the status light (a callable taking the color)"""
+
+    def __init__(self, expected_values, tolerances, sensor_backend=None, light_output=None,
+                 casting_read_delay=5, maturation_read_delay=5,
+                 full_report_sampling_rate=30, short_report_sampling_rate=120,
+                 short_report_casting_sampling_rate=None, wait_for_input=True,
+                 upload=upload_log_to_server, store=None, registry=None, adaptive_sampling=False,
+                 max_read_delay=default_max_read_delay):
+        self.expected_values = expected_values
+        self.tolerances = tolerances
+        self.threshold_table = ThresholdTable(expected_values, tolerances, params=process_params)
+        self.sensor_backend = sensor_backend if sensor_backend is not None else UserInputBackend()
+        self.light_output = light_output if light_output is not None else ConsoleLightOutput()
+        self.casting_read_delay = casting_read_delay
+        self.maturation_read_delay = maturation_read_delay
+        self.full_report_sampling_rate = full_report_sampling_rate
+        self.short_report_sampling_rate = short_report_sampling_rate
+        self.short_report_casting_sampling_rate = short_report_casting_sampling_rate
+        self.wait_for_input = wait_for_input
+        self.upload = upload
+        # TimeSeriesStore of the raw readings, optional: the full reports keep only the statistics of their window,
+        # the raw samples of a window flagged 'Bad' are read back with store.report_readings(report)
+        self.store = store
+        self.registry = registry  # PlantRegistry, the shared one (get_registry) if None
+        # the read delays are the shortest ones, stable readings are sampled less often (up to max_read_delay)
+        self.adaptive_sampling = adaptive_sampling
+        self.max_read_delay = max_read_delay
+
+    def make_sampler(self):
+        """AdaptiveSampler of a plant, None if the read delays are fixed"""
+        if not self.adaptive_sampling:
+            return None
+        return AdaptiveSampler(self.threshold_table, min_delays={'casting': self.casting_read_delay,
+                                                                 'maturation': self.maturation_read_delay},
+                               max_delay=self.max_read_delay)
+
+    def short_report_rate(self, phase):
+        """Period (in seconds) of the short reports in the phase"""
+        if phase == 'casting':
+            return self.short_report_casting_sampling_rate or self.short_report_sampling_rate
+        return self.short_report_sampling_rate
+
+    def check_params(self, current_params, phase, urgency_label):
+        """Checks if the current parameters are close enough to the expected value,
+         otherwise returns a warning"""
+        return self.threshold_table.check(current_params, phase, urgency_label)
+
+    def classify_params(self, current_params, phase):
+        """Classifies the current parameters as SAFE, WARNING or FAIL (see thresholds)"""
+        return self.threshold_table.classify(current_params, phase)
+
+    def update_params(self):
+        """Updates the current parameters using the chosen channel"""
+        return self.sensor_backend.read_params()
+
+    def record_sample(self, plant, current_params, timestamp):
+        """Stores the reading in the time series store, if any"""
+        if self.store is not None:
+            self.store.append(plant['BIM_id'], timestamp, **current_params)
+
+    def status_light_output(self, color):
+        """Shows the status of the process by turning on a LED o printing the LED color on the console"""
+        self.light_output(color)
+
+    def save_full_report(self, log_full):
+        print("Saving full report to spreadsheet")
+        summarized_log = extract_average_from_batch(log=log_full, file_detail=file_suffix[1])
+        self.upload(payload=summarized_log, file_detail=file_suffix[1])
+        print("Saved!")
+
+    def save_short_report(self, plant, bim_id, phase, status, record_timestamp,
+                          moisture, temperature, pressure):
+        """Save short report to Excel spreadsheet.
+        The plant is registered once, the report carries only the readings"""
+        if self.registry is None:
+            self.registry = get_registry()
+        self.registry.register(plant)
+        short_report = {'BIM_id': bim_id,
+                        'phase': phase,
+                        'status': status,
+                        'record_timestamp': record_timestamp,
+                        'temperature': temperature,
+                        'moisture': moisture,
+                        'pressure': pressure}
+
+        print("Saving short report to spreadsheet")
+        self.upload(payload=short_report, file_detail=file_suffix[0])
+        print("Saved!")
+
+    def monitoring_phase(self, plant, current_phase):
+        """Monitoring session under a specific phase"""
+        log_full = ReportAccumulator(plant['BIM_id'])
+
+        current_params = {
+            'moisture': 0.0,
+            'temperature': 0.0,
+            'pressure': 0.0
+        }
+
+        print(
+            "Phase: {}\n"
+            "Expected moisture at {}: {}\n"
+            "Expected temperature at {}: {}\n"
+            "Expected pressure at {}: {}\n"
+            "Params safe margin: {}\n"
+            "Exit condition: {}\n".format(current_phase.capitalize(),
+                                          current_phase.capitalize(),
+                                          self.expected_values['moisture'][current_phase],
+                                          current_phase.capitalize(),
+                                          self.expected_values['temperature'][current_phase],
+                                          current_phase.capitalize(),
+                                          self.expected_values['pressure'][current_phase],
+                                          self.tolerances['moisture']['safe'],
+                                          self.tolerances['moisture']['warning']))
+
+        # first read
+        current_params['moisture'], \
+        current_params['temperature'], \
+        current_params['pressure'] = self.update_params()
+        self.record_sample(plant, current_params, datetime.datetime.now())
+
+        # start timers: deadlines on the monotonic clock, they do not drift with the time spent reading the sensors
+        start_time_full_report = datetime.datetime.now()
+        full_report_timer = Timer.periodic(self.full_report_sampling_rate)
+        short_report_timer = Timer.periodic(self.short_report_rate(current_phase))
+        if current_phase == 'casting':
+            sampling_timer = Timer.periodic(self.casting_read_delay)
+        else:  # maturation phase
+            sampling_timer = Timer.periodic(self.maturation_read_delay)
+
+        classification = self.classify_params(current_params, phase=current_phase)
+        sampler = self.make_sampler()
+        while classification != SAFE:
+            print("Parameters at {} are not as expected\n"
+                  "Moisture: {}\n"
+                  "Temperature: {}\n"
+                  "Pressure: {}\n".format(current_phase.capitalize(), current_params['moisture'],
+                                          current_params['temperature'], current_params['pressure']))
+
+            # checks if the params are close to the expected value or if the cast has to be stopped
+            if classification == WARNING:
+                # still good
+                print("Parameters are still under control")
+                self.status_light_output('Y')
+            else:  # stop concrete casting
+                print("Something went wrong during the {} phase!".format(current_phase))
+                self.status_light_output('R')
+                return False
+
+            # delay until the next sample
+            if sampler is not None:
+                sampling_timer = sampler.timer(current_params, current_phase)
+            sampling_timer.wait()
+
+            # parameters update
+            current_params['moisture'], \
+            current_params['temperature'], \
+            current_params['pressure'] = self.update_params()
+            sample_time = datetime.datetime.now()
+            self.record_sample(plant, current_params, sample_time)
+            classification = self.classify_params(current_params, phase=current_phase)
+
+            # update log-full
+            log_full.append(phase=current_phase.capitalize(),
+                            status=current_phase.capitalize() + ': Bad',
+                            begin_timestamp=start_time_full_report,
+                            end_timestamp=sample_time,
+                            moisture=current_params['moisture'],
+                            temperature=current_params['temperature'],
+                            pressure=current_params['pressure'])
+
+            if full_report_timer.poll():
+                # save to full report file
+                self.save_full_report(log_full)
+
+                # reset timer and clear log
+                start_time_full_report = datetime.datetime.now()
+                log_full = ReportAccumulator(plant['BIM_id'])
+
+            if short_report_timer.poll():
+                # save to short report file
+                self.save_short_report(plant,
+                                       bim_id=plant['BIM_id'],
+                                       phase=current_phase.capitalize(),
+                                       status=current_phase.capitalize() + ': Bad',
+                                       record_timestamp=datetime.datetime.now(),
+                                       moisture=current_params['moisture'],
+                                       temperature=current_params['temperature'],
+                                       pressure=current_params['pressure'])
+        return True
+
+    def monitoring_session(self, plant):
+        """Monitors the phase of the work, sends feedback and returns True when the work is done"""
+        current_params = {
+            'moisture': 0.0,
+            'temperature': 0.0,
+            'pressure': 0.0
+        }
+
+        start_time = datetime.datetime.now()
+
+        for current_phase in phases:
+            # monitoring
+            result = self.monitoring_phase(plant, current_phase)
+
+            # if something went wrong, stop the entire monitoring system
+            if not result:
+                return False
+
+            # update data with the change of status
+            if current_phase == 'casting':
+                # casting parameters levels as expected
+                print("Parameters at casting are as expected. Moving to concrete maturation phase.")
+
+                # green light
+                self.status_light_output('G')
+
+                if self.wait_for_input:
+                    input("Press any key to proceed to the next phase")
+            else:  # maturation - last phase
+                # maturation level required reached
+                print("Level of maturation required is satisfied. You can now remove the formwork.")
+
+                # green light
+                self.status_light_output('G')
+
+            # parameters update
+            current_params['moisture'], \
+            current_params['temperature'], \
+            current_params['pressure'] = self.update_params()
+
+            # now the phase status will be OK since we moved to the next phase (parameters are as expected)
+            phase_change_record = {'BIM_id': plant['BIM_id'],
+                                   'phase': current_phase.capitalize(),
+                                   'status': current_phase.capitalize() + ': OK',
+                                   'begin_timestamp': start_time,
+                                   'end_timestamp': datetime.datetime.now(),
+                                   'moisture': current_params['moisture'],
+                                   'temperature': current_params['temperature'],
+                                   'pressure': current_params['pressure']}
+
+            # save to Excel spreadsheet before passing to the next phase
+            self.save_full_report([phase_change_record])
+            self.save_short_report(plant,
+                                   bim_id=plant['BIM_id'],
+                                   phase=current_phase.capitalize(),
+                                   status=current_phase.capitalize() + ': OK',
+                                   record_timestamp=datetime.datetime.now(),
+                                   moisture=current_params['moisture'],
+                                   temperature=current_params['temperature'],
+                                   pressure=current_params['pressure'])
+        return True
@@ -0,0 +1,330 @@
+import datetime
+import functools
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from log_processing import ReportAccumulator
+from thresholds import FAIL, SAFE
+from timer_wheel import TimerWheel, default_tick
+
+phases = ['casting', 'maturation']
+
+
+def _log_report_failure(future):
+    """Prints the error raised by a report saved on the worker pool"""
+    error = future.exception()
+    if error is not None:
+        print("Unable to save report: {}".format(error))
+
+
+class PlantMonitor(object):
+    """Casting -> maturation state machine of a single plant.
+    The monitor does not read sensors nor keep time by itself: it is driven by MonitoringScheduler,
+    which feeds it a new sample every time the read delay of the current phase expires and asks
+    for the full/short reports when their timers expire"""
+
+    def __init__(self, plant, core, read_params=None, light_output=None, sampler=None):
+        self.plant = plant
+        self.core = core
+        self.read_params = read_params if read_params is not None else core.update_params
+        self.light_output = light_output if light_output is not None else core.status_light_output
+        self.sampler = sampler  # AdaptiveSampler, the read delays of the phases are fixed if None
+        self.next_read_delay = None
+
+        self.phase_index = 0
+        self.result = None  # None -> running, True -> all phases completed, False -> failed
+        self.status = None  # color of the last sample
+        self.last_params = None
+        self.samples = 0
+        self.pending_reports = []
+        self._start_phase(datetime.datetime.now())
+
+    @property
+    def current_phase(self):
+        return phases[self.phase_index]
+
+    @property
+    def done(self):
+        return self.result is not None
+
+    @property
+    def read_delay(self):
+        """Delay (in seconds) before the next sample, according to the current phase
+        (and to the last readings, with an adaptive sampler)"""
+        if self.next_read_delay is not None:
+            return self.next_read_delay
+        if self.current_phase == 'casting':
+            return self.core.casting_read_delay
+        else:  # maturation phase
+            return self.core.maturation_read_delay
+
+    def _start_phase(self, now):
+        self.next_read_delay = None
+        self.phase_start_time = now
+        self.start_time_full_report = now
+        self.log_full = ReportAccumulator(self.plant['BIM_id'])
+
+    def _complete_phase(self, current_params, now):
+        """Saves the OK reports of the current phase and moves to the next one"""
+        phase = self.current_phase.capitalize()
+
+        # now the phase status will be OK since we moved to the next phase (parameters are as expected)
+        phase_change_record = {'BIM_id': self.plant['BIM_id'],
+                               'phase': phase,
+                               'status': phase + ': OK',
+                               'begin_timestamp': self.phase_start_time,
+                               'end_timestamp': now,
+                               'moisture': current_params['moisture'],
+                               'temperature': current_params['temperature'],
+                               'pressure': current_params['pressure']}
+        self.pending_reports.append(functools.partial(self.core.save_full_report, [phase_change_record]))
+        self.pending_reports.append(functools.partial(self.core.save_short_report, self.plant,
+                                                      bim_id=self.plant['BIM_id'],
+                                                      phase=phase,
+                                                      status=phase + ': OK',
+                                                      record_timestamp=now,
+                                                      moisture=current_params['moisture'],
+                                                      temperature=current_params['temperature'],
+                                                      pressure=current_params['pressure']))
+
+        if self.phase_index == len(phases) - 1:  # maturation - last phase
+            print("{}: level of maturation required is satisfied. "
+                  "You can now remove the formwork.".format(self.plant['BIM_id']))
+            self.result = True
+        else:
+            print("{}: parameters at casting are as expected. "
+                  "Moving to concrete maturation phase.".format(self.plant['BIM_id']))
+            self.phase_index += 1
+            self._start_phase(now)
+
+    def process_sample(self, moisture, temperature, pressure, now=None):
+        """Advances the state machine with a new sample and returns the status color.
+        Reports that have to be saved are queued in pending_reports"""
+        if now is None:
+            now = datetime.datetime.now()
+        self.samples += 1
+
+        current_phase = self.current_phase
+        current_params = {'moisture': moisture,
+                          'temperature': temperature,
+                          'pressure': pressure}
+        self.last_params = current_params
+
+        classification = self.core.classify_params(current_params, phase=current_phase)
+        if classification == SAFE:
+            # parameters as expected, green light
+            self.status = 'G'
+            self.light_output('G')
+            self._complete_phase(current_params, now)
+            return 'G'
+
+        # checks if the params are close to the expected value or if the cast has to be stopped
+        if classification == FAIL:
+            print("{}: something went wrong during the {} phase!".format(self.plant['BIM_id'], current_phase))
+            self.status = 'R'
+            self.light_output('R')
+            self.result = False
+            return 'R'
+
+        # still good
+        self.status = 'Y'
+        self.light_output('Y')
+        if self.sampler is not None:
+            self.next_read_delay = self.sampler.next_delay(current_params, current_phase, now.timestamp())
+        phase = current_phase.capitalize()
+        self.log_full.append(phase=phase,
+                             status=phase + ': Bad',
+                             begin_timestamp=self.start_time_full_report,
+                             end_timestamp=now,
+                             moisture=moisture,
+                             temperature=temperature,
+                             pressure=pressure)
+        return 'Y'
+
+    def full_report(self, now=None):
+        """Queues the full report of the samples collected since the previous one"""
+        if now is None:
+            now = datetime.datetime.now()
+        if self.done or not len(self.log_full):
+            return
+        self.pending_reports.append(functools.partial(self.core.save_full_report, self.log_full))
+
+        # reset timer and start a new accumulator, the full one is still referenced by the report
+        self.start_time_full_report = now
+        self.log_full = ReportAccumulator(self.plant['BIM_id'])
+
+    def short_report(self, now=None):
+        """Queues the short report of the last sample, while the parameters are not as expected"""
+        if now is None:
+            now = datetime.datetime.now()
+        if self.done or self.status != 'Y':
+            return
+        phase = self.current_phase.capitalize()
+        self.pending_reports.append(functools.partial(self.core.save_short_report, self.plant,
+                                                      bim_id=self.plant['BIM_id'],
+                                                      phase=phase,
+                                                      status=phase + ': Bad',
+                                                      record_timestamp=now,
+                                                      moisture=self.last_params['moisture'],
+                                                      temperature=self.last_params['temperature'],
+                                                      pressure=self.last_params['pressure']))
+
+    def pop_reports(self):
+        """Returns the reports queued since the last call and clears the queue"""
+        reports = self.pending_reports
+        self.pending_reports = []
+        return reports
+
+
+class MonitoringScheduler(object):
+    """Runs the monitoring sessions of many plants concurrently in a single process.
+    Every plant keeps its own state machine, log_full accumulator and report timers; sampling and
+    reporting deadlines of all the plants are kept in a single timer wheel on the monotonic clock,
+    so report cadence does not depend on how long the sensor reads take.
+    With workers > 0, sensor reads and report uploads run on a thread pool, so that a slow sensor
+    or a slow server never delays the other plants; with workers = 0 everything runs inline.
+    With a TimeSeriesStore, every reading is also stored in the series of its plant.
+    clock and sleep can be replaced by a simulated clock (inline only, workers = 0), e.g. to benchmark"""
+
+    def __init__(self, core, workers=0, tick=default_tick, catch_up='skip', store=None, clock=time.monotonic,
+                 sleep=time.sleep):
+        self.core = core
+        self.store = store
+        self.catch_up = catch_up
+        self.monitors = []
+        self.sleep = sleep
+        self._wheel = TimerWheel(tick=tick, clock=clock)
+        self._timers = {}  # monitor -> (sampling, full report, short report) timers
+        self._active = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers) if workers else None
+        self._completed = queue.Queue()
+        self._reading = set()
+        self._running = False
+
+    def add_plant(self, plant, read_params=None, light_output=None, sampler=None):
+        """Adds a plant (see init_plant) to the monitored ones, its first sample is taken at the next tick.
+        With an AdaptiveSampler (see MonitoringCore.make_sampler) every sample is scheduled after its own delay"""
+        monitor = PlantMonitor(plant, self.core, read_params=read_params, light_output=light_output,
+                               sampler=sampler)
+        self.monitors.append(monitor)
+        self._active += 1
+        self._start_timers(monitor, sampling_delay=0)
+        return monitor
+
+    def _start_timers(self, monitor, sampling_delay):
+        """(Re)starts the sampling and report timers of the plant, at the beginning of each phase"""
+        for timer in self._timers.get(monitor, ()):
+            timer.cancel()
+
+        full_rate = self.core.full_report_sampling_rate
+        short_rate = self.core.short_report_rate(monitor.current_phase)
+        self._timers[monitor] = (
+            self._wheel.schedule(sampling_delay, functools.partial(self._sample, monitor),
+                                 period=monitor.read_delay if monitor.sampler is None else None,
+                                 catch_up=self.catch_up),
+            self._wheel.schedule(full_rate, functools.partial(self._report, monitor, monitor.full_report),
+                                 period=full_rate, catch_up=self.catch_up),
+            self._wheel.schedule(short_rate, functools.partial(self._report, monitor, monitor.short_report),
+                                 period=short_rate, catch_up=self.catch_up))
+
+    def _dispatch(self, monitor):
+        for report in monitor.pop_reports():
+            if self._executor is None:
+                report()
+            else:
+                self._executor.submit(report).add_done_callback(_log_report_failure)
+
+    def _report(self, monitor, report):
+        report()
+        self._dispatch(monitor)
+
+    def _sample(self, monitor):
+        """Reads the sensors of the plant, on the worker pool if available"""
+        if self._executor is None:
+            try:
+                params = monitor.read_params()
+            except Exception as e:
+                self._read_failed(monitor, e)
+                return
+            self._handle_sample(monitor, params)
+        elif monitor not in self._reading:  # the previous read of a slow sensor is still running
+            self._reading.add(monitor)
+            future = self._executor.submit(monitor.read_params)
+            future.add_done_callback(lambda f, m=monitor: self._completed.put((m, f)))
+
+    def _read_failed(self, monitor, error):
+        """A failed sensor read skips the sample of the plant, the other plants are not affected"""
+        print("{}: unable to read the sensors: {}".format(monitor.plant['BIM_id'], error))
+        if monitor.sampler is not None and monitor in self._timers:
+            # the samples of an adaptive sampler are one-shot timers: the next one is after the read delay
+            sampling, full, short = self._timers[monitor]
+            self._timers[monitor] = (
+                self._wheel.schedule(monitor.read_delay, functools.partial(self._sample, monitor)), full, short)
+
+    def _handle_sample(self, monitor, params):
+        phase_index = monitor.phase_index
+        now = datetime.datetime.now()
+        if self.store is not None:
+            moisture, temperature, pressure = params
+            self.store.append(monitor.plant['BIM_id'], now, moisture=moisture, temperature=temperature,
+                              pressure=pressure)
+        monitor.process_sample(*params, now=now)
+        self._dispatch(monitor)
+
+        if monitor.done:
+            for timer in self._timers.pop(monitor):
+                timer.cancel()
+            self._active -= 1
+        elif monitor.phase_index != phase_index:
+            self._start_timers(monitor, sampling_delay=monitor.read_delay)
+        elif monitor.sampler is not None:
+            sampling, full, short = self._timers[monitor]
+            # the next sample after the delay chosen by the sampler for these readings
+            self._timers[monitor] = (
+                self._wheel.schedule(monitor.read_delay, functools.partial(self._sample, monitor)), full, short)
+
+    def _collect(self, timeout):
+        """Handles the sensor reads completed on the worker pool, waiting at most timeout seconds"""
+        try:
+            monitor, future = self._completed.get(timeout=timeout)
+        except queue.Empty:
+            return
+
+        while True:
+            self._reading.discard(monitor)
+            error = future.exception()
+            if error is None:
+                self._handle_sample(monitor, future.result())
+            else:
+                self._read_failed(monitor, error)
+            try:
+                monitor, future = self._completed.get_nowait()
+            except queue.Empty:
+                return
+
+    def run(self):
+        """Monitors all the plants until each one completed or failed its session.
+        Returns the results of the plants, in the order they were added"""
+        self._running = True
+        while self._running and (self._active or self._reading):
+            self._wheel.advance()
+
+            timeout = max(0.0, self._wheel.next_tick_time() - self._wheel.clock())
+            if self._reading:
+                self._collect(timeout)
+            elif timeout:
+                self.sleep(timeout)
+
+        return [monitor.result for monitor in self.monitors]
+
+    def stop(self):
+        """Stops the scheduler after the current iteration"""
+        self._running = False
+
+    def close(self):
+        """Waits for the pending reports and releases the worker pool"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        if self.store is not None:
+            self.store.flush()
@@ -0,0 +1,93 @@
+import json
+import sqlite3
+import threading
+
+default_outbox_path = 'outbox.sqlite3'
+
+# max number of reports kept on disk, the oldest are dropped first
+max_outbox_entries = 500000
+
+
+class ReportOutbox(object):
+    """Append-only local store (SQLite in WAL mode) of the reports waiting to be sent to the server.
+    Every report goes into the outbox first, so it survives network outages and restarts:
+    the uploader reads the oldest entries with peek() and removes them with ack() once the server
+    received them"""
+
+    def __init__(self, path=default_outbox_path, max_entries=max_outbox_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self.dropped = 0
+        self._acked_since_compaction = 0
+        self._lock = threading.Lock()
+
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # auto_vacuum has to be set before the table is created
+        self._connection.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS reports ('
+                                 'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                                 'file_detail TEXT NOT NULL, '
+                                 'payload TEXT NOT NULL)')
+        self._count = self._connection.execute('SELECT COUNT(*) FROM reports').fetchone()[0]
+
+    def __len__(self):
+        return self._count
+
+    def append(self, payload, file_detail):
+        """Stores a report at the end of the outbox"""
+        self.append_many([(file_detail, payload)])
+
+    def append_many(self, reports):
+        """Stores a list of (file_detail, payload) reports with a single transaction"""
+        rows = [(file_detail, json.dumps(payload, default=str)) for file_detail, payload in reports]
+        with self._lock:
+            with self._connection:
+                self._connection.execute('BEGIN')
+                self._connection.executemany('INSERT INTO reports (file_detail, payload) VALUES (?, ?)', rows)
+            self._count += len(rows)
+
+            if self._count > self.max_entries:
+                # bounded disk usage: drop the oldest reports
+                overflow = self._count - self.max_entries
+                with self._connection:
+                    self._connection.execute('BEGIN')
+                    deleted = self._connection.execute('DELETE FROM reports WHERE id IN '
+                                                       '(SELECT id FROM reports ORDER BY id LIMIT ?)',
+                                                       (overflow,)).rowcount
+                self._count -= deleted
+                self.dropped += deleted
+                self._acked_since_compaction += deleted
+
+    def peek(self, limit):
+        """Returns the oldest reports as (id, file_detail, encoded payload) tuples, without removing them"""
+        with self._lock:
+            return self._connection.execute('SELECT id, file_detail, payload FROM reports '
+                                            'ORDER BY id LIMIT ?', (limit,)).fetchall()
+
+    def ack(self, ids):
+        """Removes the reports received by the server, the ones already dropped (see max_entries) are skipped"""
+        with self._lock:
+            with self._connection:
+                self._connection.execute('BEGIN')
+                # counts only the rows deleted here, not the ones dropped since peek()
+                deleted = self._connection.executemany('DELETE FROM reports WHERE id = ?',
+                                                       [(i,) for i in ids]).rowcount
+            self._count -= deleted
+            self._acked_since_compaction += deleted
+
+    def compact(self):
+        """Gives back to the file system the space of the acknowledged reports"""
+        with self._lock:
+            if not self._acked_since_compaction:
+                return
+            # executescript steps the pragma until every free page has been released
+            self._connection.executescript('PRAGMA incremental_vacuum;')
+            self._connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            self._acked_since_compaction = 0
+
+    def close(self):
+        self.compact()
+        with self._lock:
+            self._connection.close()
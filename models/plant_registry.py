@@ -0,0 +1,75 @@
+import json
+import os
+import threading
+
+from log_processing import plant_fields
+
+default_registry_path = 'plants.json'
+
+
+class PlantRegistry(object):
+    """Static fields of the monitored plants (see init_plant), by BIM_id.
+    The plants are registered once per monitoring session and sent to the server by the uploader,
+    so the short reports carry only the readings. With a path the registry is cached on disk,
+    to send the plants of the reports left in the outbox after a restart"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._plants = {}
+        self._sources = {}  # BIM_id -> plant dict registered last, to skip the registered ones quickly
+        if path is not None and os.path.exists(path):
+            with open(path) as registry_file:
+                self._plants = json.load(registry_file)
+
+    def __len__(self):
+        return len(self._plants)
+
+    def __contains__(self, bim_id):
+        return bim_id in self._plants
+
+    def register(self, plant):
+        """Registers the static fields of a plant, returns False if they were already registered"""
+        bim_id = plant['BIM_id']
+        if self._sources.get(bim_id) is plant:
+            return False
+        fields = {field: plant.get(field) for field in plant_fields}
+        with self._lock:
+            self._sources[bim_id] = plant
+            if self._plants.get(bim_id) == fields:
+                return False
+            self._plants[bim_id] = fields
+            self._save()
+        return True
+
+    def get(self, bim_id, default=None):
+        """Static fields of a plant, default if the plant is not registered
+        :rtype: dict
+        """
+        return self._plants.get(bim_id, default)
+
+    def _save(self):
+        if self.path is None:
+            return
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w') as registry_file:
+            json.dump(self._plants, registry_file, default=str)
+        os.replace(temporary_path, self.path)
+
+
+_registry = None
+
+
+def get_registry():
+    """Returns the registry shared by the monitoring sessions and the uploader of this process"""
+    global _registry
+    if _registry is None:
+        _registry = PlantRegistry(path=default_registry_path)
+    return _registry
+
+
+def set_registry(registry):
+    """Replaces the shared registry (e.g. with one kept in memory), returns the previous one"""
+    global _registry
+    previous, _registry = _registry, registry
+    return previous
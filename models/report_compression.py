@@ -0,0 +1,134 @@
+import threading
+import time
+
+from log_processing import file_suffix, float_precision, process_params
+
+# deadband of every parameter (in the units of the readings): a report is sent when one of its readings
+# moved more than this from the last report sent for the plant
+default_deadbands = {'temperature': 0.5, 'moisture': 1.0, 'pressure': 1.0}
+
+# a report of every plant is sent at least once every heartbeat seconds, even if nothing changed
+default_heartbeat = 15 * 60
+
+# fields that always make a report to be sent when they change
+state_fields = ['phase', 'status']
+
+
+class ReportCompressor(object):
+    """Compression stage between extract_average_from_batch and the uploader, with the signature of the
+    upload of MonitoringCore: a report is uploaded only if it tells something new about its plant, i.e.
+    its phase or status changed, one of its readings moved beyond its deadband from the last report
+    uploaded (exception deadband), or no report of the plant was uploaded for heartbeat seconds, so that
+    the server still sees the plant alive. The other reports are suppressed and counted.
+    The deadband is checked against the last uploaded report and not against a trend (as a swinging door
+    would do), so the last report on the server is always within the deadband of the current readings.
+    The windows of the full reports suppressed are not lost: they are folded into the next full report
+    uploaded for the plant (its begin_timestamp goes back to the first window and its readings are averaged
+    over all the windows) when it is a heartbeat, and into a report of their own, uploaded before it, when
+    it changed, so the full reports on the server always cover the whole session"""
+
+    def __init__(self, upload, deadbands=None, heartbeat=default_heartbeat, clock=time.monotonic):
+        self.upload = upload
+        self.deadbands = dict(default_deadbands if deadbands is None else deadbands)
+        self.heartbeat = heartbeat
+        self.clock = clock
+        self._last = {}  # (file_detail, BIM_id) -> (time, report) of the last report uploaded
+        self._suppressed = {}  # BIM_id -> full reports suppressed since the last one uploaded
+        self._counts = {detail: {'received': 0, 'sent': 0, 'heartbeats': 0, 'suppressed': 0, 'folded': 0}
+                        for detail in file_suffix}
+        self._lock = threading.Lock()
+
+    def __call__(self, payload, file_detail):
+        if not isinstance(payload, dict):
+            self.upload(payload=payload, file_detail=file_detail)
+            return
+        now = self.clock()
+        bim_id = payload.get('BIM_id')
+        key = (file_detail, bim_id)
+        full = file_detail == file_suffix[1]
+        reports = [payload]
+        with self._lock:
+            counts = self._counts[file_detail]
+            counts['received'] += 1
+            last = self._last.get(key)
+            if last is not None:
+                sent_time, sent = last
+                changed = self.changed(sent, payload)
+                if not changed and now - sent_time < self.heartbeat:
+                    counts['suppressed'] += 1
+                    if full:
+                        self._suppressed.setdefault(bim_id, []).append(payload)
+                    return
+                if not changed:
+                    counts['heartbeats'] += 1
+                suppressed = self._suppressed.pop(bim_id, None) if full else None
+                if suppressed and changed:
+                    # the suppressed windows have the state and the readings of the report uploaded last
+                    reports = [fold(suppressed), payload]
+                    counts['sent'] += 1
+                elif suppressed:
+                    reports = [fold(suppressed + [payload])]
+                if suppressed:
+                    counts['folded'] += len(suppressed)
+            counts['sent'] += 1
+            self._last[key] = (now, dict(reports[-1]))
+        for report in reports:
+            self.upload(payload=report, file_detail=file_detail)
+
+    def changed(self, sent, report):
+        """Whether report has to be sent after the report sent"""
+        if any(sent.get(field) != report.get(field) for field in state_fields):
+            return True
+        for param in process_params:
+            old, new = sent.get(param), report.get(param)
+            if old is None or new is None:
+                if old is not new:
+                    return True
+            elif abs(new - old) > self.deadbands.get(param, 0.0):
+                return True
+        return False
+
+    def forget(self, bim_id):
+        """Drops the state of a plant, e.g. at the end of its monitoring session,
+        uploading the full reports suppressed since the last one uploaded"""
+        with self._lock:
+            for detail in file_suffix:
+                self._last.pop((detail, bim_id), None)
+            suppressed = self._suppressed.pop(bim_id, None)
+            if suppressed:
+                counts = self._counts[file_suffix[1]]
+                counts['sent'] += 1
+                counts['folded'] += len(suppressed)
+        if suppressed:
+            self.upload(payload=fold(suppressed), file_detail=file_suffix[1])
+
+    def statistics(self):
+        """Reports received, sent (of which heartbeats) and suppressed (of which folded into a report sent),
+        with the reduction ratio (received / sent) of every kind of report
+        :rtype: dict
+        """
+        with self._lock:
+            statistics = {}
+            for detail, counts in self._counts.items():
+                statistics[detail] = dict(counts, reduction_ratio=counts['received'] / counts['sent']
+                                          if counts['sent'] else None)
+            return statistics
+
+    def print_statistics(self):
+        for detail, counts in self.statistics().items():
+            if counts['received']:
+                print("{} reports: {} received, {} sent ({} heartbeats), {} suppressed ({} folded), "
+                      "reduction {:.1f}x".format(detail, counts['received'], counts['sent'], counts['heartbeats'],
+                                                 counts['suppressed'], counts['folded'], counts['reduction_ratio']))
+
+
+def fold(reports):
+    """Full report of a run of consecutive full reports of a plant, from the begin of the first one to the end of
+    the last one, with the state of the last one and the readings averaged over the windows
+    :rtype: dict
+    """
+    folded = dict(reports[-1], begin_timestamp=reports[0].get('begin_timestamp'))
+    for param in process_params:
+        values = [report[param] for report in reports if report.get(param) is not None]
+        folded[param] = round(sum(values) / len(values), float_precision) if values else None
+    return folded
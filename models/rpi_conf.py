@@ -1,18 +1,83 @@
 import datetime
+import threading
 import time
 
 import RPi.GPIO as GPIO
 
 # import I2C_LCD_driver
 import dht11
+from status_leds import LEDController, StatusLights
 
 # delay between two readings if the first was not valid
 retry_delay = 1
 
-LED_status = {'r': False, 'y': False, 'g': False}  # False ->OFF, True -> ON
+# delay between two readings of the sensor acquisition thread (DHT11 can be read at most once per second)
+sensor_read_cycle = 2
+
+# max time (in seconds) to wait for the first valid reading
+sensor_read_timeout = 5
+
+# age (in seconds) after which the last valid reading is reported as stale
+sensor_stale_after = 15
+
 LED_colors = ['r', 'y', 'g']
 
 
+class SensorService(object):
+    """Reads the DHT11 sensor on a background thread, with a single physical read per cycle,
+    and caches the last valid DHT11Result with its timestamp.
+    Temperature and humidity are served from the cache, so the control loop never waits for the sensor:
+    when the valid readings are too old, they are reported as stale"""
+
+    def __init__(self, sensor, cycle=sensor_read_cycle, timeout=sensor_read_timeout, stale_after=sensor_stale_after):
+        self.sensor = sensor
+        self.cycle = cycle
+        self.timeout = timeout
+        self.stale_after = stale_after
+        self.reads = 0
+        self.errors = 0
+
+        self._lock = threading.Lock()
+        self._latest = None  # (monotonic time, timestamp, DHT11Result)
+        self._first_read = threading.Event()
+        self._stop = threading.Event()
+        self._worker = threading.Thread(target=self._run, name='dht11-sensor', daemon=True)
+        self._worker.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                result = self.sensor.read()
+            except Exception as e:
+                # e.g. a GPIO error: the readers get the last valid reading, reported as stale when too old
+                print("Unable to read the sensor: {}".format(e))
+                self.errors += 1
+                self._stop.wait(retry_delay)
+                continue
+            self.reads += 1
+            if result.is_valid():
+                with self._lock:
+                    self._latest = (time.monotonic(), datetime.datetime.now(), result)
+                self._first_read.set()
+                self._stop.wait(self.cycle)
+            else:
+                self.errors += 1
+                self._stop.wait(retry_delay)
+
+    def latest(self):
+        """Returns the timestamp and the DHT11Result of the last valid reading and whether it is stale,
+        waiting at most timeout seconds for the first valid reading (None, None, True if there is none)"""
+        if not self._first_read.wait(self.timeout):
+            return None, None, True
+        with self._lock:
+            read_time, timestamp, result = self._latest
+        return timestamp, result, time.monotonic() - read_time > self.stale_after
+
+    def stop(self):
+        self._stop.set()
+        self._worker.join()
+
+
 class RPiConfigs(object):
     """Configuration class to call when initializing a session with RPi"""
 
@@ -22,6 +87,7 @@ class RPiConfigs(object):
         self.yellow_LED_pin = yellow_LED_pin
         self.red_LED_pin = red_LED_pin
         self.moisture_sensor_instance = dht11.DHT11(pin=moisture_temp_sensor_pin)
+        self.sensor_service = SensorService(self.moisture_sensor_instance)
         self.LED_mapping = {'r': red_LED_pin, 'g': green_LED_pin, 'y': yellow_LED_pin}
         # self.lcd = I2C_LCD_driver.lcd()
 
@@ -31,7 +97,27 @@ class RPiConfigs(object):
         GPIO.setup(green_LED_pin, GPIO.OUT)
         GPIO.setup(yellow_LED_pin, GPIO.OUT)
         GPIO.setup(red_LED_pin, GPIO.OUT)
-        GPIO.cleanup()
+
+        # LEDs of this board, the pins are written only on a change of level
+        self.leds = LEDController(GPIO.output)
+        for color, pin in self.LED_mapping.items():
+            self.leds.add(color, pin)
+        self.status_lights = StatusLights(self.leds, {color.upper(): color for color in LED_colors})
+
+    @property
+    def LED_status(self):
+        """Levels of the LEDs, False -> OFF, True -> ON"""
+        return self.leds.levels()
+
+    def add_status_lights(self, name, red_LED_pin, yellow_LED_pin, green_LED_pin, blink=None):
+        """Sets up the red, yellow and green LEDs of another plant, returns their light output (StatusLights):
+        the LEDs of all the plants share the LEDController of the board"""
+        leds = {}
+        for color, pin in [('R', red_LED_pin), ('Y', yellow_LED_pin), ('G', green_LED_pin)]:
+            GPIO.setup(pin, GPIO.OUT)
+            leds[color] = (name, color)
+            self.leds.add(leds[color], pin)
+        return StatusLights(self.leds, leds, blink=blink)
 
     # def clear_lcd(self):
     #     """Clears the lcd screen"""
@@ -49,34 +135,34 @@ class RPiConfigs(object):
         if LED_color not in LED_colors:
             print('No LED with the selected color')
         else:
-            if action == 'OFF':
-                GPIO.output(self.LED_mapping[LED_color], GPIO.LOW)
-                LED_status[LED_color] = False
-            else:
-                GPIO.output(self.LED_mapping[LED_color], GPIO.HIGH)
-                LED_status[LED_color] = True
+            self.leds.set(LED_color, action != 'OFF')
 
     def switch_off_all(self):
         """Switches off all the LEDs connected"""
-        for l in LED_colors:
-            self.change_LED_status(action='OFF', LED_color=l)
+        self.leds.set_many({l: False for l in LED_colors})
+
+    def close(self):
+        """Switches off the LEDs, stops the threads and releases the GPIO pins"""
+        self.leds.close()
+        self.sensor_service.stop()
+        GPIO.cleanup()
+
+    @property
+    def read_sample(self):
+        """Last valid reading of the sensor as (timestamp, temperature, humidity, stale)"""
+        timestamp, result, stale = self.sensor_service.latest()
+        if result is None:
+            return None, None, None, True
+        return str(timestamp), result.temperature, result.humidity, stale
 
     @property
     def read_temperature(self):
         """Read temperature in Celsius degrees from the sensor"""
-        while True:
-            result = self.moisture_sensor_instance.read()
-            if result.is_valid():
-                return str(datetime.datetime.now()), self.moisture_sensor_instance.read().temperature
-            else:
-                time.sleep(retry_delay)
+        timestamp, temperature, humidity, stale = self.read_sample
+        return timestamp, temperature
 
     @property
     def read_humidity(self):
         """Read relative humidity from the sensor"""
-        while True:
-            result = self.moisture_sensor_instance.read()
-            if result.is_valid():
-                return str(datetime.datetime.now()), self.moisture_sensor_instance.read().humidity
-            else:
-                time.sleep(retry_delay)
+        timestamp, temperature, humidity, stale = self.read_sample
+        return timestamp, humidity
@@ -0,0 +1,143 @@
+import math
+import random
+
+# phases of the simulated curves
+phases = ['casting', 'maturation']
+
+# reads of the RPi sensor (each one waits for the first valid reading, see RPiConfigs) before giving up
+max_sensor_attempts = 3
+
+
+class SensorUnavailableError(IOError):
+    """The sensor never returned a valid reading"""
+
+
+class SensorBackend(object):
+    """Source of the samples of the monitored parameters"""
+
+    def read_params(self):
+        """Returns the current (moisture, temperature, pressure)"""
+        raise NotImplementedError
+
+
+class UserInputBackend(SensorBackend):
+    """Asks the user to enter the parameters manually"""
+
+    def read_params(self):
+        input_moisture = float(input("Enter current moisture: "))
+        input_temperature = float(input("Enter current temperature: "))
+        input_pressure = float(input("Enter current pressure: "))
+        return input_moisture, input_temperature, input_pressure
+
+
+class RPiSensorBackend(SensorBackend):
+    """Reads the DHT11 sensor connected to the RPi (see RPiConfigs),
+    the pressure is estimated by the humidity"""
+
+    def __init__(self, rpi):
+        self.rpi = rpi
+
+    def read_params(self):
+        """Raises SensorUnavailableError if the sensor returned no valid reading since the start (e.g. it is
+        unplugged), readings too old are returned and reported as stale"""
+        for _ in range(max_sensor_attempts):
+            timestamp, temperature, humidity, stale = self.rpi.read_sample
+            if temperature is not None:
+                break
+            print("No valid reading from the sensor yet")
+        else:
+            raise SensorUnavailableError('No valid reading from the sensor after {} attempts'.format(
+                max_sensor_attempts))
+        if stale:
+            print("Sensor readings are stale, last valid reading at {}".format(timestamp))
+
+        detected_moisture = humidity
+        detected_temperature = temperature
+        detected_pressure = humidity
+        return detected_moisture, detected_temperature, detected_pressure
+
+
+class SimulatedSensorBackend(SensorBackend):
+    """Deterministic simulation of the sensors of a plant, to run and load-test the monitoring
+    pipeline without hardware.
+    During casting every parameter starts off the expected value (in the warning band) and settles
+    exponentially on it; maturation starts from the casting values (clamped in the warning band),
+    settles on the maturation expected values and the temperature shows the hydration heat peak.
+    Readings have gaussian noise, CRC errors (retried, as the DHT11 reader does) and dropouts
+    (the last valid reading is returned again). Once the readings of a phase are as expected
+    according to check_params, the simulation moves to the next phase, as the monitoring does.
+    With failure_rate > 0 a phase can drift away from the expected values instead of settling"""
+
+    def __init__(self, expected_values, check_params, seed=0, sample_period=5, casting_duration=30 * 60,
+                 maturation_duration=6 * 60 * 60, start_offset=5.0, hydration_peak=3.0, noise=0.3,
+                 dropout_rate=0.0, crc_error_rate=0.0, failure_rate=0.0):
+        self.expected_values = expected_values
+        self.check_params = check_params
+        self.sample_period = sample_period
+        self.durations = {'casting': casting_duration, 'maturation': maturation_duration}
+        self.start_offset = start_offset
+        self.hydration_peak = hydration_peak
+        self.noise = noise
+        self.dropout_rate = dropout_rate
+        self.crc_error_rate = crc_error_rate
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+
+        # statistics
+        self.reads = 0
+        self.crc_errors = 0
+        self.dropouts = 0
+
+        self.last_params = None
+        self.phase_index = 0
+        self._start_phase({param: values['casting'] + self.random.choice([-1, 1]) * start_offset
+                           for param, values in expected_values.items()})
+
+    @property
+    def phase(self):
+        return phases[self.phase_index]
+
+    def _start_phase(self, start_values):
+        expected = {param: values[self.phase] for param, values in self.expected_values.items()}
+        self.elapsed = 0.0
+        self.failing = self.random.random() < self.failure_rate
+        # start from the previous values, at most start_offset away from the expected ones
+        self.offsets = {param: max(-self.start_offset, min(self.start_offset, start_values[param] - expected[param]))
+                        for param in expected}
+        self.expected = expected
+
+    def _curve(self, param):
+        """Noiseless value of the parameter at the current time of the phase"""
+        tau = self.durations[self.phase] / 3.0
+        t = self.elapsed
+        if self.failing:
+            # drifts away from the expected value, until the monitoring stops the cast
+            return self.expected[param] + self.offsets[param] * math.exp(t / tau)
+
+        value = self.expected[param] + self.offsets[param] * math.exp(-t / tau)
+        if self.phase == 'maturation' and param == 'temperature':
+            # hydration heat, peaking at tau / 2
+            peak_time = tau / 2
+            value += self.hydration_peak * (t / peak_time) * math.exp(1 - t / peak_time) * math.exp(-t / tau)
+        return value
+
+    def read_params(self):
+        self.reads += 1
+
+        # a failed checksum is read again, as RPiConfigs does
+        while self.random.random() < self.crc_error_rate:
+            self.crc_errors += 1
+
+        # the reading that completed the previous phase is not repeated in the new one
+        if self.elapsed > 0 and self.random.random() < self.dropout_rate:
+            self.dropouts += 1
+            return self.last_params
+
+        self.elapsed += self.sample_period
+        params = {param: self._curve(param) + self.random.gauss(0, self.noise) for param in self.expected}
+        self.last_params = params['moisture'], params['temperature'], params['pressure']
+
+        if self.phase_index < len(phases) - 1 and self.check_params(params, phase=self.phase, urgency_label='safe'):
+            self.phase_index += 1
+            self._start_phase(params)
+        return self.last_params
@@ -1,8 +1,46 @@
+import atexit
+import collections
+import json
+import queue
+import threading
+import time
+
 import requests
+from requests.adapters import HTTPAdapter
+
+import wire_format
+from outbox import ReportOutbox
+from plant_registry import get_registry
 
 heroku_root_url = 'https://concrete-flowchart.herokuapp.com/'
 localhost_root_url = 'http://127.0.0.1:4999/'
 file_suffix = ['short', 'full']
+endpoints = {'short': 'short_summary', 'full': 'full_summary'}
+plants_endpoint = 'plants'
+
+# max number of reports coalesced in a single bulk request
+max_batch_size = 500
+
+# time (in seconds) the uploader waits for more reports before sending a batch
+coalesce_delay = 1
+
+# reports kept in memory (without an outbox) while the server is not reachable: the reports of the batches
+# that failed all their retries are sent again after a backoff, the oldest are dropped first
+max_pending_reports = 10000
+
+# retries of a failed bulk request, the delay (in seconds) is doubled at every attempt
+max_retries = 3
+retry_backoff = 0.5
+request_timeout = 10
+
+# max delay (in seconds) between two attempts to drain the outbox while the server is not reachable
+max_outage_backoff = 5 * 60
+
+# store the reports in a local outbox before sending them
+use_outbox = True
+
+# send the reports with the binary wire format when the server supports it, JSON otherwise
+use_wire_format = True
 
 
 def send_log_to_server(payload, file_detail):
@@ -16,3 +54,358 @@ def send_log_to_server(payload, file_detail):
 
     r = requests.get(url=url, params=payload)
     print("Sending request to: " + r.url)
+
+
+class WireFormatRejected(Exception):
+    """The server does not support the version of a binary batch (415)"""
+
+
+class FlushMarker(threading.Event):
+    """Queued by ReportUploader.flush after the reports to send, set once they were delivered or given up"""
+
+    def __init__(self, dropped):
+        super(FlushMarker, self).__init__()
+        self.dropped = dropped  # reports dropped by the uploader when the marker was queued
+        self.delivered = False
+
+
+class ReportUploader(object):
+    """Uploads the reports to the server from a background thread.
+    Reports submitted within coalesce_delay are grouped by endpoint and sent as a single bulk POST
+    (a JSON list of reports), reusing the keep-alive connections of a pooled session.
+    Without an outbox the pending reports are kept in memory; with a ReportOutbox every report is
+    stored on disk first and the thread drains the outbox in large batches whenever the server
+    is reachable, so no report is lost during network outages or restarts.
+    The short reports carry only the readings: the plants of the registry are sent to the plants endpoint
+    (or in the binary batches, if the server supports the wire format) once per session, and merged
+    into the reports only for the servers without the plants endpoint"""
+
+    _stop = object()
+
+    def __init__(self, root_url=heroku_root_url, batch_size=max_batch_size, delay=coalesce_delay,
+                 max_pending=max_pending_reports, retries=max_retries, backoff=retry_backoff, outbox=None,
+                 binary=use_wire_format, registry=None):
+        self.root_url = root_url
+        self.outbox = outbox
+        self.batch_size = batch_size
+        self.delay = delay
+        self.max_pending = max_pending
+        self.retries = retries
+        self.backoff = backoff
+
+        # version of the wire format negotiated with the server, 0 for JSON, None until negotiated
+        self.wire_version = None if binary else 0
+        self.registry = registry if registry is not None else get_registry()
+        self.wire_encoder = wire_format.SessionEncoder(plants=self.registry)
+        self.plants_endpoint = True
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(endpoints), pool_maxsize=len(endpoints))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        # statistics
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+
+        self._queue = queue.Queue()
+        self._unsent = collections.deque()  # reports of the failed batches, oldest first
+        self._closed = False
+        self._flushing = False
+        self._wakeup = threading.Event()
+        self._drained = threading.Condition()
+        self._worker = threading.Thread(target=self._run if outbox is None else self._drain_outbox,
+                                        name='report-uploader', daemon=True)
+        self._worker.start()
+
+    def submit(self, payload, file_detail):
+        """Queues a report for the upload, never waits on the network"""
+        if self._closed:
+            raise RuntimeError('The uploader has been closed')
+        if self.outbox is not None:
+            self.outbox.append(payload=payload, file_detail=file_detail)
+            self._wakeup.set()
+            return
+        with self._queue.mutex:
+            pending = self._queue.queue
+            if len(pending) >= self.max_pending:
+                # server not reachable for too long, make room for the new report: the oldest report is dropped,
+                # the flush markers are kept
+                for i, item in enumerate(pending):
+                    if isinstance(item, tuple):
+                        del pending[i]
+                        self.dropped += 1
+                        break
+        self._queue.put((file_detail, payload))
+
+    def flush(self, timeout=None):
+        """Sends the reports queued so far without waiting for the coalesce delay.
+        Returns True if they were delivered within timeout seconds, False if some of them were not delivered
+        in time or were dropped (when some reports are dropped meanwhile, even if they were newer)"""
+        if self.outbox is not None:
+            dropped = self.outbox.dropped
+            with self._drained:
+                self._flushing = True
+                self._wakeup.set()
+                flushed = self._drained.wait_for(lambda: not len(self.outbox), timeout)
+                self._flushing = False
+                return flushed and self.outbox.dropped == dropped
+        marker = FlushMarker(self.dropped)
+        self._queue.put(marker)
+        return marker.wait(timeout) and marker.delivered
+
+    def close(self, timeout=None):
+        """Sends the pending reports, stops the background thread and closes the session"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(self._stop)
+        self._wakeup.set()
+        self._worker.join(timeout)
+        self.session.close()
+        if self.outbox is not None:
+            self.outbox.close()
+
+    def _next(self, deadline):
+        """Next item of the queue, None if nothing arrived before deadline"""
+        try:
+            return self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+        except queue.Empty:
+            return None
+
+    def _run(self):
+        running = True
+        failures = 0
+        waiting = []  # flush markers queued after reports not yet delivered
+        while running:
+            batch = []
+            markers = []
+
+            if self._unsent:
+                # the server was not reachable: the failed reports are sent again first, after a backoff
+                # in which the new reports are collected
+                while self._unsent and len(batch) < self.batch_size:
+                    batch.append(self._unsent.popleft())
+                deadline = time.monotonic() + min(max_outage_backoff, self.backoff * 2 ** failures)
+                item = self._next(deadline)
+            else:
+                # wait for the first report, then coalesce the ones arriving within the delay
+                item = self._queue.get()
+                deadline = time.monotonic() + self.delay
+            while item is not None:
+                if item is self._stop:
+                    running = False
+                    break
+                elif isinstance(item, FlushMarker):
+                    markers.append(item)
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                item = self._next(deadline)
+
+            failures = 0 if self._send_batch(batch) else failures + 1
+            waiting.extend(markers)
+            if not self._unsent or not running:
+                self._release(waiting)
+                waiting = []
+        if self._unsent:
+            print("{} reports not sent, the server is not reachable".format(len(self._unsent)))
+
+    def _release(self, markers):
+        """Wakes up the flushes waiting for the reports sent so far"""
+        for marker in markers:
+            marker.delivered = not self._unsent and self.dropped == marker.dropped
+            marker.set()
+
+    def _send_batch(self, batch):
+        """Sends the batch with one bulk request for each endpoint, returns False if some reports were not
+        delivered: they are kept to be sent again, up to max_pending"""
+        payloads = {}
+        for file_detail, payload in batch:
+            payloads.setdefault(file_detail, []).append(payload)
+
+        undelivered = []
+        for file_detail, reports in payloads.items():
+            if self.post(reports, file_detail):
+                self.sent += len(reports)
+            else:
+                self.failed += len(reports)
+                undelivered.extend((file_detail, payload) for payload in reports)
+
+        # back at the front, before the reports not yet attempted
+        self._unsent.extendleft(reversed(undelivered))
+        while len(self._unsent) > self.max_pending:
+            self._unsent.popleft()
+            self.dropped += 1
+        return not undelivered
+
+    def _drain_outbox(self):
+        failures = 0
+        while True:
+            stopping = self._closed
+            self._wakeup.clear()
+            entries = self.outbox.peek(self.batch_size)
+
+            if not entries:
+                self.outbox.compact()
+                with self._drained:
+                    self._drained.notify_all()
+                if stopping:
+                    return
+                self._wakeup.wait()
+                # give the monitoring loops the time to submit more reports
+                if not (self._closed or self._flushing):
+                    time.sleep(self.delay)
+                continue
+
+            # payloads are stored already encoded, the JSON body of the full reports is built without decoding them
+            binary = self.binary_supported()
+            payloads = {}
+            for report_id, file_detail, payload in entries:
+                ids, encoded = payloads.setdefault(file_detail, ([], []))
+                ids.append(report_id)
+                encoded.append(payload)
+
+            undelivered = 0
+            for file_detail, (ids, encoded) in payloads.items():
+                if binary or file_detail == file_suffix[0]:
+                    delivered = self.post([json.loads(payload) for payload in encoded], file_detail)
+                else:
+                    delivered = self.post_encoded('[' + ','.join(encoded) + ']', len(ids), file_detail)
+                if delivered:
+                    self.outbox.ack(ids)
+                    self.sent += len(ids)
+                else:
+                    undelivered += len(ids)
+
+            if not undelivered:
+                failures = 0
+                continue
+
+            # the server is not reachable: the reports stay in the outbox until the next attempt
+            failures += 1
+            self.failed += undelivered
+            if stopping:
+                return
+            self._wakeup.wait(min(max_outage_backoff, self.backoff * 2 ** failures))
+
+    def binary_supported(self):
+        """Asks the server which versions of the wire format it accepts, once per session.
+        Servers without the wire_formats endpoint get JSON, network errors are retried at the next batch"""
+        if self.wire_version is None:
+            try:
+                r = self.session.get(url=self.root_url + 'wire_formats', timeout=request_timeout)
+            except requests.RequestException:
+                return False
+            try:
+                versions = r.json().get('versions', []) if r.ok else []
+            except ValueError:
+                versions = []
+            self.wire_version = wire_format.version if wire_format.version in versions else 0
+            print("Wire format: {}".format('binary v{}'.format(self.wire_version) if self.wire_version else 'JSON'))
+        return self.wire_version == wire_format.version
+
+    def register_plants(self, bim_ids):
+        """Sends the registered plants not yet known by the server (or changed since) to the plants endpoint"""
+        changed = {}
+        for bim_id in set(bim_ids):
+            fields = self.registry.get(bim_id)
+            if fields is not None and self.wire_encoder.known_plants.get(bim_id) != fields:
+                changed[bim_id] = dict(fields)
+        plants = [dict(fields, BIM_id=bim_id) for bim_id, fields in changed.items()]
+        if not plants or not self.plants_endpoint:
+            return
+        try:
+            r = self.session.post(url=self.root_url + plants_endpoint, data=json.dumps(plants, default=str),
+                                  headers={'Content-Type': 'application/json'}, timeout=request_timeout)
+        except requests.RequestException as e:
+            print("Unable to register {} plants: {}".format(len(plants), e))
+            return
+        if r.status_code in (404, 405):
+            print("No plants endpoint, the plant fields are sent with the short reports")
+            self.plants_endpoint = False
+        elif r.ok:
+            self.wire_encoder.confirm(changed)
+
+    def post(self, reports, file_detail):
+        """Sends a list of reports to the endpoint with bounded retries, returns True on success"""
+        r = None
+        binary = self.binary_supported()
+        if binary:
+            body, plants = self.wire_encoder.encode(reports, file_detail)
+            try:
+                r = self.post_encoded(body, len(reports), file_detail, content_type=wire_format.content_type)
+                if r:
+                    self.wire_encoder.confirm(plants)
+            except WireFormatRejected:
+                self.wire_version = 0
+                binary = False
+
+        if not binary:
+            if file_detail == file_suffix[0]:
+                self.register_plants(report['BIM_id'] for report in reports)
+                if not self.plants_endpoint:
+                    reports = [dict(self.registry.get(report['BIM_id'], {}), **report) for report in reports]
+            r = self.post_encoded(json.dumps(reports, default=str), len(reports), file_detail)
+
+        if r and file_detail == file_suffix[0]:
+            self._check_plants(r)
+        return bool(r)
+
+    def _check_plants(self, r):
+        """The server stored the short reports, but has no record of some of their plants
+        (e.g. a new database): they are registered again"""
+        try:
+            unknown = r.json().get('unknown_plants')
+        except (ValueError, AttributeError):
+            return
+        if unknown:
+            self.wire_encoder.forget(unknown)
+            self.register_plants(unknown)
+
+    def post_encoded(self, body, count, file_detail, content_type='application/json'):
+        """Sends an encoded list of count reports to the endpoint with bounded retries.
+        Returns the response, None if the reports were not delivered.
+        Raises WireFormatRejected if the server does not support the version of a binary body"""
+        url = self.root_url + endpoints[file_detail]
+
+        for attempt in range(self.retries + 1):
+            try:
+                r = self.session.post(url=url, data=body, headers={'Content-Type': content_type},
+                                      timeout=request_timeout)
+                if r.status_code == 415 and content_type == wire_format.content_type:
+                    raise WireFormatRejected(r.status_code)
+                r.raise_for_status()
+                return r
+            except requests.RequestException as e:
+                if attempt == self.retries:
+                    print("Unable to send {} {} reports to {}: {}".format(count, file_detail, url, e))
+                else:
+                    time.sleep(self.backoff * 2 ** attempt)
+        return None
+
+
+_uploader = None
+
+
+def get_uploader():
+    """Returns the uploader shared by the monitoring sessions of this process"""
+    global _uploader
+    if _uploader is None:
+        _uploader = ReportUploader(outbox=ReportOutbox() if use_outbox else None)
+        atexit.register(_uploader.close)
+    return _uploader
+
+
+def set_uploader(uploader):
+    """Replaces the shared uploader (e.g. to post to a test server), returns the previous one"""
+    global _uploader
+    previous, _uploader = _uploader, uploader
+    return previous
+
+
+def upload_log_to_server(payload, file_detail):
+    """Queues the report for the background uploader"""
+    get_uploader().submit(payload=payload, file_detail=file_detail)
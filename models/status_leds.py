@@ -0,0 +1,135 @@
+import threading
+import time
+
+from timer_wheel import TimerWheel
+
+# resolution (in seconds) of the blink patterns
+blink_tick = 0.01
+
+# colors of the status lights, as passed to the light outputs of MonitoringCore
+status_colors = ['R', 'Y', 'G']
+
+
+class LEDController(object):
+    """Output LEDs of a board, by name: a pin is written only when its level actually changes.
+    Blinking LEDs are driven by periodic timers of a single timer wheel and thread, shared by all the
+    LEDs (e.g. the status lights of many plants), instead of a sleeping thread per LED.
+    output is called with the pin and its level (True -> ON), e.g. RPi.GPIO.output"""
+
+    def __init__(self, output, tick=blink_tick, clock=time.monotonic):
+        self.output = output
+        self.clock = clock
+        self.writes = 0
+        self.skipped = 0  # writes of a level the pin already had
+
+        self._pins = {}
+        self._levels = {}
+        self._blinks = {}  # name -> timers of the ON and OFF edges
+        self._wheel = TimerWheel(tick=tick, clock=clock)
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._worker = None
+
+    def add(self, name, pin, level=False):
+        """Adds an LED on pin, written with its initial level"""
+        with self._condition:
+            self._pins[name] = pin
+            self._levels.pop(name, None)
+            self._write(name, level)
+
+    def level(self, name):
+        return self._levels.get(name, False)
+
+    def levels(self):
+        with self._condition:
+            return dict(self._levels)
+
+    def _write(self, name, level):
+        if self._levels.get(name) == level:
+            self.skipped += 1
+            return
+        self.output(self._pins[name], level)
+        self._levels[name] = level
+        self.writes += 1
+
+    def _stop_blink(self, name):
+        for timer in self._blinks.pop(name, ()):
+            timer.cancel()
+
+    def set(self, name, on):
+        """Turns an LED steadily ON or OFF, stopping its blink pattern"""
+        with self._condition:
+            self._stop_blink(name)
+            self._write(name, bool(on))
+
+    def set_many(self, levels):
+        """Sets several LEDs (dict name -> ON) at once"""
+        with self._condition:
+            for name, on in levels.items():
+                self._stop_blink(name)
+                self._write(name, bool(on))
+
+    def blink(self, name, on_time, off_time=None):
+        """Blinks an LED, on_time seconds ON and off_time (default on_time) OFF, until it is set.
+        The edges are periodic timers, so the pattern does not drift"""
+        off_time = on_time if off_time is None else off_time
+        with self._condition:
+            self._stop_blink(name)
+            self._write(name, True)
+            period = on_time + off_time
+            self._blinks[name] = [self._wheel.schedule(period, lambda: self._write(name, True), period=period),
+                                  self._wheel.schedule(on_time, lambda: self._write(name, False), period=period)]
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name='led-blink', daemon=True)
+                self._worker.start()
+            self._condition.notify_all()
+
+    def blinking(self, name):
+        return name in self._blinks
+
+    def _run(self):
+        with self._condition:
+            while not self._stopped:
+                if not self._blinks:
+                    self._condition.wait()
+                    continue
+                self._wheel.advance()
+                self._condition.wait(max(0.0, self._wheel.next_tick_time() - self.clock()))
+
+    def close(self):
+        """Stops the blink thread and switches off all the LEDs"""
+        with self._condition:
+            self._stopped = True
+            for name in list(self._pins):
+                self._stop_blink(name)
+                self._write(name, False)
+            self._condition.notify_all()
+        if self._worker is not None:
+            self._worker.join()
+
+
+class StatusLights(object):
+    """Light output of a plant (see MonitoringCore) on its red, yellow and green LEDs of a LEDController:
+    turns on the LED of the color and off the others, only when the color changes.
+    Colors in blink (color -> (on_time, off_time)) blink instead of staying ON"""
+
+    def __init__(self, controller, leds, blink=None):
+        self.controller = controller
+        self.leds = leds  # color -> name of the LED in the controller
+        self.blink = blink if blink is not None else {}
+        self.color = None
+
+    def __call__(self, color):
+        color = color.upper()
+        if color == self.color:
+            return
+        self.color = color
+        self.controller.set_many({led: False for led_color, led in self.leds.items() if led_color != color})
+        if color in self.blink:
+            self.controller.blink(self.leds[color], *self.blink[color])
+        else:
+            self.controller.set(self.leds[color], True)
+
+    def off(self):
+        self.color = None
+        self.controller.set_many({led: False for led in self.leds.values()})
@@ -0,0 +1,97 @@
+urgency_labels = ['safe', 'warning']
+
+# classification of a sample: inside the safe band, inside the warning band, out of both
+SAFE = 0
+WARNING = 1
+FAIL = 2
+classification_labels = ['safe', 'warning', 'fail']
+
+
+class ThresholdTable(object):
+    """Bounds of the allowed ranges of every (phase, urgency, param), compiled once from the expected
+    values and the tolerances of a flowchart.
+    lower and upper are contiguous arrays indexed by [phase, urgency, param], with phases in the order
+    of expected_values and params in the order of params; a value is in range if lower < value < upper.
+    The single sample checks use the same bounds as plain floats, so they need no dict lookups and no NumPy,
+    which is imported with the first access to the arrays"""
+
+    def __init__(self, expected_values, tolerances, params=('moisture', 'temperature', 'pressure')):
+        self.params = list(params)
+        self.phases = list(expected_values[self.params[0]])
+        self.phase_indexes = {phase: i for i, phase in enumerate(self.phases)}
+
+        # nested lists [phase][urgency][param] of the bounds
+        self._lower = [[[float(expected_values[param][phase]) - tolerances[param][urgency] for param in self.params]
+                        for urgency in urgency_labels] for phase in self.phases]
+        self._upper = [[[float(expected_values[param][phase]) + tolerances[param][urgency] for param in self.params]
+                        for urgency in urgency_labels] for phase in self.phases]
+        self._arrays = None
+
+        # (param, lower, upper) of every (phase, urgency)
+        self._bounds = {(phase, urgency): [(param, self._lower[i][j][k], self._upper[i][j][k])
+                                           for k, param in enumerate(self.params)]
+                        for i, phase in enumerate(self.phases)
+                        for j, urgency in enumerate(urgency_labels)}
+
+    def _compile(self):
+        if self._arrays is None:
+            import numpy as np
+
+            self._arrays = (np.array(self._lower, dtype=np.float64), np.array(self._upper, dtype=np.float64))
+        return self._arrays
+
+    @property
+    def lower(self):
+        return self._compile()[0]
+
+    @property
+    def upper(self):
+        return self._compile()[1]
+
+    def check(self, current_params, phase, urgency_label):
+        """Checks if every parameter of a sample (a dict) is in the range of the phase and urgency"""
+        for param, lower, upper in self._bounds[(phase, urgency_label)]:
+            if not lower < current_params[param] < upper:
+                return False
+        return True
+
+    def edges(self, phase):
+        """Edges of the bands of every param in a phase, dict param -> (warning lower, safe lower, safe upper,
+        warning upper)"""
+        lower = self._lower[self.phase_indexes[phase]]
+        upper = self._upper[self.phase_indexes[phase]]
+        return {param: (lower[1][k], lower[0][k], upper[0][k], upper[1][k]) for k, param in enumerate(self.params)}
+
+    def classify(self, current_params, phase):
+        """Classifies a sample (a dict) as SAFE, WARNING or FAIL"""
+        if self.check(current_params, phase, 'safe'):
+            return SAFE
+        if self.check(current_params, phase, 'warning'):
+            return WARNING
+        return FAIL
+
+    def classify_batch(self, values, phases):
+        """Classifies many samples at once, e.g. a batch of readings or the last sample of many plants.
+        values is an (n, params) array with the columns in the order of params, phases is a phase name
+        or an array of n phase indexes.
+        Returns an int8 array of SAFE, WARNING or FAIL
+        :rtype: numpy.ndarray
+        """
+        import numpy as np
+
+        lower_bounds, upper_bounds = self._compile()
+        values = np.asarray(values, dtype=np.float64)
+        if isinstance(phases, str):
+            lower = lower_bounds[self.phase_indexes[phases]]
+            upper = upper_bounds[self.phase_indexes[phases]]
+        else:
+            phases = np.asarray(phases)
+            lower = lower_bounds[phases]
+            upper = upper_bounds[phases]
+        # (n, 1, params) against (urgencies, params) or (n, urgencies, params)
+        in_range = ((values[:, None, :] > lower) & (values[:, None, :] < upper)).all(axis=2)
+
+        codes = np.full(len(values), FAIL, dtype=np.int8)
+        codes[in_range[:, 1]] = WARNING
+        codes[in_range[:, 0]] = SAFE
+        return codes
@@ -0,0 +1,141 @@
+import time
+
+# resolution (in seconds) of the timer wheel
+default_tick = 0.1
+
+# what a periodic timer does when its deadlines were missed (e.g. slow sensor reads):
+# skip -> fires once and keeps the original grid of deadlines, skipping the missed ones
+# burst -> fires once for every missed deadline, one per tick
+# delay -> fires once and restarts the period from now
+catch_up_policies = ['skip', 'burst', 'delay']
+
+
+class Timer(object):
+    """Deadline on the monotonic clock, optionally repeated every period seconds.
+    Periodic deadlines are computed from the previous deadline and not from the time the timer
+    actually fired, so they do not drift with the time spent by the callbacks"""
+
+    __slots__ = ('deadline', 'period', 'callback', 'catch_up', 'cancelled', 'missed')
+
+    def __init__(self, deadline, callback, period=None, catch_up='skip'):
+        if catch_up not in catch_up_policies:
+            raise ValueError('Unknown catch up policy: {}'.format(catch_up))
+        self.deadline = deadline
+        self.period = period
+        self.callback = callback
+        self.catch_up = catch_up
+        self.cancelled = False
+        self.missed = 0  # deadlines skipped by the 'skip' policy
+
+    @classmethod
+    def periodic(cls, period, catch_up='skip'):
+        """Periodic timer to be polled, without a wheel, whose first deadline is one period from now
+        :rtype: Timer
+        """
+        return cls(time.monotonic() + period, callback=None, period=period, catch_up=catch_up)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def reschedule(self, now):
+        """Moves a periodic timer to its next deadline, returns False for one-shot timers"""
+        if self.period is None:
+            return False
+        if self.period <= 0:
+            self.deadline = now
+            return True
+
+        deadline = self.deadline + self.period
+        if deadline <= now:
+            if self.catch_up == 'skip':
+                missed = int((now - deadline) // self.period) + 1
+                deadline += missed * self.period
+                self.missed += missed
+            elif self.catch_up == 'delay':
+                deadline = now + self.period
+            # burst: the deadline stays in the past and the timer fires again at the next tick
+        self.deadline = deadline
+        return True
+
+    def poll(self, now=None):
+        """Checks a timer that is not registered in a wheel: returns True if it expired,
+        moving it to its next deadline"""
+        if now is None:
+            now = time.monotonic()
+        if self.cancelled or now < self.deadline:
+            return False
+        if not self.reschedule(now):
+            self.cancelled = True
+        return True
+
+    def wait(self):
+        """Sleeps until the timer expires and moves it to its next deadline"""
+        delay = self.deadline - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.poll()
+
+
+class TimerWheel(object):
+    """Hashed timer wheel on the monotonic clock: timers are stored in one bucket per tick,
+    so scheduling a timer and advancing the wheel by one tick cost O(1) regardless of the number
+    of timers, and only the expired ones are visited.
+    Cancelled timers are removed lazily, when their bucket is reached"""
+
+    def __init__(self, tick=default_tick, clock=time.monotonic):
+        self.tick = tick
+        self.clock = clock
+        self.current = int(clock() // tick)  # last tick processed
+        self._buckets = {}
+
+    def __len__(self):
+        return sum(len(timers) for timers in self._buckets.values())
+
+    def _insert(self, timer):
+        # expired timers go to the next tick, so that they never fire twice in the same advance
+        index = max(int(timer.deadline // self.tick), self.current + 1)
+        try:
+            self._buckets[index].append(timer)
+        except KeyError:
+            self._buckets[index] = [timer]
+
+    def schedule(self, delay, callback, period=None, catch_up='skip'):
+        """Calls callback() after delay seconds and then, if period is given, every period seconds
+        :rtype: Timer
+        """
+        timer = Timer(self.clock() + delay, callback, period=period, catch_up=catch_up)
+        self._insert(timer)
+        return timer
+
+    def next_tick_time(self):
+        """Monotonic time of the next tick"""
+        return (self.current + 1) * self.tick
+
+    def advance(self, now=None):
+        """Fires the timers expired up to now, returns how many were fired"""
+        if now is None:
+            now = self.clock()
+        target = int(now // self.tick)
+        if target <= self.current:
+            return 0
+
+        if target - self.current > len(self._buckets):
+            # long idle period: visit only the buckets with timers
+            indexes = sorted(index for index in self._buckets if index <= target)
+        else:
+            indexes = range(self.current + 1, target + 1)
+        self.current = target
+
+        fired = 0
+        for index in indexes:
+            timers = self._buckets.pop(index, None)
+            if not timers:
+                continue
+            for timer in timers:
+                if timer.cancelled:
+                    continue
+                timer.callback()
+                fired += 1
+                if not timer.cancelled and timer.reschedule(now):
+                    self._insert(timer)
+        return fired
@@ -0,0 +1,348 @@
+import datetime
+import os
+import struct
+from collections import OrderedDict
+from urllib.parse import quote, unquote
+
+import numpy as np
+
+from log_processing import RunningStats, process_params, to_microseconds
+
+default_store_path = 'timeseries'
+
+# resolutions of the stored series (in seconds): the raw readings and their rollups
+resolutions = OrderedDict([('raw', 0), ('1min', 60), ('15min', 15 * 60), ('1h', 60 * 60)])
+
+# time span (in seconds) of each chunk file: readings are only appended to the last chunk,
+# and whole chunks are deleted when they are older than the retention
+chunk_spans = {'raw': 24 * 60 * 60,  # 1 day
+               '1min': 7 * 24 * 60 * 60,  # 1 week
+               '15min': 91 * 24 * 60 * 60,  # ~3 months
+               '1h': 365 * 24 * 60 * 60}  # 1 year
+
+# how long (in seconds) each resolution is kept, None -> forever
+default_retention = {'raw': 30 * 24 * 60 * 60,  # 30 days
+                     '1min': 365 * 24 * 60 * 60,  # 1 year
+                     '15min': None,
+                     '1h': None}
+
+# records buffered in memory before being written to the chunk file
+write_buffer_records = 256
+
+# points returned by the queries with resolution='auto'
+default_max_points = 2000
+
+# fixed-size little-endian records, timestamps in microseconds from log_processing.timestamp_epoch
+stat_names = ['mean', 'min', 'max']
+raw_dtype = np.dtype([('timestamp', '<i8')] + [(param, '<f4') for param in process_params])
+rollup_dtype = np.dtype([('timestamp', '<i8'), ('count', '<u4')] +
+                        [(param + '_' + stat, '<f4') for param in process_params for stat in stat_names])
+record_structs = {'raw': struct.Struct('<q' + 'f' * len(process_params)),
+                  'rollup': struct.Struct('<qI' + 'f' * len(process_params) * len(stat_names))}
+
+
+class ChunkedLevel(object):
+    """One resolution of a series: fixed-size records appended to a chunk file per time span.
+    Records are written in timestamp order, so a range is found with a binary search of the
+    memory-mapped chunks, without reading them"""
+
+    def __init__(self, path, dtype, record_struct, span, retention):
+        self.path = path
+        self.dtype = dtype
+        self.record_struct = record_struct
+        self.span_us = span * 1000000
+        self.retention_us = retention * 1000000 if retention is not None else None
+
+        os.makedirs(path, exist_ok=True)
+        self.chunks = sorted(int(name[:-4]) for name in os.listdir(path) if name.endswith('.bin'))
+        self._maps = {}  # chunk -> memmap of the chunks that are not written anymore
+        self._buffer = bytearray()
+        self._buffered = 0
+        self._file = None
+        self.current_chunk = None
+
+    def _chunk_path(self, chunk):
+        return os.path.join(self.path, '{}.bin'.format(chunk))
+
+    def append(self, timestamp, values):
+        chunk = timestamp // self.span_us
+        if chunk != self.current_chunk:
+            self._open_chunk(chunk)
+        self._buffer += self.record_struct.pack(timestamp, *values)
+        self._buffered += 1
+        if self._buffered >= write_buffer_records:
+            self.flush()
+
+    def _open_chunk(self, chunk):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+        path = self._chunk_path(chunk)
+        if chunk in self.chunks:
+            # drops the partial record left by an interrupted write
+            size = os.path.getsize(path)
+            if size % self.dtype.itemsize:
+                os.truncate(path, size - size % self.dtype.itemsize)
+        else:
+            self.chunks.append(chunk)
+        self._maps.pop(chunk, None)
+        self._file = open(path, 'ab')
+        self.current_chunk = chunk
+
+    def flush(self):
+        if self._buffered:
+            self._file.write(self._buffer)
+            self._file.flush()
+            self._buffer = bytearray()
+            self._buffered = 0
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self.current_chunk = None
+        self._maps.clear()
+
+    def _map(self, chunk):
+        records = self._maps.get(chunk)
+        if records is None:
+            path = self._chunk_path(chunk)
+            count = os.path.getsize(path) // self.dtype.itemsize
+            if not count:
+                return np.empty(0, dtype=self.dtype)
+            records = np.memmap(path, dtype=self.dtype, mode='r', shape=(count,))
+            if chunk != self.current_chunk:
+                self._maps[chunk] = records
+        return records
+
+    def _slices(self, start, end):
+        """(records, first, last) of the chunks with records in the range"""
+        self.flush()
+        for chunk in self.chunks:
+            if (chunk + 1) * self.span_us <= start or chunk * self.span_us >= end:
+                continue
+            records = self._map(chunk)
+            timestamps = records['timestamp']
+            yield records, np.searchsorted(timestamps, start), np.searchsorted(timestamps, end)
+
+    def read(self, start, end):
+        """Records with start <= timestamp < end (in microseconds), as a structured array"""
+        parts = [records[first:last] for records, first, last in self._slices(start, end)]
+        if not parts:
+            return np.empty(0, dtype=self.dtype)
+        return np.concatenate(parts)
+
+    def count(self, start, end):
+        """Number of records with start <= timestamp < end, without reading them"""
+        return sum(int(last - first) for records, first, last in self._slices(start, end))
+
+    def last_timestamp(self):
+        self.flush()
+        for chunk in reversed(self.chunks):
+            records = self._map(chunk)
+            if len(records):
+                return int(records['timestamp'][-1])
+        return None
+
+    def enforce_retention(self, now):
+        """Deletes the chunks older than the retention, returns how many were deleted"""
+        if self.retention_us is None:
+            return 0
+        expired = [chunk for chunk in self.chunks
+                   if (chunk + 1) * self.span_us <= now - self.retention_us and chunk != self.current_chunk]
+        for chunk in expired:
+            self._maps.pop(chunk, None)
+            os.remove(self._chunk_path(chunk))
+            self.chunks.remove(chunk)
+        return len(expired)
+
+    def size(self):
+        """Size (in bytes) of the chunk files"""
+        return sum(os.path.getsize(self._chunk_path(chunk)) for chunk in self.chunks) + len(self._buffer)
+
+
+class Rollup(object):
+    """Statistics of the raw readings in the current bucket of a rollup resolution"""
+
+    __slots__ = ('bucket', 'stats')
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.stats = [RunningStats() for _ in process_params]
+
+    def add(self, values):
+        for stats, value in zip(self.stats, values):
+            stats.add(value)
+
+    def record(self, resolution_us):
+        values = []
+        for stats in self.stats:
+            values.extend([stats.mean, stats.min, stats.max])
+        return self.bucket * resolution_us, self.stats[0].count, values
+
+
+class TimeSeries(object):
+    """Raw readings of a plant and their rollups, each level in its own directory.
+    The rollups are updated while the readings are appended; a bucket is written when the first
+    reading of the next bucket arrives, and the bucket that was open when the store was closed is
+    rebuilt from the raw readings when the series is opened again"""
+
+    def __init__(self, path, retention=None):
+        retention = dict(default_retention, **(retention or {}))
+        self.path = path
+        self.levels = OrderedDict()
+        for name, resolution in resolutions.items():
+            self.levels[name] = ChunkedLevel(os.path.join(path, name),
+                                             dtype=raw_dtype if resolution == 0 else rollup_dtype,
+                                             record_struct=record_structs['raw' if resolution == 0 else 'rollup'],
+                                             span=chunk_spans[name], retention=retention[name])
+        self.rollups = {name: None for name, resolution in resolutions.items() if resolution}
+        self.last_timestamp = self.levels['raw'].last_timestamp()
+        self.out_of_order = 0
+        self._recover_rollups()
+
+    def _recover_rollups(self):
+        for name in self.rollups:
+            resolution_us = resolutions[name] * 1000000
+            last = self.levels[name].last_timestamp()
+            start = last + resolution_us if last is not None else 0
+            for record in self.levels['raw'].read(start, 2 ** 63 - 1).tolist():
+                self._add_to_rollup(name, record[0], record[1:])
+
+    def _add_to_rollup(self, name, timestamp, values):
+        resolution_us = resolutions[name] * 1000000
+        bucket = timestamp // resolution_us
+        rollup = self.rollups[name]
+        if rollup is None or rollup.bucket != bucket:
+            if rollup is not None:
+                timestamp_bucket, count, stats = rollup.record(resolution_us)
+                self.levels[name].append(timestamp_bucket, (count,) + tuple(stats))
+            rollup = self.rollups[name] = Rollup(bucket)
+        rollup.add(values)
+
+    def append(self, timestamp, values):
+        """Appends a reading (timestamp in microseconds, values in the order of process_params).
+        Readings older than the last one (e.g. after a clock adjustment) are dropped"""
+        if self.last_timestamp is not None and timestamp < self.last_timestamp:
+            self.out_of_order += 1
+            return
+        raw = self.levels['raw']
+        new_chunk = timestamp // raw.span_us != raw.current_chunk
+        raw.append(timestamp, values)
+        for name in self.rollups:
+            self._add_to_rollup(name, timestamp, values)
+        self.last_timestamp = timestamp
+        if new_chunk:
+            self.enforce_retention(timestamp)
+
+    def query(self, start, end, resolution='raw', max_points=default_max_points):
+        """Readings (raw_dtype) or rollup buckets (rollup_dtype) with start <= timestamp < end, in microseconds.
+        With resolution='auto' the finest resolution with at most max_points points in the range is used.
+        The rollup bucket that is still open is returned with the statistics of the readings so far
+        :rtype: numpy.ndarray
+        """
+        if resolution == 'auto':
+            resolution = self.auto_resolution(start, end, max_points)
+        records = self.levels[resolution].read(start, end)
+        rollup = self.rollups.get(resolution)
+        if rollup is not None:
+            timestamp, count, stats = rollup.record(resolutions[resolution] * 1000000)
+            if start <= timestamp < end:
+                current = np.array([(timestamp, count) + tuple(stats)], dtype=rollup_dtype)
+                records = np.concatenate([records, current])
+        return records
+
+    def auto_resolution(self, start, end, max_points):
+        for name, resolution in resolutions.items():
+            if resolution == 0:
+                if self.levels[name].count(start, end) <= max_points:
+                    return name
+            elif (end - start) // (resolution * 1000000) <= max_points:
+                return name
+        return next(reversed(resolutions))
+
+    def enforce_retention(self, now):
+        return sum(level.enforce_retention(now) for level in self.levels.values())
+
+    def flush(self):
+        for level in self.levels.values():
+            level.flush()
+
+    def close(self):
+        for level in self.levels.values():
+            level.close()
+
+    def size(self):
+        return sum(level.size() for level in self.levels.values())
+
+
+class TimeSeriesStore(object):
+    """Embedded time series store of the readings of the monitored plants, one series per BIM_id.
+    Every series keeps the raw readings and their 1 min/15 min/1 h rollups in chunk files under path;
+    the retention of each resolution bounds the space used on the SD card"""
+
+    def __init__(self, path=default_store_path, retention=None):
+        self.path = path
+        self.retention = retention
+        self._series = {}
+
+    def series(self, bim_id):
+        """Series of the plant, opened on first use
+        :rtype: TimeSeries
+        """
+        series = self._series.get(bim_id)
+        if series is None:
+            series = self._series[bim_id] = TimeSeries(os.path.join(self.path, quote(str(bim_id), safe='')),
+                                                       retention=self.retention)
+        return series
+
+    def bim_ids(self):
+        """BIM_id of the stored series"""
+        if not os.path.isdir(self.path):
+            return []
+        return [unquote(name) for name in sorted(os.listdir(self.path))]
+
+    def append(self, bim_id, timestamp, moisture, temperature, pressure):
+        """Stores a reading of the plant, timestamp is a datetime"""
+        values = {'moisture': moisture, 'temperature': temperature, 'pressure': pressure}
+        self.series(bim_id).append(to_microseconds(timestamp), [values[param] for param in process_params])
+
+    def query(self, bim_id, start, end, resolution='raw', max_points=default_max_points):
+        """Readings of the plant between start and end (datetimes or microseconds), see TimeSeries.query
+        :rtype: numpy.ndarray
+        """
+        if isinstance(start, datetime.datetime):
+            start = to_microseconds(start)
+        if isinstance(end, datetime.datetime):
+            end = to_microseconds(end)
+        return self.series(bim_id).query(start, end, resolution=resolution, max_points=max_points)
+
+    def report_readings(self, report):
+        """Raw readings of the window of a full report, e.g. of a window flagged 'Bad' (within the raw retention),
+        after its begin_timestamp (the end of the previous window) up to its end_timestamp included
+        (datetimes or ISO strings, as sent to the server)
+        :rtype: numpy.ndarray
+        """
+        start, end = [to_microseconds(timestamp if isinstance(timestamp, datetime.datetime) else
+                                      datetime.datetime.fromisoformat(timestamp))
+                      for timestamp in (report['begin_timestamp'], report['end_timestamp'])]
+        return self.query(report['BIM_id'], start + 1, end + 1)
+
+    def enforce_retention(self, now=None):
+        """Deletes the expired chunks of all the series, returns how many were deleted"""
+        now = to_microseconds(now if now is not None else datetime.datetime.now())
+        return sum(self.series(bim_id).enforce_retention(now) for bim_id in self.bim_ids())
+
+    def flush(self):
+        for series in self._series.values():
+            series.flush()
+
+    def close(self):
+        for series in self._series.values():
+            series.close()
+        self._series.clear()
+
+    def size(self):
+        """Size (in bytes) of the stored series"""
+        return sum(self.series(bim_id).size() for bim_id in self.bim_ids())
@@ -0,0 +1,206 @@
+"""
+Compact binary encoding of a batch of short or full reports (version 1, little endian):
+
+    header   3s magic, B version, B kind (0 short, 1 full), H strings, H plants, I reports
+    strings  H length + UTF-8 bytes, for every distinct string of the batch
+    plants   H BIM_id + H for every field of plant_fields (string indexes)
+    reports  short: H BIM_id, H phase, H status, q record_timestamp, f temperature, f moisture, f pressure
+             full:  H BIM_id, H phase, H status, q begin_timestamp, q end_timestamp, f temperature, ...
+
+Strings are sent once per batch and referenced by index (missing_index for None), timestamps are
+microseconds from 1970-01-01 (naive, as log_processing), readings are float32 rounded back to
+float_precision decimals when decoded.
+The short reports carry only the readings: the static fields of a plant are sent in the plants section
+the first time the plant appears in a session, and the server keeps them.
+The module is shared by the Pi and the server, as log_processing.
+"""
+import datetime
+import struct
+
+import log_processing
+from log_processing import file_suffix, float_precision, plant_fields
+
+version = 1
+supported_versions = [1]
+content_type = 'application/vnd.concrete-flowchart.reports'
+magic = b'CFR'
+
+missing_index = 0xFFFF
+missing_timestamp = -2 ** 63
+
+header_struct = struct.Struct('<3sBBHHI')
+length_struct = struct.Struct('<H')
+plant_struct = struct.Struct('<H' + 'H' * len(plant_fields))
+report_structs = {'short': struct.Struct('<HHHqfff'),
+                  'full': struct.Struct('<HHHqqfff')}
+timestamp_fields = {'short': ['record_timestamp'],
+                    'full': ['begin_timestamp', 'end_timestamp']}
+reading_fields = ['temperature', 'moisture', 'pressure']
+
+
+class UnsupportedVersionError(ValueError):
+    pass
+
+
+def to_microseconds(timestamp):
+    """log_processing.to_microseconds, also accepting ISO strings and None (missing_timestamp)"""
+    if timestamp is None:
+        return missing_timestamp
+    if not isinstance(timestamp, datetime.datetime):
+        timestamp = datetime.datetime.fromisoformat(str(timestamp))
+    return log_processing.to_microseconds(timestamp)
+
+
+def from_microseconds(microseconds):
+    if microseconds == missing_timestamp:
+        return None
+    return log_processing.from_microseconds(microseconds)
+
+
+class StringTable(object):
+    def __init__(self):
+        self.strings = []
+        self.indexes = {}
+
+    def index(self, value):
+        if value is None:
+            return missing_index
+        value = str(value)
+        index = self.indexes.get(value)
+        if index is None:
+            if len(self.strings) >= missing_index:
+                raise ValueError('too many distinct strings in a batch')
+            index = self.indexes[value] = len(self.strings)
+            self.strings.append(value)
+        return index
+
+
+def encode(reports, file_detail, plants=None):
+    """Encodes a list of reports of the same kind, plants is a dict BIM_id -> dict of plant_fields
+    to be sent with the batch
+    :rtype: bytes
+    """
+    strings = StringTable()
+    report_struct = report_structs[file_detail]
+    records = []
+    for report in reports:
+        nan = float('nan')
+        readings = [float(report[field]) if report.get(field) is not None else nan for field in reading_fields]
+        timestamps = [to_microseconds(report.get(field)) for field in timestamp_fields[file_detail]]
+        records.append(report_struct.pack(strings.index(report.get('BIM_id')), strings.index(report.get('phase')),
+                                          strings.index(report.get('status')), *(timestamps + readings)))
+
+    plant_records = [plant_struct.pack(strings.index(bim_id), *[strings.index(plant.get(field))
+                                                                 for field in plant_fields])
+                     for bim_id, plant in (plants or {}).items()]
+
+    parts = [header_struct.pack(magic, version, file_suffix.index(file_detail), len(strings.strings),
+                                len(plant_records), len(records))]
+    for string in strings.strings:
+        encoded = string.encode('utf-8')
+        parts.append(length_struct.pack(len(encoded)))
+        parts.append(encoded)
+    parts.extend(plant_records)
+    parts.extend(records)
+    return b''.join(parts)
+
+
+def decode(body):
+    """Decodes a batch, returns (file_detail, plants, reports): plants is a dict BIM_id -> dict of
+    plant_fields, reports a list of dicts without the plant fields.
+    Raises UnsupportedVersionError or ValueError if the body is not a valid batch"""
+    try:
+        body_magic, body_version, kind, n_strings, n_plants, n_reports = header_struct.unpack_from(body, 0)
+    except struct.error:
+        raise ValueError('truncated header')
+    if body_magic != magic:
+        raise ValueError('not a report batch')
+    if body_version not in supported_versions:
+        raise UnsupportedVersionError('unsupported version {}'.format(body_version))
+    if kind >= len(file_suffix):
+        raise ValueError('unknown report kind {}'.format(kind))
+    file_detail = file_suffix[kind]
+    report_struct = report_structs[file_detail]
+
+    try:
+        offset = header_struct.size
+        strings = []
+        for _ in range(n_strings):
+            length, = length_struct.unpack_from(body, offset)
+            offset += length_struct.size
+            strings.append(bytes(body[offset:offset + length]).decode('utf-8'))
+            offset += length
+        strings_or_none = dict(enumerate(strings))
+        strings_or_none[missing_index] = None
+
+        plants = {}
+        for _ in range(n_plants):
+            indexes = plant_struct.unpack_from(body, offset)
+            offset += plant_struct.size
+            plants[strings_or_none[indexes[0]]] = dict(zip(plant_fields, [strings_or_none[i] for i in indexes[1:]]))
+
+        expected_size = offset + n_reports * report_struct.size
+        if len(body) != expected_size:
+            raise ValueError('expected {} bytes, got {}'.format(expected_size, len(body)))
+
+        reports = []
+        timestamp_names = timestamp_fields[file_detail]
+        for values in report_struct.iter_unpack(memoryview(body)[offset:]):
+            report = {'BIM_id': strings_or_none[values[0]],
+                      'phase': strings_or_none[values[1]],
+                      'status': strings_or_none[values[2]]}
+            for field, value in zip(timestamp_names, values[3:3 + len(timestamp_names)]):
+                report[field] = from_microseconds(value)
+            for field, value in zip(reading_fields, values[3 + len(timestamp_names):]):
+                report[field] = round(value, float_precision) if value == value else None
+            reports.append(report)
+    except (struct.error, UnicodeDecodeError, KeyError) as e:
+        raise ValueError('malformed batch: {}'.format(e))
+    return file_detail, plants, reports
+
+
+class SessionEncoder(object):
+    """Encodes the batches of an uploader, sending the plant fields of the short reports
+    only when the server does not have them yet in this session: the first time each plant is seen,
+    and again when its fields changed (e.g. registered again with a new status).
+    plants maps a BIM_id to its plant fields (e.g. a PlantRegistry), the plants that are not in it
+    are taken from the reports that carry their fields"""
+
+    def __init__(self, plants=None):
+        self.plants = plants
+        self.known_plants = {}  # BIM_id -> plant fields confirmed by the server
+
+    def plant_fields(self, bim_id, report=None):
+        """Fields of a plant, from the registry or else from a report that carries them (None if unknown)
+        :rtype: dict
+        """
+        plant = None if self.plants is None else self.plants.get(bim_id)
+        if plant is None and report is not None and any(field in report for field in plant_fields):
+            # not registered, e.g. a report stored in the outbox with its plant fields
+            plant = report
+        return None if plant is None else {field: plant.get(field) for field in plant_fields}
+
+    def encode(self, reports, file_detail):
+        """Returns the body and the plants sent with it (BIM_id -> fields), to be passed to
+        confirm() once the server accepted the batch"""
+        plants = {}
+        if file_detail == file_suffix[0]:
+            checked = set()
+            for report in reports:
+                bim_id = report.get('BIM_id')
+                if bim_id in checked:
+                    continue
+                checked.add(bim_id)
+                fields = self.plant_fields(bim_id, report)
+                if fields is not None and self.known_plants.get(bim_id) != fields:
+                    plants[bim_id] = fields
+        return encode(reports, file_detail, plants=plants), plants
+
+    def confirm(self, plants):
+        """The server stored the plants, BIM_id -> fields"""
+        self.known_plants.update(plants)
+
+    def forget(self, bim_ids):
+        """The server does not know these plants (e.g. a new database): they are sent again"""
+        for bim_id in bim_ids:
+            self.known_plants.pop(bim_id, None)